@@ -0,0 +1,174 @@
+"""
+    Offline throughput benchmark of the download paths against the local mock server.
+
+    For every engine configuration it reports MB/s, time-to-first-byte and retry
+    overhead (extra requests and extra bytes the server had to send compared to a
+    clean single pass), so changes to the download code can be compared without
+    touching cambridge-mt.com.
+
+    Usage: python cmt-mtk/benchmarks/bench_downloads.py --latency 0.05 --bandwidth 10 --reset_rate 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import requests
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+for folder in ("common", "multitrack_scrapper", "forum_scrapper"):
+    sys.path.append(os.path.join(os.path.dirname(currentdir), folder))
+from mock_server import MockServer, ServerConfig
+
+import download_dataset
+import debug_script
+import dwnld_forum_mixes
+import mix_downloads
+
+
+def time_to_first_byte(url):
+    start = time.time()
+    with requests.get(url, stream=True, timeout=30) as response:
+        next(response.iter_content(chunk_size=1))
+        ttfb = time.time() - start
+        for _ in response.iter_content(chunk_size=1024 * 1024):
+            pass  # Drain, so the rest of the body isn't counted against the first benchmark
+    return ttfb
+
+
+def run_ranged(server, work_dir, num_parts, max_workers):
+    url = f"{server.url}/files/multitrack.zip"
+    download_dataset.download_file_with_progress(url, os.path.join(work_dir, "multitrack.zip"), num_parts=num_parts,
+                                                 max_workers=max_workers, show_progress=False)
+    return url
+
+
+def run_single_stream(server, work_dir):
+    url = f"{server.url}/files/multitrack.zip"
+    if not debug_script.download_file_with_progress(url, os.path.join(work_dir, "multitrack.zip"), retry_delay=0.1):
+        raise Exception("download failed")
+    return url
+
+
+def run_stream_extract(server, work_dir):
+    url = f"{server.url}/files/multitrack.zip"
+    if download_dataset.stream_download_and_extract(url, work_dir, show_progress=False) is None:
+        raise Exception("streaming extraction failed")
+    return url
+
+
+def run_process_song(server, work_dir):
+    url = f"{server.url}/files/multitrack.zip"
+    song_path = os.path.join(work_dir, "Song")
+    os.makedirs(song_path)
+    debug_script.metadata_dict["Song"] = (url, None)  # Excerpt only
+    failed = debug_script.process_song(song_path)
+    if failed["excerpt"]:
+        raise Exception("process_song failed")
+    return url
+
+
+def run_forum_mix(server, work_dir):
+    mix_downloads.FORUM_URL = server.url + "/"
+    thread = {"Thread Link": "showthread.php?tid=1", "Thread Author": "user1"}
+    dwnld_forum_mixes.download_audio_for_song("Song", {"threads": [thread]}, work_dir)
+    if not os.path.exists(os.path.join(work_dir, "Song", "user1.mp3")):
+        raise Exception("forum mix download failed")
+    return f"{server.url}/files/mix_1.mp3"
+
+
+ENGINES = {
+    "ranged 1x1": lambda server, work_dir: run_ranged(server, work_dir, 1, 1),
+    "ranged 4x1 (serial parts)": lambda server, work_dir: run_ranged(server, work_dir, 4, 1),
+    "ranged 4x4": lambda server, work_dir: run_ranged(server, work_dir, 4, 4),
+    "ranged 8x8": lambda server, work_dir: run_ranged(server, work_dir, 8, 8),
+    "debug_script single stream": run_single_stream,
+    "stream extract": run_stream_extract,
+    "debug_script.process_song": run_process_song,
+    "forum download_audio_file": run_forum_mix,
+}
+
+
+def benchmark(server, name, engine, repeats):
+    """Run one engine repeats times on a fresh directory and summarise the server side counters."""
+    results = []
+    for _ in range(repeats):
+        work_dir = tempfile.mkdtemp(prefix="cmt_bench_")
+        server.stats.reset()
+        start = time.time()
+        error = None
+        try:
+            url = engine(server, work_dir)
+        except Exception as e:
+            url, error = None, str(e)
+            print(f"{name} failed: {error}")
+        elapsed = time.time() - start
+        requests_made, bytes_sent = server.stats.requests, server.stats.bytes_sent
+        faults = server.stats.faults
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        size = len(server.static_file(*os.path.basename(url).rsplit(".", 1))) if url else 0
+        results.append({
+            "seconds": elapsed,
+            "mb_per_s": size / 1024 ** 2 / elapsed if size else 0.0,
+            "requests": requests_made,
+            "faults": faults,
+            "overhead_bytes": max(0, bytes_sent - size),
+            "error": error,
+        })
+
+    ok = [r for r in results if not r["error"]]
+    summary = {"engine": name, "runs": repeats, "failures": repeats - len(ok)}
+    for key in ("seconds", "mb_per_s", "requests", "faults", "overhead_bytes"):
+        summary[key] = sum(r[key] for r in ok) / len(ok) if ok else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the download engines against the local mock server.")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds before every response")
+    parser.add_argument("--bandwidth", type=float, default=None, help="MB/s per connection")
+    parser.add_argument("--reset_rate", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--truncate_rate", type=float, default=0.0)
+    parser.add_argument("--stems", type=int, default=8)
+    parser.add_argument("--stem_mb", type=float, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--engines", nargs="*", default=list(ENGINES), help="subset of: " + ", ".join(ENGINES))
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    config = ServerConfig(latency=args.latency,
+                          bandwidth=args.bandwidth * 1024 ** 2 if args.bandwidth else None,
+                          reset_rate=args.reset_rate, error_rate=args.error_rate, truncate_rate=args.truncate_rate,
+                          zip_stems=args.stems, stem_size=int(args.stem_mb * 1024 ** 2))
+    server = MockServer(config=config).start()
+    try:
+        zip_size = len(server.static_file("multitrack", "zip"))
+        print(f"Mock server on {server.url}, archive {zip_size / 1024 ** 2:.1f} MB")
+        ttfb = time_to_first_byte(f"{server.url}/files/multitrack.zip")
+
+        summaries = [benchmark(server, name, ENGINES[name], args.repeats) for name in args.engines]
+    finally:
+        server.stop()
+
+    print(f"\nTime to first byte: {ttfb * 1000:.1f} ms\n")
+    print(f"{'engine':<30}{'MB/s':>10}{'seconds':>10}{'requests':>10}{'faults':>8}{'overhead MB':>13}{'failed':>8}")
+    for s in summaries:
+        if s["seconds"] is None:
+            print(f"{s['engine']:<30}{'-':>10}{'-':>10}{'-':>10}{'-':>8}{'-':>13}{s['failures']:>8}")
+            continue
+        print(f"{s['engine']:<30}{s['mb_per_s']:>10.1f}{s['seconds']:>10.2f}{s['requests']:>10.1f}"
+              f"{s['faults']:>8.1f}{s['overhead_bytes'] / 1024 ** 2:>13.2f}{s['failures']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"ttfb_seconds": ttfb, "config": vars(args), "results": summaries}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
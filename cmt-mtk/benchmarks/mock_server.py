@@ -0,0 +1,326 @@
+"""
+    Local stand-in for cambridge-mt.com, previews.cambridge-mt.com, zenodo.org and the
+    discussion forum, so the download paths can be measured offline.
+
+    Serves:
+        /files/<name>.zip              synthetic multitrack zip (stems of deterministic noise)
+        /files/<name>.mp3              synthetic mp3 preview / forum mix
+        /showthread.php?tid=<n>        forum thread page with an <audio><source src> mix
+        /forumdisplay.php?fid=<n>      forum listing (genre page or song forum with pagination)
+
+    Supports HEAD, single byte-range GETs, ETag / Last-Modified (304s), per-request
+    latency, per-connection bandwidth limits and fault injection (connection resets,
+    400/503 responses, truncated bodies).
+
+    Usage: python cmt-mtk/benchmarks/mock_server.py --port 8000 --latency 0.05 --bandwidth 20
+"""
+
+import io
+import re
+import time
+import random
+import socket
+import zipfile
+import zlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class ServerConfig:
+    def __init__(self, latency=0.0, bandwidth=None, reset_rate=0.0, error_rate=0.0, error_statuses=(400, 503),
+                 truncate_rate=0.0, zip_stems=8, stem_size=4 * 1024 * 1024, mp3_size=2 * 1024 * 1024,
+                 threads_per_forum=45, threads_per_page=20, songs_per_genre=10, seed=0):
+        self.latency = latency  # Seconds before every response
+        self.bandwidth = bandwidth  # Bytes per second per connection, None for unlimited
+        self.reset_rate = reset_rate  # Probability of dropping the connection half way through a body
+        self.error_rate = error_rate  # Probability of answering with one of error_statuses
+        self.error_statuses = error_statuses
+        self.truncate_rate = truncate_rate  # Probability of sending only part of a body, then closing cleanly
+        self.zip_stems = zip_stems
+        self.stem_size = stem_size
+        self.mp3_size = mp3_size
+        self.threads_per_forum = threads_per_forum
+        self.threads_per_page = threads_per_page
+        self.songs_per_genre = songs_per_genre
+        self.seed = seed
+
+
+class ServerStats:
+    """Counters the benchmark reads to compute retry overhead."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.bytes_sent = 0
+            self.faults = 0
+            self.statuses = {}
+
+    def add_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def add(self, status=None, sent=0, fault=False):
+        with self.lock:
+            if status is not None:
+                self.requests += 1
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_sent += sent
+            self.faults += int(fault)
+
+
+def random_bytes(rng, n):
+    return rng.getrandbits(8 * n).to_bytes(n, "little") if n else b""
+
+
+def synthetic_zip(stems, stem_size, seed):
+    """A deflated zip laid out like the Mixing Secrets archives: Song/<n>_<Instrument>.wav plus __MACOSX junk."""
+    rng = random.Random(seed)
+    names = ["Kick", "Snare", "Overheads", "Bass", "ElecGtr", "Keys", "LeadVox", "BackingVox", "Strings", "Fx"]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(stems):
+            # Half noise, half silence, so deflate has something to do
+            noise = random_bytes(rng, min(stem_size // 2, 65536))
+            data = (noise * (stem_size // 2 // len(noise) + 1))[:stem_size // 2] + bytes(stem_size - stem_size // 2)
+            zip_ref.writestr(f"Song/{i + 1:02d}_{names[i % len(names)]}.wav", data)
+            zip_ref.writestr(f"__MACOSX/Song/._{i + 1:02d}_{names[i % len(names)]}.wav", b"\0" * 82)
+    return buffer.getvalue()
+
+
+def synthetic_mp3(size, seed):
+    block = random_bytes(random.Random(seed), 65536)
+    return (b"ID3\x03\x00\x00\x00\x00\x00\x00" + block * (size // len(block) + 1))[:size]
+
+
+def thread_page(base_url, tid):
+    return f"""<html><head><title>Mix {tid}</title></head><body>
+<div id="posts"><div class="post"><div class="post_body">
+<p>My mix of this song, feedback welcome.</p>
+<audio controls><source src="{base_url}/files/mix_{tid}.mp3" type="audio/mpeg"></audio>
+</div></div></div></body></html>"""
+
+
+def listing_page(base_url, fid, page, config, newest_first=False):
+    """MyBB-like forum listing. fid < 100 is a genre page linking song forums, other fids are song forums.
+    Threads are listed oldest first, or newest first like with sortby=started&order=desc."""
+    if fid < 100:
+        songs = "".join(
+            f'<tr><td><strong><a href="forumdisplay.php?fid={fid * 1000 + i}">Artist {i}: \'Song {i}\'</a></strong></td></tr>'
+            for i in range(config.songs_per_genre))
+        return f"<html><head><title>Discussion Zone - Genre {fid}</title></head><body><table>{songs}</table></body></html>"
+
+    pages = max(1, -(-config.threads_per_forum // config.threads_per_page))
+    first = (page - 1) * config.threads_per_page
+    rows = []
+    for i in range(first, min(first + config.threads_per_page, config.threads_per_forum)):
+        if newest_first:
+            i = config.threads_per_forum - 1 - i
+        tid = fid * 1000 + i
+        rows.append(f"""<tr class="inline_row">
+<td class="trow1"></td><td class="trow1"></td>
+<td class="trow1"><span class="subject_new" id="tid_{tid}"><a href="showthread.php?tid={tid}">Mix by user{i}</a></span>
+<div class="author smalltext"><a href="member.php?action=profile&amp;uid={i}">user{i}</a></div>
+<span class="author smalltext"><a href="member.php?action=profile&amp;uid={i}">user{i}</a></span>
+<span class="thread_start_datetime smalltext">01-01-2020, 10:{i % 60:02d} AM</span></td>
+<td class="trow1"><ul class="star_rating"><li>0 Vote(s) - 0 out of 5 in Average</li></ul></td>
+<td class="trow1">{i * 7}</td><td class="trow1">{i * 31}</td></tr>""")
+    pagination = f'<span class="pages">Pages ({pages}):</span>' if pages > 1 else ""
+    return f"""<html><head><title>Song forum {fid}</title></head><body>{pagination}
+<table>{''.join(rows)}</table></body></html>"""
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real servers
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.stats.add_connection()
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def base_url(self):
+        return f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address)}"
+
+    def resolve(self):
+        """Return (body, content type, is a static file) for the requested path, or None."""
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        match = re.match(r"^/files/(.+)\.(zip|mp3)$", url.path)
+        if match:
+            name, kind = match.groups()
+            return self.server.static_file(name, kind), "application/zip" if kind == "zip" else "audio/mpeg", True
+        if url.path == "/showthread.php" and "tid" in query:
+            return thread_page(self.base_url(), int(query["tid"][0])).encode(), "text/html", False
+        if url.path == "/forumdisplay.php" and "fid" in query:
+            page = int(query.get("page", ["1"])[0])
+            newest_first = query.get("sortby") == ["started"] and query.get("order") == ["desc"]
+            return listing_page(self.base_url(), int(query["fid"][0]), page, self.config, newest_first).encode(), "text/html", False
+        return None
+
+    def respond(self, head):
+        config = self.config
+        if config.latency:
+            time.sleep(config.latency)
+        if config.error_rate and self.server.rng.random() < config.error_rate:
+            status = self.server.rng.choice(config.error_statuses)
+            self.server.stats.add(status, fault=True)
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        resolved = self.resolve()
+        if resolved is None:
+            self.server.stats.add(404)
+            self.send_error(404)
+            return
+        body, content_type, static = resolved
+        etag = f'"{zlib.crc32(body):08x}"'
+        last_modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+        if static and self.headers.get("If-None-Match") == etag:
+            self.server.stats.add(304)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        status = 200
+        start, end = 0, len(body) - 1
+        range_header = self.headers.get("Range")
+        if static and range_header:
+            match = re.match(r"bytes=(\d*)-(\d*)$", range_header)
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), len(body) - 1) if match.group(2) else len(body) - 1
+                else:
+                    start = max(0, len(body) - int(match.group(2)))  # Suffix range, last N bytes
+                if start > end:
+                    self.server.stats.add(416)
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(body)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        if static:
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        self.end_headers()
+        if head:
+            self.server.stats.add(status)
+            return
+        self.send_body(memoryview(body)[start:end + 1], status)
+
+    def send_body(self, body, status):
+        config = self.config
+        cut = None
+        fault = False
+        if config.reset_rate and self.server.rng.random() < config.reset_rate:
+            cut, fault = self.server.rng.randrange(max(1, len(body))), "reset"
+        elif config.truncate_rate and self.server.rng.random() < config.truncate_rate:
+            cut, fault = self.server.rng.randrange(max(1, len(body))), "truncate"
+        limit = len(body) if cut is None else cut
+
+        sent = 0
+        block = 64 * 1024
+        started = time.time()
+        try:
+            while sent < limit:
+                data = body[sent:min(limit, sent + block)]
+                self.wfile.write(data)
+                sent += len(data)
+                if config.bandwidth:
+                    ahead = sent / config.bandwidth - (time.time() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            if fault == "reset":
+                # RST instead of FIN, like a dropped connection
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b"\1\0\0\0\0\0\0\0")
+            if fault:
+                self.close_connection = True
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.server.stats.add(status, sent, fault=bool(fault))
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, config=None):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.config = config or ServerConfig()
+        self.stats = ServerStats()
+        self.rng = random.Random(self.config.seed)
+        self.files = {}
+        self.files_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def static_file(self, name, kind):
+        """Synthetic files are generated on first request and then kept in memory."""
+        key = (name, kind)
+        with self.files_lock:
+            if key not in self.files:
+                seed = zlib.crc32(name.encode())
+                if kind == "zip":
+                    self.files[key] = synthetic_zip(self.config.zip_stems, self.config.stem_size, seed)
+                else:
+                    self.files[key] = synthetic_mp3(self.config.mp3_size, seed)
+            return self.files[key]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the Cambridge-MT download hosts and forum.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--bandwidth", type=float, default=None, help="MB/s per connection")
+    parser.add_argument("--reset_rate", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--truncate_rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = ServerConfig(latency=args.latency,
+                          bandwidth=args.bandwidth * 1024 ** 2 if args.bandwidth else None,
+                          reset_rate=args.reset_rate, error_rate=args.error_rate, truncate_rate=args.truncate_rate)
+    server = MockServer(args.port, config)
+    print(f"Serving on {server.url}")
+    server.serve_forever()
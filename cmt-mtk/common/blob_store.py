@@ -0,0 +1,109 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import threading
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed store for downloaded audio.
+
+    Every file is kept once under root/sha256/<aa>/<digest>, and the per-song paths the
+    scripts use are hardlinks to it (symlinks when the store is on another filesystem).
+    root/index.jsonl maps each linked path to its digest, so feature and alignment
+    caches can key on content instead of on song folder names.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "index.jsonl")
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(root, "sha256"), exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.index[record["path"]] = record["sha256"]
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "sha256", digest[:2], digest)
+
+    def digest_of(self, path):
+        """Content hash of a path added to the store, None if it was never added."""
+        return self.index.get(os.path.abspath(path))
+
+    def add(self, path, digest=None):
+        """
+        Put the file at path into the store and replace it with a link to its blob.
+        Pass digest when it was already computed while downloading, otherwise the file
+        is hashed here, unless it is still the link added before. Returns the digest.
+        """
+        path = os.path.abspath(path)
+        known = self.index.get(path)
+        if known is not None and digest in (None, known) and self.is_linked(path, known):
+            return known  # Already linked, no need to read it
+        digest = digest or hash_file(path)
+        blob = self.blob_path(digest)
+
+        with self.lock:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if not os.path.exists(blob):
+                try:
+                    os.link(path, blob)  # First copy of these bytes, the file itself becomes the blob
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(path, blob)
+                    os.symlink(blob, path)
+            else:
+                self.link(blob, path)  # Duplicate, drop our copy in favour of the existing blob
+            self.index[path] = digest
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps({"path": path, "sha256": digest, "size": os.path.getsize(blob)}) + "\n")
+        return digest
+
+    def is_linked(self, path, digest):
+        """Whether path is the same file (inode) as the blob of digest."""
+        blob = self.blob_path(digest)
+        return os.path.exists(blob) and os.path.samefile(path, blob)
+
+    def link(self, blob, path):
+        """Atomically replace path with a hardlink (or symlink) to blob."""
+        temp_path = f"{path}.link"
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(blob, temp_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            os.symlink(blob, temp_path)
+        os.replace(temp_path, path)
+
+    def add_tree(self, folder, known_digests=None):
+        """
+        Add every regular, non-hidden file under folder. known_digests ({path: digest},
+        e.g. computed while extracting) spares hashing those files again. Returns {path: digest}.
+        """
+        known_digests = {os.path.abspath(path): digest for path, digest in (known_digests or {}).items()}
+        digests = {}
+        for current, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                path = os.path.join(current, name)
+                if not name.startswith(".") and not os.path.islink(path):
+                    digests[path] = self.add(path, known_digests.get(os.path.abspath(path)))
+        return digests
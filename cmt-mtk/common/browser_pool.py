@@ -0,0 +1,168 @@
+"""
+    Pool of warm headless browser sessions for pages plain requests can't get.
+
+    Launching Chrome costs seconds, so sessions are kept open and reused: at most size
+    of them, started on first use, each one quit and replaced after max_pages pages
+    (long-lived browsers leak memory) or after an error. Instead of a fixed sleep, a
+    page is returned once its document.readyState is "complete".
+
+    The driver is pluggable: driver_factory() returns anything with get(url),
+    execute_script(script), page_source and quit(), like a Selenium WebDriver.
+    chrome_driver is the default, FakeDriver stands in for it offline.
+"""
+
+import time
+import threading
+
+READY_TIMEOUT = 15  # Seconds to wait for a page to be loaded before taking it as is
+READY_POLL = 0.1
+
+chromedriver_path = None
+chromedriver_lock = threading.Lock()
+
+
+def chrome_driver():
+    """Headless Chrome. chromedriver is looked up (and downloaded if needed) once per process."""
+    global chromedriver_path
+    # Imported here so the pool can be used (e.g. with FakeDriver) without Selenium installed
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    with chromedriver_lock:
+        if chromedriver_path is None:
+            chromedriver_path = ChromeDriverManager().install()
+    options = Options()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    return webdriver.Chrome(service=Service(chromedriver_path), options=options)
+
+
+class FakeDriver:
+    """
+    Offline stand-in for a WebDriver, to test and benchmark the pool: starting it takes
+    startup seconds, and a page only reports readyState "complete" render seconds after
+    get(). Pages come from fetch(url) (e.g. a GET against the mock server), or are a stub.
+    """
+
+    def __init__(self, startup=2.0, render=0.5, fetch=None):
+        time.sleep(startup)
+        self.render = render
+        self.fetch = fetch
+        self.page_source = ""
+        self.ready_at = 0.0
+        self.closed = False
+
+    def get(self, url):
+        if self.closed:
+            raise RuntimeError("Browser session was quit")
+        self.page_source = self.fetch(url) if self.fetch else f"<html><head><title>{url}</title></head><body></body></html>"
+        self.ready_at = time.time() + self.render
+
+    def execute_script(self, script):
+        return "complete" if time.time() >= self.ready_at else "loading"
+
+    def quit(self):
+        self.closed = True
+
+
+class BrowserSession:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class BrowserPool:
+    """At most size browser sessions shared by every thread, each used for up to max_pages pages."""
+
+    def __init__(self, size=2, max_pages=50, driver_factory=chrome_driver, ready_timeout=READY_TIMEOUT):
+        self.size = size
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+        self.ready_timeout = ready_timeout
+        self.idle = []
+        self.started = 0  # Sessions open or being launched
+        self.launched = 0  # Browsers launched so far, for stats
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """An idle session, a new one if the pool isn't full, or else the next one given back."""
+        with self.condition:
+            while not self.idle and self.started >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            driver = self.driver_factory()
+        except Exception:
+            self.discard(None)
+            raise
+        with self.condition:
+            self.launched += 1
+        return BrowserSession(driver)
+
+    def release(self, session):
+        session.pages += 1
+        if session.pages >= self.max_pages:
+            self.discard(session)
+            return
+        with self.condition:
+            self.idle.append(session)
+            self.condition.notify()
+
+    def discard(self, session):
+        """Quit a session (worn out or broken), making room for a new one."""
+        if session is not None:
+            try:
+                session.driver.quit()
+            except Exception as e:
+                print(f"Could not quit browser session: {e}")
+        with self.condition:
+            self.started -= 1
+            self.condition.notify()
+
+    def wait_until_ready(self, driver):
+        deadline = time.time() + self.ready_timeout
+        while driver.execute_script("return document.readyState") != "complete":
+            if time.time() >= deadline:
+                print("Page still loading, using it as is.")
+                return
+            time.sleep(READY_POLL)
+
+    def fetch(self, url):
+        """HTML of url as rendered by a browser of the pool, None if it fails."""
+        try:
+            session = self.acquire()
+        except Exception as e:
+            print(f"Could not start a browser: {e}")
+            return None
+        try:
+            session.driver.get(url)
+            self.wait_until_ready(session.driver)
+            html = session.driver.page_source
+        except Exception as e:
+            print(f"Browser failed to load {url}: {e}")
+            self.discard(session)
+            return None
+        self.release(session)
+        return html
+
+    def warm(self):
+        """Launch every session of the pool now rather than on first use."""
+        sessions = []
+        for _ in range(self.size - self.started):
+            sessions.append(self.acquire())
+        for session in sessions:
+            with self.condition:
+                self.idle.append(session)
+                self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for session in idle:
+            self.discard(session)
@@ -0,0 +1,184 @@
+import os
+import queue
+import threading
+import http.client
+
+import requests
+
+BUFFER_SIZE = 4 * 1024 * 1024  # Bytes read from the network per buffer
+
+
+class BufferPool:
+    """
+    A fixed number of reusable bytearrays. Buffers are allocated on first use, so a
+    pool sized for a big download costs nothing for a small one. acquire() blocks
+    while every buffer is waiting to be written, which holds the network reader
+    back to the speed of the disk.
+    """
+
+    def __init__(self, count=4, size=BUFFER_SIZE):
+        self.count = count
+        self.size = size
+        self.allocated = 0
+        self.free = []
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while not self.free and self.allocated >= self.count:
+                self.condition.wait()
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+        return bytearray(self.size)
+
+    def release(self, buffer):
+        with self.condition:
+            self.free.append(buffer)
+            self.condition.notify()
+
+
+def read_into(response, buffer, size=None):
+    """
+    Fill up to size bytes of buffer from a streamed requests response and return how
+    many were read, 0 at the end of the body. Bodies without a Content-Encoding are
+    read straight into the buffer, skipping the bytes objects requests and urllib3
+    would allocate for every chunk. Once such a body is read to its end, the connection
+    goes back to the pool like urllib3 would do it, so the next request reuses it.
+    Connection errors are raised as requests' ConnectionError, like iter_content does.
+    """
+    view = memoryview(buffer)[:size or len(buffer)]
+    raw = response.raw
+    fp = getattr(raw, "_fp", None)
+    direct = fp is not None and response.headers.get("content-encoding", "identity") == "identity"
+    filled = 0
+    try:
+        while filled < len(view):
+            if direct:
+                n = fp.readinto(view[filled:])
+                if fp.isclosed():  # http.client closes it at Content-Length, or the last chunk
+                    response._content_consumed = True
+                    raw.release_conn()
+            else:
+                data = raw.read(len(view) - filled, decode_content=True)
+                n = len(data)
+                view[filled:filled + n] = data
+            if not n:
+                break
+            filled += n
+    except (OSError, http.client.HTTPException) as e:
+        raise requests.exceptions.ConnectionError(e)
+    return filled
+
+
+class WriteBehind:
+    """
+    Background thread that writes buffers to a file descriptor at their offsets, so
+    the thread reading from the network never waits on the disk (which matters on
+    the NFS-mounted dataset volume). Writes happen in submission order.
+
+    done(view) runs on the writer thread after each successful write, e.g. to hash
+    or checkpoint the bytes. With a pool, buffers are given back to it once written.
+    At most max_pending writes are queued before submit() blocks.
+    """
+
+    def __init__(self, fd, pool=None, max_pending=4):
+        self.fd = fd
+        self.pool = pool
+        self.error = None
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            buffer, length, offset, done = item
+            try:
+                if self.error is None:
+                    view = memoryview(buffer)[:length]
+                    while view:
+                        written = os.pwrite(self.fd, view, offset)
+                        view, offset = view[written:], offset + written
+                    if done is not None:
+                        done(memoryview(buffer)[:length])
+            except Exception as e:
+                self.error = e
+            finally:
+                if self.pool is not None:
+                    self.pool.release(buffer)
+
+    def submit(self, buffer, length, offset, done=None):
+        """Queue buffer[:length] to be written at offset. Raises the error of an earlier write, if any."""
+        if self.error is not None:
+            if self.pool is not None:
+                self.pool.release(buffer)
+            raise self.error
+        self.queue.put((buffer, length, offset, done))
+
+    def close(self):
+        """Wait until everything queued is written. Returns the first write error instead of raising it."""
+        self.queue.put(None)
+        self.thread.join()
+        return self.error
+
+
+class WriteBehindFile:
+    """Sequential file whose write() returns as soon as the data is queued, for sinks that take a file object."""
+
+    def __init__(self, path, max_pending=8):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.writer = WriteBehind(self.fd, max_pending=max_pending)
+        self.offset = 0
+
+    def write(self, data):
+        self.writer.submit(data, len(data), self.offset)
+        self.offset += len(data)
+        return len(data)
+
+    def close(self):
+        error = self.writer.close()
+        os.close(self.fd)
+        if error is not None:
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_response(response, path, pool, done=None, counters=None):
+    """
+    Stream a whole response body into path through pool buffers and a write-behind
+    thread. done(view) sees every written block in order (e.g. to hash the file) and
+    counters, a metrics WorkerCounters, gets the received bytes.
+    Returns the number of bytes received.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    writer = WriteBehind(fd, pool)
+    received = 0
+    try:
+        while True:
+            buffer = pool.acquire()
+            try:
+                length = read_into(response, buffer)
+            except BaseException:
+                pool.release(buffer)
+                raise
+            if not length:
+                pool.release(buffer)
+                break
+            writer.submit(buffer, length, received, done)
+            received += length
+            if counters is not None:
+                counters.bytes += length
+    finally:
+        error = writer.close()
+        os.close(fd)
+    if error is not None:
+        raise error
+    return received
@@ -0,0 +1,91 @@
+import time
+import threading
+
+import requests
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit is open."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"Circuit for {host} is open, not sending requests for {retry_in:.0f}s.")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class HostCircuit:
+    def __init__(self, reset_timeout):
+        self.state = CLOSED
+        self.failures = 0  # Consecutive failures while closed
+        self.opened_at = 0.0
+        self.open_for = reset_timeout
+        self.trial_in_flight = False
+
+
+class CircuitBreakers:
+    """
+    One circuit breaker per host. failure_threshold consecutive failures open the
+    circuit: requests fail fast with CircuitOpenError for reset_timeout seconds, so
+    workers move on (e.g. to the retry queue) instead of hammering a host that is down.
+    After that a single trial request is let through (half-open). If it succeeds the
+    circuit closes, if it fails the circuit opens again for twice as long, up to
+    max_reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, max_reset_timeout=600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def circuit(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostCircuit(self.reset_timeout)
+        return self.hosts[host]
+
+    def allow(self, host):
+        """Raise CircuitOpenError unless a request to host may be sent now."""
+        with self.lock:
+            circuit = self.circuit(host)
+            if circuit.state == CLOSED:
+                return
+            retry_in = circuit.opened_at + circuit.open_for - time.time()
+            if circuit.state == OPEN and retry_in <= 0:
+                circuit.state = HALF_OPEN
+                circuit.trial_in_flight = False
+            if circuit.state == HALF_OPEN and not circuit.trial_in_flight:
+                circuit.trial_in_flight = True
+                return
+            raise CircuitOpenError(host, max(retry_in, 0))
+
+    def record(self, host, ok):
+        """Report the outcome of a request that allow() let through."""
+        with self.lock:
+            circuit = self.circuit(host)
+            if ok:
+                if circuit.state != CLOSED:
+                    print(f"Circuit for {host} closed again.")
+                circuit.state = CLOSED
+                circuit.failures = 0
+                circuit.open_for = self.reset_timeout
+                return
+            if circuit.state == HALF_OPEN:
+                circuit.open_for = min(self.max_reset_timeout, circuit.open_for * 2)
+                self.open(host, circuit)
+                return
+            circuit.failures += 1
+            if circuit.state == CLOSED and circuit.failures >= self.failure_threshold:
+                self.open(host, circuit)
+
+    def open(self, host, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = time.time()
+        circuit.trial_in_flight = False
+        print(f"Circuit for {host} opened after repeated failures, pausing it for {circuit.open_for:.0f}s.")
+
+    def state(self, host):
+        with self.lock:
+            return self.circuit(host).state
@@ -0,0 +1,166 @@
+import os
+import time
+import shutil
+import threading
+
+HEADROOM = 2 * 1024 ** 3  # Free space always left on the volume
+ZIP_FOOTPRINT = 2  # A zip needs room for itself and its extracted stems until it is removed
+UNKNOWN_FOOTPRINT = 1024 ** 3  # Reserved for a download of unknown size, unless a larger one was seen
+MEASURE_INTERVAL = 5.0  # Seconds the measured disk usage of the downloads is trusted for
+
+
+def footprint(file_name, size):
+    """
+    Disk space a download of size bytes needs at its peak: the file, plus its extracted
+    content for zips. None if size is unknown (see DiskBudget.reserve).
+    """
+    if size is None:
+        return None
+    return size * ZIP_FOOTPRINT if file_name.endswith(".zip") else size
+
+
+def disk_used(path):
+    """Bytes allocated on disk for a file or a folder tree (preallocated space included), 0 if it doesn't exist."""
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = [os.path.join(root, name) for root, _, files in os.walk(path) for name in files]
+    used = 0
+    for file_path in paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue  # Renamed or removed while walking
+        used += stat.st_blocks * 512 if hasattr(stat, "st_blocks") else stat.st_size
+    return used
+
+
+class Reservation:
+    """
+    Bytes reserved for one download. Stages give back their share with release() as
+    they finish. With track(), what the download already wrote (or preallocated) under
+    a path is no longer counted against the free space, since the disk shows it already.
+    That growth is measured by DiskBudget.measure(), not on every check.
+    """
+
+    def __init__(self, budget, nbytes):
+        self.budget = budget
+        self.nbytes = nbytes
+        self.paths = {}  # Tracked path -> bytes it held before the download
+        self.written = 0  # Growth of the tracked paths at the last measure()
+
+    def track(self, path):
+        """Count the growth of path (the download's file or folder) as reserved bytes already on disk."""
+        used = disk_used(path)
+        with self.budget.condition:
+            self.paths[path] = used
+
+    def measure(self):
+        """Walk the tracked paths, without the budget's lock held. Returns the bytes written so far."""
+        with self.budget.condition:
+            paths = list(self.paths.items())
+        return sum(max(0, disk_used(path) - before) for path, before in paths)
+
+    def pending(self):
+        """Reserved bytes not on disk yet, as of the last measure()."""
+        return max(0, self.nbytes - self.written)
+
+    def release(self, nbytes=None):
+        """Give back nbytes (everything left by default), e.g. once a zip has been extracted and removed."""
+        self.budget.free(self, nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class DiskBudget:
+    """
+    Admission control on disk space for concurrent downloads into one volume.
+
+    Every download reserves its peak footprint up front (all stages at once, so a
+    worker never waits for space while holding some), and is only let through when
+    both fit: reserved bytes stay within budget (None for no limit besides the
+    disk), and the volume keeps headroom bytes free on top of the part of every
+    outstanding reservation not on disk yet (see Reservation.track). Otherwise reserve() blocks until extraction or cleanup frees space,
+    so the number of workers no longer has to be tuned to the scratch disk.
+    A download is always admitted when nothing else is reserved, so one file larger
+    than the budget still goes through, alone.
+
+    Free space and the growth of the tracked paths are measured together, outside
+    the lock, at most every measure_interval seconds or after a release, so waiting
+    downloads don't walk every tree on each wake-up.
+    """
+
+    def __init__(self, path, budget=None, headroom=HEADROOM, measure_interval=MEASURE_INTERVAL):
+        self.path = path
+        self.budget = budget
+        self.headroom = headroom
+        self.measure_interval = measure_interval
+        self.reserved = 0
+        self.reservations = set()
+        self.largest = 0  # Largest reservation so far, the default for downloads of unknown size
+        self.free_space = None  # Free bytes on the volume at the last measure()
+        self.measured_at = None
+        self.measuring = threading.Lock()
+        self.condition = threading.Condition()
+
+    def measure(self):
+        """Measure free space and what every reservation wrote, unless that was done recently."""
+        with self.measuring:  # One walk at a time, the others use its result
+            with self.condition:
+                if self.measured_at is not None and time.time() - self.measured_at < self.measure_interval:
+                    return
+                reservations = list(self.reservations)
+            written = {reservation: reservation.measure() for reservation in reservations}
+            free_space = shutil.disk_usage(self.path).free
+            with self.condition:
+                for reservation, nbytes in written.items():
+                    reservation.written = nbytes
+                self.free_space = free_space
+                self.measured_at = time.time()
+
+    def fits(self, nbytes):
+        if self.reserved == 0:
+            return True
+        if self.budget is not None and self.reserved + nbytes > self.budget:
+            return False
+        # Free space already went down by what live downloads preallocated or wrote
+        pending = sum(reservation.pending() for reservation in self.reservations)
+        return self.free_space - self.headroom >= pending + nbytes
+
+    def reserve(self, nbytes=None):
+        """
+        Block until nbytes can be written, and return their Reservation. With nbytes
+        None (size unknown), the largest reservation so far is assumed, at least
+        UNKNOWN_FOOTPRINT.
+        """
+        waited = False
+        while True:
+            self.measure()
+            with self.condition:
+                if nbytes is None:
+                    nbytes = max(self.largest, UNKNOWN_FOOTPRINT)
+                if self.fits(nbytes):
+                    self.reserved += nbytes
+                    self.largest = max(self.largest, nbytes)
+                    reservation = Reservation(self, nbytes)
+                    self.reservations.add(reservation)
+                    return reservation
+                if not waited:
+                    print(f"Waiting for disk space: {nbytes / 1024 ** 2:.0f} MB needed, "
+                          f"{self.reserved / 1024 ** 2:.0f} MB reserved.")
+                    waited = True
+                self.condition.wait(self.measure_interval)  # Space can also be freed outside of this process
+
+    def free(self, reservation, nbytes=None):
+        with self.condition:
+            nbytes = reservation.nbytes if nbytes is None else min(nbytes, reservation.nbytes)
+            reservation.nbytes -= nbytes
+            self.reserved -= nbytes
+            if reservation.nbytes == 0:
+                self.reservations.discard(reservation)
+            self.measured_at = None  # A stage finished, measure again before the next admission
+            self.condition.notify_all()
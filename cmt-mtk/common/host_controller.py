@@ -0,0 +1,160 @@
+import time
+import weakref
+import threading
+from urllib.parse import urlparse
+
+# Responses the forum sends when it is being hit too hard
+BACKOFF_STATUSES = {400, 429, 500, 502, 503, 504}
+
+
+class HostState:
+    def __init__(self, concurrency, interval):
+        self.concurrency = concurrency  # Allowed requests in flight (float, floored when used)
+        self.interval = interval  # Minimum seconds between two request starts
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.latency = None  # EWMA of response latency in seconds
+
+
+class AIMDController:
+    """
+    Per-host adaptive rate and concurrency limit (additive increase, multiplicative decrease).
+
+    Every healthy response (fast enough, no error status) grows the host's concurrency by
+    about one request per round of requests and shortens the gap between requests. A
+    400/429/5xx, a connection error or a latency spike halves the concurrency and doubles
+    the gap (or waits for Retry-After), so scripts slow down instead of exiting.
+    With breakers (CircuitBreakers), a host that keeps failing is not sent requests at
+    all for a while, request() raises CircuitOpenError right away instead.
+    Requests replayed from an HttpArchive (see http_client.use_archive) never reach a
+    host, so they skip the limits and the breakers.
+    """
+
+    def __init__(self, initial_concurrency=1, max_concurrency=8, initial_interval=1.0, min_interval=0.0,
+                 max_interval=60.0, latency_factor=3.0, min_slow_latency=1.0, metrics=None,
+                 breakers=None):
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.latency_factor = latency_factor  # Latency above latency_factor * average counts as congestion
+        self.min_slow_latency = min_slow_latency  # ...as long as it is also above this many seconds
+        self.metrics = metrics  # Optional Metrics, gets every request, error and latency
+        self.breakers = breakers  # Optional CircuitBreakers, fed the same outcomes as the AIMD limits
+        self.hosts = {}
+        self.condition = threading.Condition()
+
+    def state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.initial_concurrency, self.initial_interval)
+        return self.hosts[host]
+
+    def acquire(self, host):
+        """Block until the host has a free slot and its request gap has passed."""
+        with self.condition:
+            state = self.state(host)
+            while True:
+                now = time.time()
+                if state.in_flight >= max(1, int(state.concurrency)):
+                    self.condition.wait(1.0)  # Woken up early by release()
+                elif now < state.next_start:
+                    self.condition.wait(state.next_start - now)
+                else:
+                    break
+            state.in_flight += 1
+            state.next_start = now + state.interval
+
+    def release(self, host, latency, status=None, retry_after=None, free_slot=True):
+        """
+        Report how a request went. status is None for connection errors and timeouts.
+        With free_slot False the request keeps its slot (its body is still being read),
+        until the function returned by slot_releaser() is called.
+        """
+        with self.condition:
+            state = self.state(host)
+            if free_slot:
+                state.in_flight -= 1
+            slow = (state.latency is not None and latency > self.min_slow_latency
+                    and latency > self.latency_factor * state.latency)
+            if status is None or status in BACKOFF_STATUSES or slow:
+                state.concurrency = max(1.0, state.concurrency / 2)
+                state.interval = min(self.max_interval, max(state.interval * 2, self.initial_interval))
+                if retry_after:
+                    state.next_start = max(state.next_start, time.time() + retry_after)
+            else:
+                state.concurrency = min(self.max_concurrency, state.concurrency + 1 / state.concurrency)
+                state.interval = max(self.min_interval, state.interval * 0.9)
+            if status is not None and not slow:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+            self.condition.notify_all()
+
+    def slot_releaser(self, host):
+        """A function freeing one in-flight slot of host, at most once however often it is called."""
+        freed = []
+
+        def free():
+            with self.condition:
+                if freed:
+                    return
+                freed.append(True)
+                self.state(host).in_flight -= 1
+                self.condition.notify_all()
+        return free
+
+    def request(self, method, url, **kwargs):
+        """
+        Run method(url, **kwargs) (e.g. session.get) within the host's limits and feed the
+        outcome back into them. Exceptions and error responses are passed to the caller.
+        A stream=True response holds its slot while the body is read: close it (or use it
+        as a context manager) when done, the slot is only freed then (or when it is
+        garbage collected).
+        """
+        import http_client  # Not at the top, http_client imports this module through http_archive
+        if http_client.replaying():
+            return method(url, **kwargs)
+        host = urlparse(url).hostname or ""
+        if self.breakers is not None:
+            self.breakers.allow(host)
+        self.acquire(host)
+        start = time.time()
+        counters = self.metrics.worker() if self.metrics is not None else None
+        try:
+            response = method(url, **kwargs)
+        except Exception:
+            self.release(host, time.time() - start)
+            if self.breakers is not None:
+                self.breakers.record(host, ok=False)
+            if counters is not None:
+                counters.requests += 1
+                counters.errors += 1
+            raise
+        latency = time.time() - start
+        retry_after = response.headers.get("Retry-After")
+        streamed = bool(kwargs.get("stream"))
+        self.release(host, latency, response.status_code,
+                     float(retry_after) if retry_after and retry_after.isdigit() else None, free_slot=not streamed)
+        if streamed:
+            free = self.slot_releaser(host)
+            close = response.close
+
+            def close_and_free():
+                try:
+                    close()
+                finally:
+                    free()
+            response.close = close_and_free
+            weakref.finalize(response, free)  # A response dropped without close() still gives its slot back
+        if self.breakers is not None:
+            self.breakers.record(host, ok=response.status_code not in BACKOFF_STATUSES)
+        if counters is not None:
+            counters.requests += 1
+            counters.observe_latency(latency)
+            if response.status_code >= 400:
+                counters.errors += 1
+        return response
+
+    def describe(self, host):
+        with self.condition:
+            state = self.state(host)
+            return f"{host}: concurrency {state.concurrency:.1f}, interval {state.interval:.2f}s"
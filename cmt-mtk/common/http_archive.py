@@ -0,0 +1,122 @@
+"""
+    Record / replay archive of fetched pages, so scrapers can be re-run offline.
+
+    Every page a scraper GETs (streamed downloads excepted) is stored in an SQLite
+    file, keyed by URL and fetch time, with its body zlib-compressed. In replay mode
+    the same requests are answered from the archive without touching the network:
+    the newest copy of each URL by default, or the newest one fetched before as_of
+    to re-run a scrape as it was at some date. Requests that are not in the archive
+    get a 404 "Not archived" response, so scrapers handle them like a missing page.
+
+    Turned on for the whole process with http_client.use_archive(path, replay).
+    python http_archive.py <archive> [url_substring] lists what an archive holds.
+"""
+
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from http.client import responses as reasons
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from host_controller import BACKOFF_STATUSES
+
+# The body is stored decoded, so these no longer describe it
+DROPPED_HEADERS = ("content-encoding", "transfer-encoding")
+
+
+def archive_key(url, params=None):
+    """The URL as it is sent, query parameters included."""
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+def archivable(method, kwargs):
+    return method.upper() == "GET" and not kwargs.get("stream")
+
+
+def build_response(url, status, final_url, headers, body, reason=None):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason or reasons.get(status, "")
+    response.headers = CaseInsensitiveDict(headers)
+    response.url = final_url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = body
+    response.request = requests.Request("GET", url).prepare()
+    return response
+
+
+class HttpArchive:
+    def __init__(self, path, replay=False, as_of=None):
+        self.path = path
+        self.replay = replay
+        self.as_of = as_of  # Replay pages as fetched up to this time (seconds since the epoch), None for the newest
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT NOT NULL, fetched_at REAL NOT NULL, "
+                        "status INTEGER NOT NULL, final_url TEXT, headers TEXT, body BLOB)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_url ON responses (url, fetched_at)")
+        self.db.commit()
+
+    def request(self, send, method, url, **kwargs):
+        """
+        Answer send(method, url, **kwargs) (e.g. Session.request) from the archive when
+        replaying, otherwise send it and store the response. Throttling and server
+        errors (400/429/5xx) are not stored, a later successful fetch would hide them anyway.
+        """
+        key = archive_key(url, kwargs.get("params")) if archivable(method, kwargs) else None
+        if self.replay:
+            response = self.get(key) if key else None
+            if response is None:
+                return build_response(url, 404, url, {}, b"", reason="Not archived")
+            return response
+        response = send(method, url, **kwargs)
+        if key and response.status_code not in BACKOFF_STATUSES:
+            self.store(key, response)
+        return response
+
+    def store(self, key, response):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in DROPPED_HEADERS}
+        row = (key, time.time(), response.status_code, response.url, json.dumps(headers), zlib.compress(response.content))
+        with self.lock:
+            self.db.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)", row)
+            self.db.commit()
+
+    def get(self, url):
+        """The archived response of url (newest up to as_of), None if it was never fetched."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT status, final_url, headers, body FROM responses WHERE url = ? AND fetched_at <= ? "
+                "ORDER BY fetched_at DESC LIMIT 1", (url, self.as_of or float("inf"))).fetchone()
+        if row is None:
+            return None
+        status, final_url, headers, body = row
+        return build_response(url, status, final_url, json.loads(headers), zlib.decompress(body))
+
+    def entries(self, pattern=""):
+        """(url, fetched_at, status, stored bytes) of every archived fetch whose URL contains pattern."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT url, fetched_at, status, length(body) FROM responses WHERE instr(url, ?) > 0 "
+                "ORDER BY url, fetched_at", (pattern,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python http_archive.py <archive> [url_substring]")
+        sys.exit(1)
+    archive = HttpArchive(sys.argv[1], replay=True)
+    entries = archive.entries(sys.argv[2] if len(sys.argv) == 3 else "")
+    for url, fetched_at, status, size in entries:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(fetched_at))}  {status}  {size:>9}  {url}")
+    print(f"{len(entries)} responses, {sum(entry[3] for entry in entries) / 1024 ** 2:.1f} MB compressed.")
@@ -0,0 +1,101 @@
+import os
+import json
+import threading
+
+from http_client import head as pooled_head
+
+
+def response_validators(headers, size=None):
+    """
+    Validators of a download response, as ValidatorCache.store() takes them. size is
+    the size of the whole file, needed for a 206 whose Content-Length is only its range.
+    """
+    content_length = str(size) if size is not None else headers.get("content-length")
+    return {"etag": headers.get("etag"), "last-modified": headers.get("last-modified"),
+            "content-length": content_length}
+
+
+class ValidatorCache:
+    """
+    Local record of the ETag, Last-Modified and Content-Length of every downloaded URL.
+
+    revalidate() sends a HEAD with If-None-Match / If-Modified-Since, so a re-run can
+    tell from a 304 (or from unchanged validators, for servers that ignore conditional
+    HEADs) that the local copy is still current without downloading anything.
+    Entries are appended to a JSON Lines file, the last entry for a URL wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.by_path = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["url"]] = entry
+                        self.by_path[entry.get("path")] = entry
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def for_path(self, path):
+        """Cached entry of the URL that was downloaded to path, if any."""
+        return self.by_path.get(os.path.abspath(path))
+
+    def conditional_headers(self, url):
+        entry = self.entries.get(url)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def matches(self, url, headers):
+        """True if the response headers describe the same file as the cached entry."""
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+        etag = headers.get("etag")
+        if etag and entry.get("etag"):
+            return etag == entry["etag"]
+        last_modified = headers.get("last-modified")
+        content_length = headers.get("content-length")
+        if not last_modified and not content_length:
+            return False  # Nothing to compare against
+        return (last_modified == entry.get("last_modified")
+                and (content_length is None or int(content_length) == entry.get("content_length")))
+
+    def revalidate(self, url, head=pooled_head, **kwargs):
+        """
+        Ask the server whether url changed since it was cached.
+        Returns (unchanged, headers). unchanged is False for URLs that were never cached.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update(self.conditional_headers(url))
+        response = head(url, headers=headers, allow_redirects=True, timeout=30, **kwargs)
+        if response.status_code == 304:
+            return True, response.headers
+        response.raise_for_status()
+        return self.matches(url, response.headers), response.headers
+
+    def store(self, url, headers, path=None):
+        """Remember the validators of a URL that was just downloaded to path."""
+        content_length = headers.get("content-length")
+        entry = {
+            "url": url,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "content_length": int(content_length) if content_length else None,
+            "path": os.path.abspath(path) if path else None,
+        }
+        with self.lock:
+            self.entries[url] = entry
+            self.by_path[entry["path"]] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
@@ -0,0 +1,137 @@
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from http_archive import HttpArchive
+
+TIMEOUT = (10, 30)  # (connect, read) seconds, used when a request doesn't set its own
+POOL_SIZE = 16  # Keep-alive connections kept open per host
+DNS_TTL = 300  # Seconds a resolved host name is reused
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+archive = None  # HttpArchive every session records to or replays from, see use_archive()
+
+
+def retry_policy(status_retries=True):
+    """
+    The retry policy shared by every script: connection errors and errors before the
+    response headers are retried with exponential backoff (2s, 4s, 8s...). With
+    status_retries, 429/5xx responses are retried too (honouring Retry-After), scripts
+    whose AIMDController has to see those statuses to back off turn that off.
+    """
+    return Retry(
+        total=5,
+        connect=5,
+        read=3,
+        status=5 if status_retries else 0,
+        status_forcelist=RETRY_STATUSES if status_retries else (),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        backoff_factor=2,
+        respect_retry_after_header=True,
+        raise_on_status=False,  # Hand the last response to the caller, which calls raise_for_status
+    )
+
+
+class PooledSession(requests.Session):
+    """requests.Session with the shared timeout applied to every request that doesn't set one."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", TIMEOUT)
+        if archive is not None:
+            return archive.request(super().request, method, url, **kwargs)
+        return super().request(method, url, **kwargs)
+
+
+def use_archive(path, replay=False, as_of=None):
+    """
+    Record every page fetched by the process into the HttpArchive at path, or with
+    replay, serve them from it without going online (see http_archive.py).
+    """
+    global archive
+    archive = HttpArchive(path, replay=replay, as_of=as_of)
+    return archive
+
+
+def replaying():
+    """Whether requests are answered from the archive, without going online."""
+    return archive is not None and archive.replay
+
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def session(pool_size=POOL_SIZE, status_retries=True):
+    """
+    Process-wide session (one per retry flavour), so every request of a script reuses
+    keep-alive connections instead of paying a new TCP + TLS handshake. Asking for a
+    larger pool_size than the current one (e.g. workers * connections per file)
+    grows the pool, and closes the connections of the smaller one.
+    """
+    with sessions_lock:
+        current = sessions.get(status_retries)
+        if current is None or current.pool_size < pool_size:
+            current = current or PooledSession()
+            replaced = set(current.adapters.values())
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=pool_size,
+                                  max_retries=retry_policy(status_retries))
+            current.mount("https://", adapter)
+            current.mount("http://", adapter)
+            current.pool_size = pool_size
+            for old in replaced:
+                old.close()  # Idle connections of the smaller pool would stay open otherwise
+            sessions[status_retries] = current
+        return current
+
+
+def get(url, **kwargs):
+    return session().get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    return session().head(url, **kwargs)
+
+
+system_getaddrinfo = None  # Lookup the cache stands in front of, while it is installed
+dns_cache = {}
+dns_lock = threading.Lock()
+
+
+def cached_getaddrinfo(host, port, *args, **kwargs):
+    """socket.getaddrinfo with results kept for DNS_TTL seconds, failures are not cached."""
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    now = time.time()
+    with dns_lock:
+        hit = dns_cache.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    result = (system_getaddrinfo or socket.getaddrinfo)(host, port, *args, **kwargs)
+    with dns_lock:
+        dns_cache[key] = (now + DNS_TTL, result)
+    return result
+
+
+def install_dns_cache():
+    """
+    Route every name lookup of the process (urllib3 included) through the cache, until
+    uninstall_dns_cache(). It patches socket.getaddrinfo for every library of the
+    process, so only scripts turn it on, the helpers never do.
+    """
+    global system_getaddrinfo
+    with dns_lock:
+        if system_getaddrinfo is None:
+            system_getaddrinfo = socket.getaddrinfo
+            socket.getaddrinfo = cached_getaddrinfo
+
+
+def uninstall_dns_cache():
+    """Give name lookups back to the lookup that was in place before install_dns_cache(), and forget the cache."""
+    global system_getaddrinfo
+    with dns_lock:
+        if system_getaddrinfo is not None:
+            socket.getaddrinfo = system_getaddrinfo
+            system_getaddrinfo = None
+        dns_cache.clear()
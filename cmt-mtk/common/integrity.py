@@ -0,0 +1,55 @@
+import os
+import json
+import time
+import threading
+
+
+class Manifest:
+    """
+    Append-only JSON Lines record of every downloaded file and its checksums.
+
+    Checksums are computed while the bytes come off the network, never by reading
+    the file back. Files downloaded sequentially get one SHA-256; files downloaded as
+    parallel byte ranges get one SHA-256 per range ("pieces", as in BitTorrent).
+    Archives that were extracted while streaming are recorded by URL with no path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def record(self, path, size, url=None, sha256=None, pieces=None):
+        entry = {
+            "path": os.path.abspath(path) if path else None,
+            "url": url,
+            "size": size,
+            "sha256": sha256,
+            "pieces": pieces,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def entries(self):
+        """Latest entry per path (or per URL for entries without a path)."""
+        latest = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        latest[entry["path"] or entry["url"]] = entry
+        return latest
+
+
+def is_size_valid(file_path, expected_size, min_size=1024):
+    """
+    A download is complete only if it has exactly the advertised Content-Length.
+    Without one, fall back to a minimum plausible size.
+    """
+    if not os.path.exists(file_path):
+        return False
+    size = os.path.getsize(file_path)
+    return size == expected_size if expected_size else size > min_size
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the request latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+COUNTERS = ("bytes", "requests", "retries", "errors", "files")
+
+
+class WorkerCounters:
+    """
+    Counters owned by a single thread. Only that thread ever writes them, so the
+    download loops can bump them with a plain += and no lock. Readers sum them
+    while they change, which is fine for progress and monitoring.
+    """
+
+    __slots__ = COUNTERS + ("latency_counts", "latency_sum", "thread")
+
+    def __init__(self, thread=None):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.thread = thread
+
+    def observe_latency(self, seconds):
+        self.latency_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_sum += seconds
+
+    def add_to(self, other):
+        for name in COUNTERS:
+            setattr(other, name, getattr(other, name) + getattr(self, name))
+        for i, count in enumerate(self.latency_counts):
+            other.latency_counts[i] += count
+        other.latency_sum += self.latency_sum
+
+
+class Metrics:
+    """
+    Download counters (bytes, requests, retries, errors, finished files) and a
+    request latency histogram, kept per worker thread and only summed when a
+    snapshot is taken. Workers call metrics.worker() once and then update the
+    returned WorkerCounters directly in their loop.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.workers = []
+        self.retired = WorkerCounters()  # Totals of threads that have exited
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+    def worker(self):
+        """The calling thread's counters, registered on first use."""
+        counters = getattr(self.local, "counters", None)
+        if counters is None:
+            counters = self.local.counters = WorkerCounters(threading.current_thread())
+            with self.lock:
+                self.workers.append(counters)
+        return counters
+
+    def snapshot(self):
+        """Sum every worker's counters into a plain dict."""
+        total = WorkerCounters()
+        with self.lock:
+            # Fold finished threads into one record, so short lived pools don't pile up
+            alive = []
+            for counters in self.workers:
+                if counters.thread.is_alive():
+                    alive.append(counters)
+                else:
+                    counters.add_to(self.retired)
+            self.workers = alive
+            self.retired.add_to(total)
+            for counters in alive:
+                counters.add_to(total)
+        elapsed = time.time() - self.start_time
+        snapshot = {name: getattr(total, name) for name in COUNTERS}
+        snapshot.update({
+            "elapsed": elapsed,
+            "bytes_per_second": total.bytes / max(elapsed, 1e-5),
+            "latency_buckets": list(LATENCY_BUCKETS) + ["+Inf"],
+            "latency_counts": total.latency_counts,
+            "latency_sum": total.latency_sum,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+        return snapshot
+
+    def export(self, path, snapshot=None):
+        """Write a snapshot to path, as Prometheus text if it ends in .prom and as JSON otherwise."""
+        snapshot = snapshot or self.snapshot()
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(to_prometheus(snapshot))
+            else:
+                json.dump(snapshot, f, indent=4)
+        os.replace(temp_path, path)
+
+
+def latency_quantile(snapshot, q):
+    """Estimate a latency quantile as the upper bound of the bucket it falls in."""
+    counts = snapshot["latency_counts"]
+    target = q * sum(counts)
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+        seen += count
+        if count and seen >= target:
+            return bound
+    return None
+
+
+def to_prometheus(snapshot, prefix="cmt_download"):
+    lines = []
+    for name in COUNTERS:
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {snapshot[name]}")
+    lines.append(f"# TYPE {prefix}_request_latency_seconds histogram")
+    cumulative = 0
+    for bound, count in zip(snapshot["latency_buckets"], snapshot["latency_counts"]):
+        cumulative += count
+        lines.append(f'{prefix}_request_latency_seconds_bucket{{le="{bound}"}} {cumulative}')
+    lines.append(f"{prefix}_request_latency_seconds_sum {snapshot['latency_sum']}")
+    lines.append(f"{prefix}_request_latency_seconds_count {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def format_progress(snapshot, total_bytes=None, total_files=None, eta=None):
+    """One status line: bytes (of total), rate, ETA, files, requests, retries, errors and p50/p95 latency."""
+    line = f"{snapshot['bytes'] / 1024 ** 2:.1f}"
+    if total_bytes:
+        line += f"/{total_bytes / 1024 ** 2:.1f}"
+    line += f" MB @ {snapshot['bytes_per_second'] / 1024 ** 2:.2f} MB/s"
+    if eta is not None:
+        line += f", ETA {format_duration(eta)}"
+    if total_files is not None:
+        line += f" | {snapshot['files']}/{total_files} files"
+    line += f" | {snapshot['requests']} requests, {snapshot['retries']} retries, {snapshot['errors']} errors"
+    p50, p95 = latency_quantile(snapshot, 0.5), latency_quantile(snapshot, 0.95)
+    if p50 is not None:
+        line += f" | latency p50 <{p50}s p95 <{p95}s"
+    return line
+
+
+class ProgressReporter:
+    """
+    Background thread that renders progress every interval seconds and, with an
+    export_path, writes a snapshot there every export_interval seconds. The
+    download loops never touch the terminal themselves.
+    With inline, the line is redrawn in place (for one interactive download),
+    otherwise a new line is printed each time (for long runs and logs).
+    eta, if given, is called with each snapshot and returns the seconds left (or None).
+    """
+
+    def __init__(self, metrics, interval=1.0, total_bytes=None, total_files=None, export_path=None,
+                 export_interval=10.0, inline=True, show=True, eta=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.inline = inline
+        self.show = show
+        self.eta = eta
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.last_export = 0.0
+
+    def report(self, final=False):
+        snapshot = self.metrics.snapshot()
+        if self.show:
+            eta = self.eta(snapshot) if self.eta is not None and not final else None
+            line = format_progress(snapshot, self.total_bytes, self.total_files, eta)
+            if self.inline:
+                sys.stderr.write("\r" + line + ("\n" if final else ""))
+                sys.stderr.flush()
+            else:
+                print(line)
+        if self.export_path and (final or time.time() - self.last_export >= self.export_interval):
+            self.metrics.export(self.export_path, snapshot)
+            self.last_export = time.time()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        if self.show or self.export_path:
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+            self.report(final=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import threading
+
+
+class RetryQueue:
+    """
+    Persistent queue of work items that failed and should be tried again later in
+    the same process, instead of restarting the script.
+
+    Every change is appended to a JSON Lines file (last entry per key wins), so the
+    attempt counts survive a crash and items that used up max_attempts are kept as a
+    dead-letter record. Attempt n is scheduled base_delay * 2 ** (n - 1) seconds
+    after the failure, capped at max_delay.
+    """
+
+    def __init__(self, path, max_attempts=5, base_delay=60.0, max_delay=1800.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.items = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from an interrupted run
+                    self.items[item["key"]] = item
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def save(self, item):
+        self.items[item["key"]] = item
+        with open(self.path, "a") as f:
+            f.write(json.dumps(item) + "\n")
+
+    def add(self, key, payload, error=None):
+        """Record a failed attempt of key, scheduling the next one or moving it to the dead letters."""
+        with self.lock:
+            previous = self.items.get(key)
+            attempts = previous["attempts"] + 1 if previous and previous["status"] == "pending" else 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            self.save({
+                "key": key,
+                "payload": payload,
+                "attempts": attempts,
+                "error": str(error) if error else None,
+                "next_attempt": time.time() + delay,
+                "status": "dead" if attempts >= self.max_attempts else "pending",
+            })
+
+    def done(self, key):
+        with self.lock:
+            if key in self.items and self.items[key]["status"] != "done":
+                self.save(dict(self.items[key], status="done"))
+
+    def pending(self):
+        with self.lock:
+            return [item for item in self.items.values() if item["status"] == "pending"]
+
+    def dead(self):
+        with self.lock:
+            return [item for item in self.items.values() if item["status"] == "dead"]
+
+    def drain(self, process):
+        """
+        Retry pending items as they become due, sleeping in between, until none are
+        left. process(payload) returns True when the item succeeded, anything else
+        (or an exception) counts as another failed attempt.
+        Returns the payloads that succeeded.
+        """
+        succeeded = []
+        while True:
+            pending = self.pending()
+            if not pending:
+                return succeeded
+            due = [item for item in pending if item["next_attempt"] <= time.time()]
+            if not due:
+                wait = min(item["next_attempt"] for item in pending) - time.time()
+                print(f"{len(pending)} failed items waiting for a retry, next one in {wait:.0f}s.")
+                time.sleep(max(wait, 0))
+                continue
+            for item in due:
+                try:
+                    ok, error = process(item["payload"]) is True, None
+                except Exception as e:
+                    ok, error = False, e
+                if ok:
+                    self.done(item["key"])
+                    succeeded.append(item["payload"])
+                else:
+                    self.add(item["key"], item["payload"], error)
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import head as pooled_head
+
+SMALL_SIZE = 64 * 1024 * 1024  # Assets up to this size (previews, excerpts) go to the fast lane
+
+
+def host_of(url):
+    return urlparse(url).hostname or ""
+
+
+class SizeCache:
+    """
+    URL -> size in bytes, learned from HEAD requests of earlier runs. Entries are
+    appended to a JSON Lines file (kept in memory only if path is None), the last
+    entry for a URL wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sizes = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from an interrupted run
+                    self.sizes[entry["url"]] = entry["size"]
+        elif path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self, url):
+        return self.sizes.get(url)
+
+    def store(self, url, size):
+        with self.lock:
+            self.sizes[url] = size
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({"url": url, "size": size, "time": time.time()}) + "\n")
+
+
+def learn_sizes(urls, size_cache, validator_cache=None, manifest=None, head=pooled_head, max_workers=8):
+    """
+    Return {url: size in bytes, or None if unknown} for every url. Sizes come from
+    previous downloads (manifest, validator_cache), then size_cache, and only the
+    rest is asked for with HEAD requests, in parallel. HEAD results are added to
+    size_cache so the next run doesn't send them again.
+    """
+    known = {}
+    if manifest is not None:
+        for entry in manifest.entries().values():
+            if entry.get("url") and entry.get("size"):
+                known[entry["url"]] = entry["size"]
+    sizes = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        entry = validator_cache.get(url) if validator_cache is not None else None
+        size = known.get(url) or (entry or {}).get("content_length") or size_cache.get(url)
+        if size:
+            sizes[url] = size
+        else:
+            missing.append(url)
+
+    def fetch(url):
+        try:
+            response = head(url, allow_redirects=True, timeout=30)
+            length = response.headers.get("content-length") if response.ok else None
+        except Exception as e:
+            print(f"Could not get the size of {url}: {e}")
+            return url, None
+        if length and length.isdigit():
+            size_cache.store(url, int(length))
+            return url, int(length)
+        return url, None
+
+    if len(missing) > 1:
+        print(f"Asking the size of {len(missing)} files...")
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            sizes.update(executor.map(fetch, missing))
+    return sizes
+
+
+class EtaEstimator:
+    """
+    Remaining time of a run from the bytes still to download and the current rate.
+    Jobs that turn out to need fewer bytes than estimated (skipped, failed, smaller
+    than expected) are reported with finish() so they stop counting.
+    Called with a Metrics snapshot, as ProgressReporter does.
+    """
+
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def finish(self, estimated, transferred):
+        with self.lock:
+            self.skipped += max(0, estimated - transferred)
+
+    def remaining_bytes(self, snapshot):
+        with self.lock:
+            return max(0, self.total_bytes - self.skipped - snapshot["bytes"])
+
+    def __call__(self, snapshot):
+        if not snapshot["bytes_per_second"]:
+            return None
+        return self.remaining_bytes(snapshot) / snapshot["bytes_per_second"]
+
+
+class Job:
+    def __init__(self, key, size, payload=None, host=None, estimated=False):
+        self.key = key
+        self.size = size
+        self.payload = payload
+        self.host = host
+        self.estimated = estimated  # Size was guessed, not learned
+
+
+class SizeScheduler:
+    """
+    Hands out jobs to workers so the run finishes as close as possible to total bytes
+    / aggregate bandwidth, instead of waiting on one huge archive picked up last.
+
+    Large jobs go longest-processing-time first: every free worker takes the largest
+    job left, so the biggest archives start at once and the small ones fill the gaps
+    at the end. The first fast_lanes workers take small jobs (<= small_size) first,
+    smallest first, so previews keep flowing while the archives download. Both kinds
+    of worker take the other lane's jobs when their own lane is empty.
+    At most host_limits[host] (or default_host_limit) jobs of a host run at once.
+    Jobs of unknown size (None) are assumed to be as large as the average known job.
+    """
+
+    def __init__(self, jobs, workers, fast_lanes=1, small_size=SMALL_SIZE, host_limits=None, default_host_limit=None):
+        known = [job.size for job in jobs if job.size]
+        average = sum(known) // len(known) if known else small_size + 1
+        for job in jobs:
+            if job.size is None:
+                job.size, job.estimated = average, True
+        self.small = sorted((job for job in jobs if job.size <= small_size), key=lambda job: job.size)
+        self.large = sorted((job for job in jobs if job.size > small_size), key=lambda job: -job.size)
+        self.workers = workers
+        self.fast_lanes = min(fast_lanes, workers - 1) if self.small and self.large else 0
+        self.host_limits = host_limits or {}
+        self.default_host_limit = default_host_limit
+        self.running = {}
+        self.condition = threading.Condition()
+        self.eta = EtaEstimator(sum(job.size for job in jobs))
+
+    def host_free(self, job):
+        limit = self.host_limits.get(job.host, self.default_host_limit)
+        return limit is None or self.running.get(job.host, 0) < limit
+
+    def take(self, fast=False):
+        """Block until a job can start and return it, or None once every job has been handed out."""
+        lanes = (self.small, self.large) if fast else (self.large, self.small)
+        with self.condition:
+            while self.small or self.large:
+                for lane in lanes:
+                    job = next((job for job in lane if self.host_free(job)), None)
+                    if job is not None:
+                        lane.remove(job)
+                        self.running[job.host] = self.running.get(job.host, 0) + 1
+                        return job
+                self.condition.wait(1.0)  # Every remaining job is on a host at its limit
+            return None
+
+    def finish(self, job, transferred=None):
+        """Report a job as done, with the bytes it actually downloaded if known (for the ETA)."""
+        with self.condition:
+            self.running[job.host] -= 1
+            self.condition.notify_all()
+        if transferred is not None:
+            self.eta.finish(job.size, transferred)
+
+    def run(self, process):
+        """
+        Run process(job.payload) on every job with self.workers threads. process may
+        return the bytes it downloaded. Returns {job.key: result}.
+        """
+        results = {}
+
+        def worker(fast):
+            while True:
+                job = self.take(fast)
+                if job is None:
+                    return
+                result = None
+                try:
+                    result = process(job.payload)
+                except Exception as e:
+                    print(f"Failed to process {job.key}: {e}")
+                finally:
+                    self.finish(job, result if type(result) is int else None)
+                results[job.key] = result
+
+        threads = [threading.Thread(target=worker, args=(i < self.fast_lanes,)) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
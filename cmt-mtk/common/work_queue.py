@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+
+
+class Lease:
+    """A claim on one work item, kept alive by the queue's heartbeat thread until completed or released."""
+
+    def __init__(self, queue, key, path, token):
+        self.queue = queue
+        self.key = key
+        self.path = path
+        self.token = token
+        self.lost = False  # Set when the lease expired and another node took the item over
+
+    def complete(self, result=None):
+        self.queue.complete(self, result)
+
+    def release(self):
+        self.queue.release(self)
+
+
+class LeaseQueue:
+    """
+    Work queue shared by several machines through a directory on the common
+    filesystem (e.g. /data4), so each song or forum thread is processed by one node.
+
+    Work items are plain string keys that every node lists for itself (e.g. song
+    folders). A node claims an item by creating leases/<hash>.lease with O_EXCL,
+    which is atomic on NFS as well as local disks (SQLite's locking is not reliable
+    on NFS). A heartbeat thread refreshes the mtime of every held lease every
+    lease_seconds / 3; a lease whose mtime is older than lease_seconds belongs to a
+    dead node and is taken over. Finished items get a done/<hash>.json marker and are
+    skipped from then on, released (failed) items can be claimed again.
+    Node clocks only need to agree to well within lease_seconds.
+    """
+
+    def __init__(self, queue_dir, lease_seconds=600, node=None):
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.node = node or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_dir = os.path.join(queue_dir, "leases")
+        self.done_dir = os.path.join(queue_dir, "done")
+        os.makedirs(self.lease_dir, exist_ok=True)
+        os.makedirs(self.done_dir, exist_ok=True)
+        self.held = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    def item_name(self, key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def lease_path(self, key):
+        return os.path.join(self.lease_dir, self.item_name(key) + ".lease")
+
+    def done_path(self, key):
+        return os.path.join(self.done_dir, self.item_name(key) + ".json")
+
+    def is_done(self, key):
+        return os.path.exists(self.done_path(key))
+
+    def claim(self, key):
+        """Try to lease one item. Returns a Lease, or None if it is done or leased by a live node."""
+        if self.is_done(key):
+            return None
+        path = self.lease_path(key)
+        token = uuid.uuid4().hex
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if not self.take_over_expired(path):
+                    return None
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"key": key, "node": self.node, "token": token, "claimed": time.time()}, f)
+            if self.is_done(key):  # Finished by another node between the check above and the claim
+                os.remove(path)
+                return None
+            lease = Lease(self, key, path, token)
+            with self.lock:
+                self.held[key] = lease
+            self.start_heartbeat()
+            return lease
+        return None
+
+    def take_over_expired(self, path):
+        """Remove a lease whose heartbeat stopped. Only one node wins the rename if several try at once."""
+        try:
+            if time.time() - os.path.getmtime(path) < self.lease_seconds:
+                return False
+            expired_path = f"{path}.expired.{uuid.uuid4().hex}"
+            os.rename(path, expired_path)
+        except FileNotFoundError:
+            return True  # Released or taken over by someone else in the meantime, try to claim it
+        with open(expired_path) as f:
+            try:
+                print(f"Lease of {json.load(f).get('node')} on {os.path.basename(path)} expired, requeueing it.")
+            except ValueError:
+                pass
+        os.remove(expired_path)
+        return True
+
+    def owns(self, lease):
+        try:
+            with open(lease.path) as f:
+                return json.load(f).get("token") == lease.token
+        except (OSError, ValueError):
+            return False
+
+    def complete(self, lease, result=None):
+        """Mark the item done for every node and drop the lease."""
+        temp_path = f"{self.done_path(lease.key)}.{lease.token}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"key": lease.key, "node": self.node, "finished": time.time(), "result": result}, f)
+        os.replace(temp_path, self.done_path(lease.key))
+        self.release(lease)
+
+    def release(self, lease):
+        """Give an item back (e.g. after a failure) so any node can claim it again."""
+        with self.lock:
+            self.held.pop(lease.key, None)
+        if self.owns(lease):
+            try:
+                os.remove(lease.path)
+            except FileNotFoundError:
+                pass
+
+    def node_order(self, keys):
+        """Rotate keys to start at a point that depends on the node, so nodes rarely race for the same item."""
+        keys = list(keys)
+        if not keys:
+            return keys
+        start = int(hashlib.sha1(self.node.encode("utf-8")).hexdigest(), 16) % len(keys)
+        return keys[start:] + keys[:start]
+
+    def claims(self, keys):
+        """
+        Yield a Lease for every item of keys this node manages to claim, claiming the
+        next one only when the caller asks for it. The caller must complete() or
+        release() every lease it gets.
+        """
+        for key in self.node_order(keys):
+            lease = self.claim(key)
+            if lease is not None:
+                yield lease
+
+    def start_heartbeat(self):
+        with self.lock:
+            if self.heartbeat_thread is None:
+                self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+                self.heartbeat_thread.start()
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.lock:
+                leases = list(self.held.values())
+            for lease in leases:
+                if not self.owns(lease):
+                    if not lease.lost:
+                        print(f"Lost the lease on {lease.key}, another node has taken it over.")
+                    lease.lost = True
+                    continue
+                now = time.time()
+                try:
+                    os.utime(lease.path, (now, now))
+                except FileNotFoundError:
+                    lease.lost = True
+
+    def status(self):
+        """Number of finished items and of items currently leased (by any node)."""
+        return {
+            "done": len([f for f in os.listdir(self.done_dir) if f.endswith(".json")]),
+            "leased": len([f for f in os.listdir(self.lease_dir) if f.endswith(".lease")]),
+        }
+
+    def close(self):
+        """Stop the heartbeat and give back every lease still held."""
+        self.stopped.set()
+        with self.lock:
+            leases = list(self.held.values())
+        for lease in leases:
+            self.release(lease)
+
+
+def run_queue(queue, keys, process, max_workers=4, is_complete=lambda result: True, ordered=False):
+    """
+    Run process(key) on every item of keys this node can claim, with max_workers
+    threads that each claim their next item only once they are free (so idle nodes
+    can pick up the rest). Items whose result fails is_complete, or whose process
+    raised, are released for another attempt instead of being marked done.
+    With ordered, items are tried in the order of keys (e.g. largest first) on every
+    node instead of a per-node rotation. Returns {key: result} for the items processed here.
+    """
+    pending = iter(list(keys) if ordered else queue.node_order(keys))
+    pending_lock = threading.Lock()
+    results = {}
+
+    def worker():
+        while True:
+            with pending_lock:
+                key = next(pending, None)
+            if key is None:
+                return
+            lease = queue.claim(key)
+            if lease is None:
+                continue
+            try:
+                result = process(key)
+            except Exception as e:
+                print(f"Failed to process {key}: {e}")
+                lease.release()
+                continue
+            results[key] = result
+            if is_complete(result):
+                lease.complete()
+            else:
+                lease.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(max_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
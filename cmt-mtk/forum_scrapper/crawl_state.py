@@ -0,0 +1,74 @@
+"""
+    High-water marks for incremental crawls of the song forums.
+
+    Song forums are listed newest thread first (MyBB's sortby=started), so a refresh
+    only has to read pages until it reaches a thread it already has. Each song entry
+    of the genre JSON keeps the id of the newest thread crawled so far under
+    "high_water_mark", and new threads are merged in front of the known ones.
+"""
+
+import re
+import json
+import os
+
+# Newest threads first, sticky threads aside. The default order (last post) would bring old threads back on page 1.
+SORT_BY_START = "&sortby=started&order=desc"
+THREAD_ID = re.compile(r"[?&]tid=(\d+)")
+
+
+def thread_id(link):
+    """Thread id of a showthread.php?tid=<n> link, None if it has none."""
+    match = THREAD_ID.search(link or "")
+    return int(match.group(1)) if match else None
+
+
+def listing_url(forum_link, page):
+    return f"{forum_link}{SORT_BY_START}" + (f"&page={page}" if page > 1 else "")
+
+
+def load_metadata(file_name):
+    """Genre JSON of a previous run, {} if there is none."""
+    if not os.path.exists(file_name):
+        return {}
+    try:
+        with open(file_name, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read previous metadata from {file_name}, crawling from scratch: {e}")
+        return {}
+
+
+def newest_thread_id(threads):
+    ids = [thread_id(thread['Thread Link']) for thread in threads]
+    return max((tid for tid in ids if tid is not None), default=None)
+
+
+def high_water_mark(entry):
+    """Newest thread id crawled for a song entry, None to crawl the whole forum."""
+    if 'high_water_mark' in entry:
+        return entry['high_water_mark']
+    return newest_thread_id(entry.get('threads', []))  # Metadata from before incremental crawls
+
+
+def reached_mark(threads, mark):
+    """Whether a listing page ends with an already crawled thread, so older pages can be skipped."""
+    if mark is None or not threads:
+        return False
+    tid = thread_id(threads[-1]['Thread Link'])
+    return tid is not None and tid <= mark
+
+
+def merge_threads(new_threads, old_threads):
+    """New threads first, then the known ones not seen again. Threads seen again take their fresh views and rating."""
+    seen = {thread['Thread Link'] for thread in new_threads if thread['Thread Link'] != "none"}
+    return new_threads + [thread for thread in old_threads if thread['Thread Link'] not in seen]
+
+
+def merge_songs(song_dict, previous):
+    """Carry threads and high-water marks of a previous run over to the songs found on the genre page."""
+    for key, value in song_dict.items():
+        if key in previous:
+            song_dict[key] = {**previous[key], **value}
+    for key, value in previous.items():
+        song_dict.setdefault(key, value)  # Keep songs no longer listed rather than losing their threads
+    return song_dict
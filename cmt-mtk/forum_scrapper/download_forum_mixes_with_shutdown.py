@@ -1,116 +1,93 @@
 import os
-import json
-import requests
 import sys
-from requests.adapters import HTTPAdapter, Retry
-from bs4 import BeautifulSoup
-from tqdm import tqdm
-import time
-import random
-
-# Global counters
-fail_count = 0
-
-# Configure retry logic
-session = requests.Session()
-retries = Retry(total=5, backoff_factor=2, status_forcelist=[500, 502, 503, 504, 104])
-session.mount("https://", HTTPAdapter(max_retries=retries))
-
-HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-}
-
-def create_directory(path):
-    """Create a directory if it doesn't already exist."""
-    os.makedirs(path, exist_ok=True)
-
-def download_audio_file(thread, song_path):
-    """Download an audio file from a thread."""
-    global fail_count
-
-    file_name = os.path.join(song_path, f"{thread['Thread Author']}.mp3")
-    
-    if os.path.exists(file_name) and os.path.getsize(file_name) > 1024:
-        return True  # File already exists
-
-    url = "https://discussion.cambridge-mt.com/" + thread['Thread Link']
-
-    for attempt in range(5):
-        try:
-            response = session.get(url, headers=HEADERS, timeout=10)
-            if response.status_code == 400:
-                fail_count += 1
-                if fail_count >= 5:
-                    print("Too many 400 errors. Exiting...")
-                    sys.exit(1)  # Exit so Bash script can restart
-                return False
-
-            response.raise_for_status()
-            page_soup = BeautifulSoup(response.content, 'html.parser')
-            audio_element = page_soup.find("audio")
-
-            if not audio_element:
-                print(f"No audio found for {thread['Thread Author']}.")
-                # remove the entry
-                
-                return False
-
-            audio_source = audio_element.find("source")
-            if not audio_source or "src" not in audio_source.attrs:
-                print(f"No audio source found for {thread['Thread Author']}.")
-                return False
-
-            audio_url = audio_source["src"]
-            audio_response = session.get(audio_url, stream=True, headers=HEADERS, timeout=10)
-            audio_response.raise_for_status()
-
-            total_size = int(audio_response.headers.get('content-length', 0))
-
-            with open(file_name, "wb") as f, tqdm(
-                desc=f"Downloading {thread['Thread Author']} - {os.path.basename(song_path)}",
-                total=total_size,
-                unit="B",
-                unit_scale=True
-            ) as pbar:
-                for chunk in audio_response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-                        pbar.update(len(chunk))
-
-            return True
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error downloading {thread['Thread Author']}: {e}")
-            time.sleep(2 ** attempt + random.uniform(0.5, 1.5))
-
-    return False
-
-def download_audio_for_song(song, value, dataset_path):
-    """Download all audio files for a song."""
+from concurrent.futures import ThreadPoolExecutor
+
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+import http_client
+from retry_queue import RetryQueue
+from resolve_audio_urls import AudioUrlCache
+from metadata_log import MetadataLog, iter_metadata, log_path
+from metrics import ProgressReporter
+from mix_downloads import (MAX_WORKERS, audio_path, create_directory, download_audio_file, metrics, open_stores,
+                           resolve_audio)
+
+def download_audio_for_song(song, value, dataset_path, blob_store=None, validator_cache=None, manifest=None,
+                            url_cache=None, retry_queue=None):
+    """
+    Download all audio files for a song: first resolve the audio URL of every thread
+    whose mp3 is missing, then download the mp3s. Returns the threads with audio.
+    Threads that failed are added to retry_queue, if given.
+    """
     song_path = os.path.join(dataset_path, song)
     create_directory(song_path)
 
-    valid_threads = [thread for thread in value['threads'] if download_audio_file(thread, song_path)]
+    url_cache = url_cache or AudioUrlCache(None)
+    resolve_audio(value['threads'], url_cache, skip=lambda t: os.path.exists(audio_path(song_path, t)))
+
+    # The controller decides how many of these actually hit the forum at once
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        downloaded = list(executor.map(lambda t: download_audio_file(t, song_path, blob_store, validator_cache, manifest, url_cache), value['threads']))
+    valid_threads = [thread for thread, ok in zip(value['threads'], downloaded) if ok]
+    if retry_queue is not None:
+        for thread, ok in zip(value['threads'], downloaded):
+            key = f"{song}/{thread['Thread Author']}"
+            if ok:
+                retry_queue.done(key)  # Left over from an earlier run that crashed
+            elif ok is None:
+                retry_queue.add(key, {"song": song, "thread": thread}, "download failed")
     return valid_threads
 
-def clean_json(json_path, dataset_path):
-    """Remove songs that didn't have valid audio from JSON."""
-    with open(json_path, "r") as f:
-        data = json.load(f)
+def retry_audio_file(item, dataset_path, blob_store=None, validator_cache=None, manifest=None, url_cache=None):
+    """Retry one thread from the retry queue, resolving its audio URL again if that failed before."""
+    song_path = os.path.join(dataset_path, item["song"])
+    create_directory(song_path)
+    thread = item["thread"]
+    resolve_audio([thread], url_cache or AudioUrlCache(None), max_workers=1)
+    return download_audio_file(thread, song_path, blob_store, validator_cache, manifest, url_cache)
+
+def clean_json(json_path, dataset_path, blob_store=None, validator_cache=None, manifest=None, url_cache=None,
+               retry_queue=None):
+    """
+    Remove songs that didn't have valid audio from JSON.
+    Songs are read from the JSON one at a time and each cleaned song is checkpointed in
+    <name>_cleaned.jsonl, so a restart carries on after the last finished song, then
+    the log is compacted into <name>_cleaned.json.
+    With a retry_queue, threads that failed are retried after the first pass (with
+    backoff, in this process) and added to their song's record as each retry succeeds.
+    """
+    cleaned_json_path = json_path.replace(".json", "_cleaned.json")
+    log = MetadataLog(log_path(cleaned_json_path))
 
-    updated_data = {song: {"threads": download_audio_for_song(song, value, dataset_path)} for song, value in data.items() if value['threads']}
+    for song, value in iter_metadata(json_path):
+        if value.get('threads') and song not in log:
+            log.append(song, {"threads": download_audio_for_song(song, value, dataset_path, blob_store, validator_cache, manifest, url_cache, retry_queue)})
 
-    # Save cleaned JSON
-    cleaned_json_path = json_path.replace(".json", "_cleaned.json")
-    with open(cleaned_json_path, "w") as f:
-        json.dump(updated_data, f, indent=4)
+    if retry_queue is not None:
+        def retry_and_log(item):
+            """Log a recovered thread in its song's record before the queue marks it done."""
+            if retry_audio_file(item, dataset_path, blob_store, validator_cache, manifest, url_cache) is not True:
+                return False
+            entry = log.get(item["song"])
+            links = {thread["Thread Link"] for thread in entry["threads"]} if entry is not None else set()
+            if entry is not None and item["thread"]["Thread Link"] not in links:  # Else logged before a crash, not acked
+                entry["threads"].append(item["thread"])
+                log.append(item["song"], entry)
+            return True
 
-    print(f"Cleaned JSON saved at: {cleaned_json_path}")
+        retry_queue.drain(retry_and_log)
+        dead = retry_queue.dead()
+        if dead:
+            print(f"Gave up on {len(dead)} threads after {retry_queue.max_attempts} attempts, see {retry_queue.path}")
+
+    # Save cleaned JSON
+    log.compact(cleaned_json_path)
 
 def main():
     if len(sys.argv) != 3:
         print("Usage: python3 download_script.py <json_path> <audio_directory>")
         sys.exit(1)
+    http_client.install_dns_cache()
 
     json_path = sys.argv[1]
     audio_dir = sys.argv[2]
@@ -119,8 +96,13 @@ def main():
     dataset_path = os.path.join(audio_dir, dataset_name)
     create_directory(dataset_path)
 
+    blob_store, validator_cache, manifest, url_cache = open_stores(audio_dir)
+    # Failed threads are retried later in this run, the file keeps attempt counts and give-ups across runs
+    retry_queue = RetryQueue(os.path.join(dataset_path, ".retry_queue.jsonl"))
+
     print(f"Processing dataset: {dataset_name}")
-    clean_json(json_path, dataset_path)
+    with ProgressReporter(metrics, interval=10, export_path=os.path.join(audio_dir, ".metrics.json"), inline=False):
+        clean_json(json_path, dataset_path, blob_store, validator_cache, manifest, url_cache, retry_queue)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,93 @@
+"""
+    Concurrent crawl of the song forums listed on a genre page.
+
+    Songs are crawled in parallel, and as soon as page 1 of a song forum gives its page
+    count, all its other pages are requested at once. How many of these requests reach
+    the forum at a time, and how far apart, is up to the fetch function the caller
+    passes in (going through the script's AIMDController, shared by every thread and
+    every genre). Its min_interval is the politeness floor: requests never start closer
+    together than that, so concurrency only stops the crawl from waiting on one
+    response at a time, it doesn't raise the request rate past the floor.
+    In an incremental crawl, pages are read one after the other instead, since the
+    first one or two usually reach threads the previous run already has.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from page_parsers import page_count
+from crawl_state import listing_url, high_water_mark, newest_thread_id, reached_mark, merge_threads
+
+MAX_WORKERS = 8  # Songs crawled at once, and pages of a song requested at once
+
+
+def crawl_forum(forum_link, fetch, parse_threads, mark=None, pages_executor=None, fetch_first=None):
+    """
+    Threads of a song forum (down to the high-water mark, if any) and whether no page
+    was missing, or None if its first page can't be fetched. fetch(url) returns the
+    page HTML or None, fetch_first (fetch by default) is used for page 1.
+    """
+    first_html = (fetch_first or fetch)(listing_url(forum_link, 1))
+    if not first_html:
+        return None
+
+    pages_number = page_count(first_html)
+    if pages_number is None:
+        print(f"Could not parse pages for {forum_link}, defaulting to 1.")
+        pages_number = 1
+
+    threads = parse_threads(first_html)
+    pages = range(2, pages_number + 1)
+    prefetched = None
+    if mark is None and pages_executor is not None:
+        prefetched = pages_executor.map(lambda i: fetch(listing_url(forum_link, i)), pages)
+
+    complete = True
+    for i in pages:
+        if reached_mark(threads, mark):
+            break  # Older pages were crawled by a previous run
+        page_html = next(prefetched) if prefetched is not None else fetch(listing_url(forum_link, i))
+        if not page_html:
+            print(f"Skipping page {i} of {forum_link} due to request failure.")
+            complete = False
+            continue
+        threads.extend(parse_threads(page_html))
+    return threads, complete
+
+
+def crawl_songs(song_dict, fetch, parse_threads, incremental=True, fetch_first=None, max_workers=MAX_WORKERS,
+                desc=None, on_done=None):
+    """
+    Set the threads and high-water mark of every song of song_dict, crawling max_workers
+    songs at once. With incremental, new threads are merged in front of the known ones.
+    With on_done, each song is handed to on_done(key, value, crawled) as soon as it is
+    finished (crawled is False if its forum couldn't be fetched) and removed from
+    song_dict, so finished songs don't stay in memory.
+    """
+    with ThreadPoolExecutor(max_workers) as songs_executor, ThreadPoolExecutor(max_workers) as pages_executor:
+        def crawl_song(key):
+            value = song_dict[key]
+            crawled = crawl_song_threads(key, value)
+            if on_done is not None:
+                on_done(key, value, crawled)
+                del song_dict[key]
+
+        def crawl_song_threads(key, value):
+            mark = high_water_mark(value) if incremental else None
+            result = crawl_forum(value['forum_link'], fetch, parse_threads, mark, pages_executor, fetch_first)
+            if result is None:
+                print(f"Skipping {key} due to request failure.")
+                return False
+            threads, complete = result
+            if incremental:
+                threads = merge_threads(threads, value.get('threads', []))
+            value['threads'] = threads
+            # Past a missing page the mark stays where it was, so its threads are looked for again next run
+            value['high_water_mark'] = newest_thread_id(threads) if complete else mark
+            return True
+
+        futures = [songs_executor.submit(crawl_song, key) for key in list(song_dict)]
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc or "Scraping thread data"):
+            future.result()
+    return song_dict
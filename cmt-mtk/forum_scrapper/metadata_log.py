@@ -0,0 +1,184 @@
+"""
+    Song-by-song checkpoints of forum metadata, and streaming access to the genre JSONs.
+
+    A scrape (or clean_json) appends every song to a JSON Lines log as soon as it is
+    done, so a crash loses at most the songs in progress, and a restart skips the songs
+    already in the log. Once every song is in, compact() writes the usual JSON
+    ({song: {"forum_link": ..., "threads": [...]}, ...}, same formatting as
+    json.dump(indent=4)) and removes the log. Neither step holds all songs in memory:
+    the log keeps the offset of each song's last record, and records are read back one
+    at a time.
+"""
+
+import os
+import json
+import threading
+
+DELIMITERS = ",:]} \t\r\n"
+
+
+def write_json_object(path, items):
+    """Write (key, value) pairs as one JSON object, like json.dump(dict(items), f, indent=4) but streaming."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write("{")
+        empty = True
+        for key, value in items:
+            f.write("\n    " if empty else ",\n    ")
+            f.write(json.dumps(key) + ": " + json.dumps(value, indent=4).replace("\n", "\n    "))
+            empty = False
+        f.write("}" if empty else "\n}")
+    os.replace(temp_path, path)
+
+
+def iter_json_object(path, chunk_size=1024 * 1024):
+    """(key, value) pairs of the top-level object of a JSON file, parsed one at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer, position = "", 0
+
+        def fill():
+            nonlocal buffer, position
+            chunk = f.read(chunk_size)
+            buffer, position = buffer[position:] + chunk, 0
+            return bool(chunk)
+
+        def skip_space():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer) or not fill():
+                    return
+
+        def parse():
+            nonlocal position
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                    # A number cut by the end of the chunk (1 of 1e20) only counts once followed by a delimiter
+                    if end < len(buffer) and buffer[end] in DELIMITERS:
+                        position = end
+                        return value
+                except ValueError:
+                    pass
+                if not fill():
+                    value, position = decoder.raw_decode(buffer, position)  # Raises on a truncated file
+                    return value
+
+        def expect(chars):
+            nonlocal position
+            skip_space()
+            char = buffer[position:position + 1]
+            if not char or char not in chars:
+                raise ValueError(f"Expected one of {chars!r} in {path}, found {char!r}")
+            position += 1
+            return char
+
+        expect("{")
+        skip_space()
+        if buffer[position:position + 1] == "}":
+            return
+        while True:
+            skip_space()
+            key = parse()
+            expect(":")
+            skip_space()
+            yield key, parse()
+            if expect(",}") == "}":
+                return
+
+
+def iter_metadata(path):
+    """(song, entry) pairs of a genre JSON, or of a scrape's log if path is a .jsonl."""
+    if path.endswith(".jsonl"):
+        return MetadataLog(path).items()
+    return iter_json_object(path)
+
+
+def log_path(json_path):
+    return os.path.splitext(json_path)[0] + ".jsonl"
+
+
+class MetadataLog:
+    """
+    Append-only JSON Lines log of song entries, {"song": ..., "crawled": ..., "data": {...}}
+    per line, the last record of a song wins. Songs that failed (crawled False) are kept
+    with their old data, so they still end up in the JSON, but are not skipped on resume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}  # Song -> offset of its last record
+        self.crawled = set()
+        self.lock = threading.Lock()
+        end = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Partial record of an interrupted run
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self.index(record, end)
+                    end += len(line)
+            if end < os.path.getsize(path):
+                print(f"Dropping a partial record at the end of {path}.")
+                os.truncate(path, end)
+            if self.offsets:
+                print(f"Resuming from {path}: {len(self.crawled)} songs done.")
+        self.file = open(path, "ab")
+
+    def index(self, record, offset):
+        self.offsets[record["song"]] = offset
+        if record["crawled"]:
+            self.crawled.add(record["song"])
+        else:
+            self.crawled.discard(record["song"])
+
+    def __contains__(self, song):
+        return song in self.crawled
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, song, data, crawled=True):
+        record = {"song": song, "crawled": crawled, "data": data}
+        line = (json.dumps(record) + "\n").encode()
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.index(record, offset)
+
+    def get(self, song):
+        """Last entry logged for song, None if there is none."""
+        offset = self.offsets.get(song)
+        if offset is None:
+            return None
+        with open(self.path, "rb") as f:
+            return self.read(f, offset)
+
+    def read(self, f, offset):
+        f.seek(offset)
+        return json.loads(f.readline())["data"]
+
+    def items(self, order=None):
+        """(song, entry) pairs, songs of order first (in that order), then the others in log order."""
+        songs = [song for song in order or [] if song in self.offsets]
+        listed = set(songs)
+        songs += [song for song in self.offsets if song not in listed]
+        with open(self.path, "rb") as f:
+            for song in songs:
+                yield song, self.read(f, self.offsets[song])
+
+    def compact(self, json_path, order=None):
+        """Write the entries as a genre JSON to json_path, then delete the log."""
+        with self.lock:
+            self.file.close()
+        write_json_object(json_path, self.items(order))
+        os.remove(self.path)
+        print(f"Metadata saved to {json_path}.")
@@ -0,0 +1,162 @@
+"""
+    Download stage of the forum mixes, shared by dwnld_forum_mixes.py and
+    download_forum_mixes_with_shutdown.py: the mp3 of every thread, once resolved
+    (see resolve_audio_urls.py), is downloaded through one session, host controller
+    and set of read buffers, and revalidated on later runs.
+"""
+
+import os
+import hashlib
+
+import requests
+
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+import http_client
+from host_controller import AIMDController
+from circuit_breaker import CircuitBreakers, CircuitOpenError
+from blob_store import BlobStore
+from http_cache import ValidatorCache
+from integrity import Manifest, is_size_valid
+from metrics import Metrics
+from buffered_io import BufferPool, save_response
+from resolve_audio_urls import AudioUrlCache, resolve_threads
+
+FORUM_URL = "https://discussion.cambridge-mt.com/"
+MAX_WORKERS = 8
+RESOLVE_WORKERS = 4  # Thread pages fetched at once when resolving audio URLs
+
+# Add User-Agent to prevent server rejection
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# Shared keep-alive session with the common retry policy, error statuses are left to the controller below
+session = http_client.session(pool_size=MAX_WORKERS, status_retries=False)
+# Per-thread download counters, shared by every worker and reported by the scripts
+metrics = Metrics()
+# Adapts request rate and parallelism per host instead of fixed sleeps, so 400s slow us down instead of
+# forcing a restart. A host that keeps failing is paused (its threads are retried later) instead of being hammered.
+breakers = CircuitBreakers(failure_threshold=5, reset_timeout=30)
+controller = AIMDController(initial_concurrency=1, max_concurrency=MAX_WORKERS, metrics=metrics, breakers=breakers)
+# Read buffers reused by every download, two per worker so reading and writing overlap
+buffer_pool = BufferPool(count=2 * MAX_WORKERS, size=1024 * 1024)
+
+def create_directory(path):
+    """Create a directory if it doesn't already exist."""
+    os.makedirs(path, exist_ok=True)
+
+def open_stores(audio_dir, revalidate=True):
+    """
+    Blob store, validator cache (None without revalidate), manifest and audio URL cache
+    of audio_dir. Forum mixes of every genre share them, so re-uploads and songs listed
+    under several genres are kept once, and thread pages aren't fetched again on reruns.
+    """
+    blob_store = BlobStore(os.path.join(audio_dir, ".blobs"))
+    # Existing mixes are revalidated with a conditional HEAD instead of being trusted blindly
+    validator_cache = ValidatorCache(os.path.join(audio_dir, ".http_cache.jsonl")) if revalidate else None
+    manifest = Manifest(os.path.join(audio_dir, ".manifest.jsonl"))
+    url_cache = AudioUrlCache(os.path.join(audio_dir, ".audio_urls.jsonl"))  # Thread link -> mp3 URL
+    return blob_store, validator_cache, manifest, url_cache
+
+def audio_path(song_path, thread):
+    """Where the mp3 of a thread is saved."""
+    return os.path.join(song_path, f"{thread['Thread Author']}.mp3")
+
+def resolve_audio(threads, url_cache, skip=None, max_workers=RESOLVE_WORKERS):
+    """Resolve the audio URL of threads (see resolve_audio_urls.resolve_threads) through the controller."""
+    return resolve_threads(threads, url_cache, lambda url, **kwargs: controller.request(session.get, url, **kwargs),
+                           FORUM_URL, max_workers=max_workers, skip=skip)
+
+def is_audio_current(file_name, validator_cache):
+    """
+    Revalidate an existing audio file against the URL it was downloaded from.
+    Files without a cache entry (downloaded before the cache existed) are trusted.
+    """
+    entry = validator_cache.for_path(file_name)
+    if entry is None:
+        return True
+    try:
+        unchanged, _ = validator_cache.revalidate(
+            entry["url"], head=lambda url, **kwargs: controller.request(session.head, url, **kwargs), headers=HEADERS)
+    except requests.exceptions.RequestException as e:
+        print(f"Could not revalidate {file_name}, keeping it: {e}")
+        return True
+    return unchanged
+
+def download_audio_file(thread, song_path, blob_store=None, validator_cache=None, manifest=None, url_cache=None):
+    """
+    Download the mp3 of a thread, already resolved to thread["Audio URL"] by
+    resolve_audio, with retries and file validation. It is written to <name>.part and
+    only renamed to <name>.mp3 once complete, so an existing mp3 is never a partial download.
+    The file is hashed (SHA-256) while it downloads, and recorded in the manifest if given.
+    With a blob_store, the file is deduplicated into the store.
+    With a validator_cache, an existing file is only kept if the mp3 is unchanged upstream.
+    An audio URL that is gone (404/410) is dropped from url_cache, to be resolved again next run.
+    Returns True if the mp3 is there, False if the thread has no audio and None if the
+    download failed in a way worth retrying later (request errors, open circuit).
+    """
+    file_name = audio_path(song_path, thread)
+    temp_path = file_name + ".part"
+
+    # Avoid re-downloading if file exists and is valid
+    if os.path.exists(file_name) and os.path.getsize(file_name) > 1024:
+        if validator_cache is None or is_audio_current(file_name, validator_cache):
+            return True
+        print(f"Audio file {file_name} changed upstream. Redownloading...")
+        os.remove(file_name)
+    elif os.path.exists(file_name):
+        print(f"Corrupt or incomplete file found: {file_name}. Redownloading...")
+        os.remove(file_name)
+
+    if "Audio URL" not in thread:
+        print(f"Audio URL of {thread['Thread Author']} could not be resolved, skipping.")
+        return None
+    audio_url = thread["Audio URL"]
+    if not audio_url:
+        print(f"No audio element found on the page: {FORUM_URL + thread['Thread Link']}")
+        return False
+
+    counters = metrics.worker()
+    for attempt in range(5):  # Retry up to 5 times
+        if attempt:
+            counters.retries += 1
+        try:
+            audio_response = controller.request(session.get, audio_url, stream=True, headers=HEADERS, timeout=10)
+            with audio_response:  # Closing it frees the controller slot held while the body is read
+                if audio_response.status_code in (404, 410):
+                    print(f"Audio URL of {thread['Thread Author']} is gone, it will be resolved again next run.")
+                    if url_cache is not None:
+                        url_cache.forget(thread["Thread Link"])
+                    return False
+                audio_response.raise_for_status()  # A 400 means the forum is throttling us, retry after the controller backs off
+                total_size = int(audio_response.headers.get('content-length', 0))
+
+                digest = hashlib.sha256()
+                save_response(audio_response, temp_path, buffer_pool, digest.update, counters)
+
+            if not is_size_valid(temp_path, total_size):
+                print(f"File {file_name} is incomplete, retrying...")
+                os.remove(temp_path)
+                continue
+            os.replace(temp_path, file_name)
+            if manifest is not None:
+                manifest.record(file_name, os.path.getsize(file_name), url=audio_url, sha256=digest.hexdigest())
+            if blob_store is not None:
+                blob_store.add(file_name, digest.hexdigest())
+            if validator_cache is not None:
+                validator_cache.store(audio_url, audio_response.headers, file_name)
+            counters.files += 1
+            print(f"Audio file downloaded successfully: '{file_name}'.")
+            return True
+
+        except CircuitOpenError as e:
+            print(f"Postponing {thread['Thread Author']}: {e}")
+            return None
+        except requests.exceptions.RequestException as e:
+            # The controller has already slowed this host down, no extra sleep needed
+            print(f"Error on attempt {attempt + 1} for {thread['Thread Author']}: {e}")
+
+    print(f"Failed to download audio after multiple attempts for {thread['Thread Author']}.")
+    return None
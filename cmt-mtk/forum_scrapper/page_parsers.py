@@ -0,0 +1,153 @@
+"""
+    Parsers for the MyBB forum pages, shared by the scrapers and the downloaders.
+
+    Two backends return the same results:
+    - "fast" (default) only looks at the part of the page that is needed: thread pages
+      are scanned from the first <audio> tag and the scan stops at its <source>, and
+      for listing pages only the stretch of HTML holding the thread rows (or the
+      "Pages" element) is parsed, not the header, navigation and footer around them.
+    - "soup" is the plain full-page BeautifulSoup parse, kept as the reference.
+    HTML comments are dropped before the fast scans, so commented-out markup is ignored
+    like the soup backend ignores it.
+
+    python page_parsers.py [page.html ...] checks that both backends agree, on built-in
+    edge cases and on the given pages.
+"""
+
+import re
+import sys
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+BACKEND = "fast"
+# Tree builder used by BeautifulSoup. "lxml" is faster when installed, but may repair broken markup differently.
+PARSER = "html.parser"
+
+AUDIO_TAG = re.compile(r"<audio[\s>/]", re.IGNORECASE)
+# Start tags whose class attribute holds the class as one of its space-separated tokens
+ROW_TAG = re.compile(r"""<tr\s[^>]*class=["'](?:[^"']*\s)?inline_row[\s"']""", re.IGNORECASE)
+PAGES_TAG = re.compile(r"""<span\s[^>]*class=["'](?:[^"']*\s)?pages[\s"']""", re.IGNORECASE)
+COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+
+# (html, audio_source, page_count) pages both backends must agree on
+PARITY_CASES = [
+    ('<span class="pages x">Pages (3):</span>', None, 3),
+    ('<!-- <audio><source src="a.mp3"></audio> --><audio><source src="b.mp3"></audio>', "b.mp3", 1),
+    ('<!-- <span class="pages">Pages (5):</span> --><span class="pages">Pages (2):</span>', None, 2),
+    ('<span class="pagesx">Pages (4):</span>', None, 1),
+    ('<audio controls><source src="c.mp3" type="audio/mpeg"></audio>', "c.mp3", 1),
+    ('<table><!-- <tr class="inline_row"><td>old</td></tr> --><tr class="trow inline_row"><td>new</td></tr></table>',
+     None, 1),
+]
+
+
+class FoundSource(Exception):
+    pass
+
+
+class AudioSourceScanner(HTMLParser):
+    """Finds the first <source> inside the first <audio>, then stops tokenizing."""
+
+    def __init__(self):
+        super().__init__()
+        self.in_audio = False
+        self.audio_seen = False
+        self.source = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "audio" and not self.audio_seen:
+            self.in_audio = self.audio_seen = True
+        elif tag == "source" and self.in_audio:
+            # Valueless attributes are "" in BeautifulSoup, None here
+            self.source = {name: value if value is not None else "" for name, value in attrs}
+            raise FoundSource()
+
+    def handle_endtag(self, tag):
+        if tag == "audio" and self.in_audio:
+            self.in_audio = False
+            raise FoundSource()  # An <audio> without <source>
+
+
+def decode(html):
+    """Text of a page with its comments removed."""
+    text = html.decode("utf-8", errors="replace") if isinstance(html, bytes) else html
+    return COMMENT.sub("", text) if "<!--" in text else text
+
+
+def audio_source(html, backend=None):
+    """src of the <source> of the first <audio> of a thread page, None if it has none."""
+    if (backend or BACKEND) == "soup":
+        page_soup = BeautifulSoup(html, PARSER)
+        audio_element = page_soup.find("audio")
+        source = audio_element.find("source") if audio_element else None
+        return source["src"] if source and "src" in source.attrs else None
+
+    text = decode(html)
+    match = AUDIO_TAG.search(text)
+    if match is None:
+        return None
+    scanner = AudioSourceScanner()
+    try:
+        scanner.feed(text[match.start():])
+        scanner.close()
+    except FoundSource:
+        pass
+    return scanner.source.get("src") if scanner.source else None
+
+
+def thread_rows(html, backend=None):
+    """The <tr class="inline_row"> thread rows of a forum listing page, as BeautifulSoup tags."""
+    if (backend or BACKEND) == "soup":
+        return BeautifulSoup(html, PARSER).find_all("tr", class_="inline_row")
+    text = decode(html)
+    starts = [match.start() for match in ROW_TAG.finditer(text)]
+    if not starts:
+        return []
+    end = text.lower().find("</tr>", starts[-1])
+    region = text[starts[0]:end + len("</tr>") if end >= 0 else len(text)]
+    return BeautifulSoup(region, PARSER).find_all("tr", class_="inline_row")
+
+
+def page_count(html, backend=None):
+    """Number of pages of a forum listing from its "Pages (N):" element, None if it has none or it can't be read."""
+    if (backend or BACKEND) == "soup":
+        pages_element = BeautifulSoup(html, PARSER).find("span", class_="pages")
+    else:
+        text = decode(html)
+        match = PAGES_TAG.search(text)
+        end = text.lower().find("</span>", match.end()) if match else -1
+        region = text[match.start():end + len("</span>")] if end >= 0 else ""
+        pages_element = BeautifulSoup(region, PARSER).find("span", class_="pages")
+    if not pages_element:
+        return 1
+    try:
+        return int(pages_element.get_text(strip=True).split('(')[1].split(')')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def check_parity(pages):
+    """Pages (html, name) on which the fast and soup backends disagree, printing each difference."""
+    mismatches = []
+    for html, name in pages:
+        for parse in (audio_source, page_count, lambda page, backend: [str(row) for row in thread_rows(page, backend)]):
+            fast, soup = parse(html, "fast"), parse(html, "soup")
+            if fast != soup:
+                print(f"{name}: fast gives {fast!r}, soup gives {soup!r}")
+                mismatches.append((html, name))
+                break
+    return mismatches
+
+
+if __name__ == "__main__":
+    for html, source, pages in PARITY_CASES:
+        if (audio_source(html, "soup"), page_count(html, "soup")) != (source, pages):
+            print(f"Unexpected reference result for {html!r}")
+    pages = [(html, f"case {i}") for i, (html, _, _) in enumerate(PARITY_CASES)]
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            pages.append((f.read(), path))
+    mismatches = check_parity(pages)
+    print(f"{len(pages) - len(mismatches)} of {len(pages)} pages parsed the same by both backends.")
+    sys.exit(1 if mismatches else 0)
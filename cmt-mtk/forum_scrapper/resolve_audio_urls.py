@@ -0,0 +1,178 @@
+"""
+    First stage of the forum mix download: resolve thread links to the URL of the mp3
+    they embed, so the download stage only ever requests the mp3 itself.
+
+    Resolved URLs are kept in a JSON Lines cache with a TTL, and can be written into
+    the metadata JSON ("Audio URL" on every thread) ahead of the download:
+    python resolve_audio_urls.py <json_path> <audio_directory>
+"""
+
+import os
+import json
+import time
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+from host_controller import AIMDController
+import http_client
+from page_parsers import audio_source
+
+FORUM_URL = "https://discussion.cambridge-mt.com/"
+MAX_WORKERS = 8
+AUDIO_URL_TTL = 30 * 24 * 3600  # Attachment links rarely change
+NO_AUDIO_TTL = 24 * 3600  # Threads without audio are checked again sooner
+# Pages are recorded into this archive, or with REPLAY served from it offline (see common/http_archive.py)
+HTTP_ARCHIVE = None  # e.g. "/data4/soumya/MSF_forum/metadata/pages.sqlite", shared with the metadata scrapers
+REPLAY = False
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+
+class AudioUrlCache:
+    """
+    Thread link -> audio URL (None for threads without an <audio> element), with the
+    time it was resolved. Entries are appended to a JSON Lines file (kept in memory
+    only if path is None), the last entry for a thread wins, and entries older than
+    their TTL are resolved again.
+    """
+
+    def __init__(self, path, ttl=AUDIO_URL_TTL, no_audio_ttl=NO_AUDIO_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.no_audio_ttl = no_audio_ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial line from an interrupted run
+                    self.entries[entry["thread"]] = entry
+        elif path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def get(self, thread_link):
+        """Return (True, audio URL or None) for a fresh entry, (False, None) if it has to be resolved."""
+        entry = self.entries.get(thread_link)
+        if entry is None or entry.get("gone"):
+            return False, None
+        ttl = self.ttl if entry["audio_url"] else self.no_audio_ttl
+        if time.time() - entry["resolved"] > ttl:
+            return False, None
+        return True, entry["audio_url"]
+
+    def store(self, thread_link, audio_url):
+        entry = {"thread": thread_link, "audio_url": audio_url, "resolved": time.time()}
+        with self.lock:
+            self.entries[thread_link] = entry
+            self.append(entry)
+
+    def forget(self, thread_link):
+        """Mark the audio URL of a thread as gone (e.g. 404), so it is resolved again, even if the metadata has it."""
+        entry = {"thread": thread_link, "audio_url": None, "resolved": time.time(), "gone": True}
+        with self.lock:
+            self.entries[thread_link] = entry
+            self.append(entry)
+
+    def is_gone(self, thread_link):
+        entry = self.entries.get(thread_link)
+        return bool(entry and entry.get("gone"))
+
+    def append(self, entry):
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+def resolve_audio_url(thread_link, get, forum_url=FORUM_URL):
+    """
+    Fetch a thread page with get(url, **kwargs) and return the src of its <audio>
+    <source>, or None if the thread has no audio. Request errors are raised.
+    """
+    url = forum_url + thread_link
+    response = get(url, headers=HEADERS, timeout=10)
+    response.raise_for_status()
+    src = audio_source(response.content)
+    if src is None:
+        return None
+    return urljoin(url, src)
+
+
+def resolve_threads(threads, cache, get, forum_url=FORUM_URL, max_workers=MAX_WORKERS, skip=None):
+    """
+    Set thread["Audio URL"] on every thread (None when it has no audio), from the
+    metadata itself (unless the cache knows it is gone), then the cache, then the
+    forum, the latter in parallel.
+    Threads for which skip(thread) is true (e.g. already downloaded) are left alone.
+    Threads that could not be resolved because of request errors are left without
+    the key. Returns the number of thread pages fetched.
+    """
+    pending = []
+    for thread in threads:
+        if skip is not None and skip(thread):
+            continue
+        if "Audio URL" in thread and not cache.is_gone(thread["Thread Link"]):
+            continue
+        found, audio_url = cache.get(thread["Thread Link"])
+        if found:
+            thread["Audio URL"] = audio_url
+        else:
+            pending.append(thread)
+
+    def resolve(thread):
+        try:
+            audio_url = resolve_audio_url(thread["Thread Link"], get, forum_url)
+        except requests.exceptions.RequestException as e:
+            print(f"Could not resolve the audio of {thread['Thread Author']}: {e}")
+            return
+        cache.store(thread["Thread Link"], audio_url)
+        thread["Audio URL"] = audio_url
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(resolve, pending))
+    return len(pending)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python3 resolve_audio_urls.py <json_path> <audio_directory>")
+        sys.exit(1)
+    http_client.install_dns_cache()
+
+    json_path = sys.argv[1]
+    audio_dir = sys.argv[2]
+
+    if HTTP_ARCHIVE:
+        http_client.use_archive(HTTP_ARCHIVE, replay=REPLAY)
+    session = http_client.session(pool_size=MAX_WORKERS, status_retries=False)
+    controller = AIMDController(initial_concurrency=1, max_concurrency=MAX_WORKERS)
+    cache = AudioUrlCache(os.path.join(audio_dir, ".audio_urls.jsonl"))
+
+    with open(json_path) as f:
+        data = json.load(f)
+    threads = [thread for value in data.values() for thread in value['threads']]
+    fetched = resolve_threads(threads, cache, lambda url, **kwargs: controller.request(session.get, url, **kwargs))
+
+    # Written in place, the download scripts read "Audio URL" straight from the metadata
+    temp_path = json_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_path, json_path)
+
+    resolved = [thread for thread in threads if thread.get("Audio URL")]
+    print(f"Resolved {len(resolved)} of {len(threads)} threads to audio URLs ({fetched} thread pages fetched).")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,8 @@ AUDIO_DIR="/data4/soumya/MSF_forum/dataset"
 for JSON_PATH in "${JSON_FILES[@]}"; do
     echo "Processing: $JSON_PATH"
     
+    # Failed threads are retried inside the downloader (circuit breakers + retry queue),
+    # this loop only restarts it after a real crash.
     while true; do
         python3 /home/soumya/cambridge-mt_scrapper/cmt-mtk/forum_scrapper/download_forum_mixes_with_shutdown.py "$JSON_PATH" "$AUDIO_DIR"
         EXIT_CODE=$?
@@ -26,7 +28,7 @@ for JSON_PATH in "${JSON_FILES[@]}"; do
             echo "Completed $JSON_PATH successfully."
             break
         elif [ $EXIT_CODE -eq 1 ]; then
-            echo "Encountered multiple 400 errors. Restarting in 30 seconds..."
+            echo "Downloader crashed. Restarting in 30 seconds..."
             sleep 30
         else
             echo "Unknown error occurred."
@@ -4,27 +4,48 @@
 
 import requests
 from bs4 import BeautifulSoup
-import json
 import os
-import time
-import random
 from tqdm import tqdm
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+from concurrent.futures import ThreadPoolExecutor
+
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+from host_controller import AIMDController
+import http_client
+from browser_pool import BrowserPool
+from page_parsers import thread_rows
+from crawl_state import load_metadata, merge_songs
+from listing_crawler import crawl_songs
+from metadata_log import MetadataLog, log_path
 
 # Configure headers to mimic a real browser
+FORUM_URL = "https://discussion.cambridge-mt.com/"
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Accept-Language': 'en-US,en;q=0.9',
     'Referer': 'https://www.google.com/'
 }
 
-# Use a session for persistent connection
-session = requests.Session()
+# Use the shared keep-alive session, error statuses are left to the controller
+session = http_client.session(pool_size=4, status_retries=False)
 session.headers.update(HEADERS)
 
+# Adapts the request rate per host (backs off on 400/429/5xx) instead of fixed random delays
+MIN_INTERVAL = 0.5  # Politeness floor: at most 2 requests per second to the forum, shared by every genre and song
+controller = AIMDController(initial_concurrency=1, max_concurrency=4, initial_interval=2.0, min_interval=MIN_INTERVAL)
+
+# Warm headless browsers for the Selenium fallback, started on first use and renewed every 50 pages
+browser_pool = BrowserPool(size=2, max_pages=50)
+
+# Pages are recorded into this archive, or with REPLAY served from it offline (see common/http_archive.py)
+HTTP_ARCHIVE = None  # e.g. "/data4/soumya/MSF_forum/metadata/pages.sqlite"
+REPLAY = False
+
+# Only fetch the threads posted since the previous run, merged into its metadata (False re-crawls every page)
+INCREMENTAL = True
+
 # Optional: Proxy support (set to True if needed)
 USE_PROXY = False
 PROXIES = {
@@ -35,42 +56,30 @@ PROXIES = {
 def fetch_url(url, use_selenium=False):
     """Fetch the HTML content of a URL with retries and optional Selenium fallback."""
     max_retries = 3
-    delay = random.uniform(2, 5)  # Randomized delay to prevent detection
-    
+
     for attempt in range(max_retries):
         try:
-            time.sleep(delay)  # Add delay before making a request
-
+            if use_selenium and http_client.replaying():
+                return None  # Offline, the archive has no browser-rendered pages
             if use_selenium:
                 print(f"Fetching {url} using Selenium...")
                 return fetch_with_selenium(url)
 
             print(f"Fetching {url} (attempt {attempt + 1}/{max_retries})...")
-            response = session.get(url, proxies=PROXIES if USE_PROXY else None, timeout=10)
+            response = controller.request(session.get, url, proxies=PROXIES if USE_PROXY else None, timeout=10)
             response.raise_for_status()
             return response.content  # Return raw HTML
         
         except requests.exceptions.RequestException as e:
+            # The controller has already slowed this host down before the next attempt
             print(f"Request failed ({attempt + 1}/{max_retries}): {e}")
-            time.sleep(5)  # Wait before retrying
             
     print(f"Failed to fetch {url} after {max_retries} attempts.")
     return None
 
 def fetch_with_selenium(url):
-    """Use Selenium to fetch the page source."""
-    options = Options()
-    options.headless = True  # Run in headless mode
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-    driver.get(url)
-    time.sleep(5)  # Wait for page to load
-    html = driver.page_source
-    driver.quit()
-    return html
+    """Use a pooled Selenium browser to fetch the page source, once the page has loaded."""
+    return browser_pool.fetch(url)
 
 def find_song_names_forumlink(soup):
     """Extract song names and forum links from the page."""
@@ -80,93 +89,92 @@ def find_song_names_forumlink(soup):
     for strong_tag in tqdm(strong_tags):
         a_tag = strong_tag.find('a')
         if a_tag:
-            forum_link = "https://discussion.cambridge-mt.com/" + a_tag['href']
+            forum_link = FORUM_URL + a_tag['href']
             song_name = a_tag.get_text()
             song_dict[song_name] = {'forum_link': forum_link}
     
     print(f"{len(song_dict)} songs found.")
     return song_dict
 
-def find_thread_info(song_dict):
-    """Extract thread details (title, author, rating, views) from each song's forum page."""
-    for key, value in tqdm(song_dict.items()):
-        song_forum_url = value['forum_link']
-        song_forum_html = fetch_url(song_forum_url, use_selenium=False)  # Try normal request first
-        
-        if not song_forum_html:  # If request fails, use Selenium
-            song_forum_html = fetch_url(song_forum_url, use_selenium=True)
-            if not song_forum_html:
-                print(f"Skipping {song_forum_url} due to persistent failure.")
-                continue
-
-        song_forum_soup = BeautifulSoup(song_forum_html, 'html.parser')
-        pages_element = song_forum_soup.find('span', class_='pages')
-        pages_number = int(pages_element.get_text(strip=True).split('(')[1].split(')')[0]) if pages_element else 1
-        
-        threads = []
-        for i in range(1, pages_number + 1):
-            page_url = song_forum_url if i == 1 else f"{song_forum_url}&page={i}"
-            song_forum_html = fetch_url(page_url, use_selenium=False)
-            
-            if not song_forum_html:
-                continue  # Skip page if request fails
-
-            song_forum_soup = BeautifulSoup(song_forum_html, 'html.parser')
-            mixes = song_forum_soup.find_all('tr', class_='inline_row')
-
-            for row in mixes:
-                
-              
-                try:
-                    thread_link = row.find('span', class_='subject_new').a['href']
-                except:
-                    thread_link = "none"
-                try:
-                    thread_title = row.find('span', class_='subject_new').text
-                except:
-                    thread_title = "none"
-                try:
-                    thread_author = row.find('span', class_='author smalltext').a.text
-                    # print(thread_author)
-                except:
-                    thread_author = "none"
-                try:
-                    thread_time = row.find('span', class_='thread_start_datetime smalltext').text.strip()
-                    
-                except:
-                    thread_time = "none"
-                try:
-                    thread_rating = row.find('ul', class_='star_rating').find('li').text.strip()
-                except:
-                    thread_rating = "none"
-                try:
-                    thread_views = row.find_all('td', class_='trow1')[4].text.strip()
-                except:
-                    thread_views = "none"
-
-                threads.append({
-                    'Thread Link': thread_link,
-                    'Thread Title': thread_title,
-                    'Thread Author': thread_author,
-                    'Thread Time': thread_time,
-                    'Thread Rating': thread_rating,
-                    'Thread Views': thread_views
-                })
-           
-        song_dict[key]['threads'] = threads
-       
-    return song_dict
-
-def save_metadata(file_name, data):
-    """Save the metadata to a JSON file."""
-    try:
-        with open(file_name, 'w') as f:
-            json.dump(data, f, indent=4)
-        print(f"Metadata saved to {file_name}.")
-    except Exception as e:
-        print(f"Error saving metadata to {file_name}: {e}")
+def parse_threads(page_html):
+    """Extract link, title, author, time, rating and views of every thread row of a listing page."""
+    threads = []
+    for row in thread_rows(page_html):
+        try:
+            thread_link = row.find('span', class_='subject_new').a['href']
+        except:
+            thread_link = "none"
+        try:
+            thread_title = row.find('span', class_='subject_new').text
+        except:
+            thread_title = "none"
+        try:
+            thread_author = row.find('span', class_='author smalltext').a.text
+        except:
+            thread_author = "none"
+        try:
+            thread_time = row.find('span', class_='thread_start_datetime smalltext').text.strip()
+        except:
+            thread_time = "none"
+        try:
+            thread_rating = row.find('ul', class_='star_rating').find('li').text.strip()
+        except:
+            thread_rating = "none"
+        try:
+            thread_views = row.find_all('td', class_='trow1')[4].text.strip()
+        except:
+            thread_views = "none"
+
+        threads.append({
+            'Thread Link': thread_link,
+            'Thread Title': thread_title,
+            'Thread Author': thread_author,
+            'Thread Time': thread_time,
+            'Thread Rating': thread_rating,
+            'Thread Views': thread_views
+        })
+    return threads
+
+def fetch_first_page(url):
+    """Fetch with a normal request first, then with Selenium if that fails."""
+    return fetch_url(url, use_selenium=False) or fetch_url(url, use_selenium=True)
+
+def find_thread_info(song_dict, incremental=True, desc=None, on_done=None):
+    """Extract thread details (title, author, rating, views) from each song's forum page, several songs at once.
+
+    With incremental, only the pages down to the newest thread of the previous run are read.
+    With on_done, each song is handed over as soon as it is done (see crawl_songs)."""
+    return crawl_songs(song_dict, fetch_url, parse_threads, incremental, fetch_first=fetch_first_page, desc=desc,
+                       on_done=on_done)
+
+def scrape_genre(url):
+    """Scrape the songs of a genre forum and their threads into the genre's JSON file."""
+    print(f"Fetching forum page {url}...")
+    forum_html = fetch_first_page(url)  # Try Selenium if normal request fails
+    if not forum_html:
+        print(f"Failed to fetch the forum page {url}, skipping this genre.")
+        return
+
+    soup = BeautifulSoup(forum_html, 'html.parser')
+    file_name = soup.title.string.strip() + ".json"
+    save_dir = os.path.join('/data4/soumya/MSF_forum/metadata', file_name)
+
+    print("Scraping metadata from", file_name.replace(".json", ""))
+    song_dict = find_song_names_forumlink(soup)
+    if INCREMENTAL:
+        song_dict = merge_songs(song_dict, load_metadata(save_dir))
+    # Songs are checkpointed as they finish, a restart after a crash skips the ones already done
+    log = MetadataLog(log_path(save_dir))
+    order = list(song_dict)
+    song_dict = {key: value for key, value in song_dict.items() if key not in log}
+
+    print("Finding thread information...")
+    find_thread_info(song_dict, INCREMENTAL, desc=file_name.replace(".json", ""), on_done=log.append)
+    log.compact(save_dir, order)
 
 if __name__ == "__main__":
+    if HTTP_ARCHIVE:
+        http_client.use_archive(HTTP_ARCHIVE, replay=REPLAY)
     # url = input("Enter the URL of the Genre forum to scrape metadata: ") or 'https://discussion.cambridge-mt.com/forumdisplay.php?fid=6'
     # list of the url with i from 2 to 7
 
@@ -176,24 +184,7 @@ if __name__ == "__main__":
             'https://discussion.cambridge-mt.com/forumdisplay.php?fid=5',
             'https://discussion.cambridge-mt.com/forumdisplay.php?fid=6',
             'https://discussion.cambridge-mt.com/forumdisplay.php?fid=7']
-    for url in urls:
-        print("Fetching forum page...")
-        forum_html = fetch_url(url, use_selenium=False)
-
-        if not forum_html:
-            forum_html = fetch_url(url, use_selenium=True)  # Try Selenium if normal request fails
-            if not forum_html:
-                print("Failed to fetch the forum page. Exiting.")
-                exit()
-
-        soup = BeautifulSoup(forum_html, 'html.parser')
-        file_name = soup.title.string.strip() + ".json"
-        save_dir = os.path.join('/data4/soumya/MSF_forum/metadata', file_name)
-
-        print("Scraping metadata from", file_name.replace(".json", ""))
-        song_dict = find_song_names_forumlink(soup)
-        save_metadata(save_dir, song_dict)
-
-        print("Finding thread information...")
-        song_dict_with_threads_info = find_thread_info(song_dict)
-        save_metadata(save_dir, song_dict_with_threads_info)
+    # Genres are scraped in parallel, the controller keeps the total request rate to the forum in check
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        list(executor.map(scrape_genre, urls))
+    browser_pool.close()
@@ -1,80 +1,89 @@
 import os
-import shutil
 import zipfile
 import yaml
 import numpy as np
 import pandas as pd
-import requests
 import time
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from os.path import join as opj
+from stem_extract import extract_stems, verify_zip
+from download_dataset import download_file_with_progress as ranged_download, remove_asset, stream_download_and_extract
+from remote_zip import fetch_selected_stems, selection_covers, selection_of, stem_filter, stored_selection
+
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+from metrics import Metrics, ProgressReporter
+from work_queue import LeaseQueue, run_queue
+from scheduler import EtaEstimator, SizeCache, learn_sizes
+from disk_budget import DiskBudget, footprint
 
 # Constants
 DATASET_DIR = "/data4/soumya/Mixing_Secrets_Full"
 METADATA_PATH = "/home/soumya/cambridge-mt_scrapper/data/multitrack_website/metadata_with_fine_genre.csv"
 MAX_WORKERS = 4  # Number of parallel downloads
+# Disk space downloads in flight may use in DATASET_DIR (None for all free space), checked before each download
+DISK_BUDGET = None
+# Only fetch stems of these categories (see post_processing/stem_categories.py), e.g. ["drum", "kick", "snare"].
+# None downloads whole multitracks.
+STEM_CATEGORIES = None
+# Shared by every machine working on DATASET_DIR, so each song is processed by one of them
+QUEUE_DIR = opj(DATASET_DIR, ".work_queue")
+METRICS_PATH = "data/download_metrics.json"
 
-# Load metadata and convert to dictionary for fast lookup
-METADATA = pd.read_csv(METADATA_PATH)
-metadata_dict = {
-    row["Track Name"]: (row["Excerpt Multitrack Link"], row["Full Multitrack Link"])
-    for _, row in METADATA.iterrows()
-}
+# Bytes, requests, retries and errors of every download, reported by main()
+metrics = Metrics()
+
+# Track name -> (excerpt link, full link), filled by load_metadata
+metadata_dict = {}
+# Link -> size in bytes, filled by largest_first
+link_sizes = {}
+
+
+def load_metadata(metadata_path=METADATA_PATH):
+    """Load metadata and convert to dictionary for fast lookup."""
+    metadata = pd.read_csv(metadata_path)
+    metadata_dict.update({
+        row["Track Name"]: (row["Excerpt Multitrack Link"], row["Full Multitrack Link"])
+        for _, row in metadata.iterrows()
+    })
 
 
 def post_process_download(directory):
-    """Unzip files and clean up unnecessary subdirectories."""
+    """
+    CRC check downloaded zips, extract their audio stems straight into one flat folder,
+    then remove the zips. Corrupt zips are removed without extracting anything.
+    Returns False if any zip was corrupt.
+    """
+    ok = True
     for zip_file in glob(opj(directory, "*.zip")):
         # check if file is not zip  file
         if not zipfile.is_zipfile(zip_file):
             print(f"{zip_file} is not a valid zip file. Skipping...")
             continue
-        with zipfile.ZipFile(zip_file, "r") as zip_ref:
-            zip_ref.extractall(directory)
+        bad_members = verify_zip(zip_file, max_workers=MAX_WORKERS)
+        if bad_members:
+            print(f"{zip_file} is corrupt ({len(bad_members)} bad members). Removing it...")
+            os.remove(zip_file)
+            ok = False
+            continue
+        extract_stems(zip_file, directory, max_workers=MAX_WORKERS)
         os.remove(zip_file)  # Remove the zip file after extraction
-
-    # Move all audio files to the main directory
-    subdirs = [d for d in glob(opj(directory, "*")) if os.path.isdir(d) and "__MACOSX" not in d]
-
-    if len(subdirs) > 1:
-        main_dir = subdirs[0]
-        for subdir in subdirs[1:]:
-            for file in glob(opj(subdir, "*.wav")):
-                shutil.move(file, main_dir)
-            shutil.rmtree(subdir)  # Remove empty directories
+    return ok
 
 
 def download_file_with_progress(url, output_path, max_retries=5, retry_delay=5):
-    """Download a file with progress bar and retry mechanism."""
-    temp_path = output_path + ".part"
-    
-    # Get file size
-    try:
-        response = requests.head(url, allow_redirects=True)
-        total_size = int(response.headers.get("content-length", 0))
-    except Exception as e:
-        print(f"Error getting file size: {e}")
-        return False
-
-    # Check if partially downloaded file exists
-    downloaded_size = os.path.getsize(temp_path) if os.path.exists(temp_path) else 0
-    headers = {"Range": f"bytes={downloaded_size}-"} if downloaded_size > 0 else {}
-
+    """
+    Download a file with retries, progress is reported by main() through metrics.
+    Each retry resumes from the range journal, so only missing bytes are fetched again.
+    """
     for attempt in range(max_retries):
+        if attempt:
+            metrics.worker().retries += 1
         try:
-            with requests.get(url, headers=headers, stream=True) as r:
-                r.raise_for_status()
-                with open(temp_path, "ab") as f, tqdm(
-                    total=total_size, initial=downloaded_size, unit="B", unit_scale=True, desc="Downloading"
-                ) as pbar:
-                    for chunk in r.iter_content(chunk_size=1024 * 1024):
-                        f.write(chunk)
-                        pbar.update(len(chunk))
-            os.rename(temp_path, output_path)  # Rename to final file
+            ranged_download(url, output_path, num_parts=1, max_workers=1, show_progress=False, metrics=metrics)
             return True
-        except requests.exceptions.RequestException as e:
+        except Exception as e:
             print(f"Download error: {e}. Retrying in {retry_delay}s...")
             time.sleep(retry_delay)
 
@@ -82,7 +91,80 @@ def download_file_with_progress(url, output_path, max_retries=5, retry_delay=5):
     return False
 
 
-def process_song(song_path):
+def selected_stems():
+    """Selector of the STEM_CATEGORIES stems (see remote_zip.stem_filter), None for whole multitracks."""
+    return stem_filter(categories=STEM_CATEGORIES) if STEM_CATEGORIES else None
+
+
+def is_downloaded(path):
+    """Whether path holds an extracted multitrack, with at least the stems STEM_CATEGORIES asks for."""
+    return bool(glob(opj(path, "*/"))) and selection_covers(stored_selection(path), selection_of(selected_stems()))
+
+
+def pending_links(song_path):
+    """Excerpt and full multitrack links of a song that still have to be downloaded."""
+    excerpt_link, full_link = metadata_dict.get(os.path.basename(song_path), (None, None))
+    links = []
+    if isinstance(excerpt_link, str) and not is_downloaded(opj(song_path, "excerpt_multitrack")):
+        links.append(excerpt_link)
+    if isinstance(full_link, str) and not is_downloaded(opj(song_path, "full_multitrack")):
+        links.append(full_link)
+    return links
+
+
+def largest_first(song_dirs):
+    """
+    Order songs by bytes left to download, largest first, so the multi-GB multitracks
+    start at once instead of setting the end of the run. Sizes come from earlier runs
+    or HEAD requests, songs of unknown size are placed as if average.
+    Returns (ordered song dirs, total bytes to download).
+    """
+    links = {song_path: pending_links(song_path) for song_path in song_dirs}
+    sizes = learn_sizes([link for song_links in links.values() for link in song_links],
+                        SizeCache(opj(DATASET_DIR, ".sizes.jsonl")))
+    link_sizes.update(sizes)
+    known = [size for size in sizes.values() if size]
+    average = sum(known) // len(known) if known else 0
+    song_sizes = {song_path: sum(sizes.get(link) or average for link in song_links)
+                  for song_path, song_links in links.items()}
+    return sorted(song_dirs, key=lambda song_path: -song_sizes[song_path]), sum(song_sizes.values())
+
+
+def download_multitrack(link, path, name, disk_budget=None):
+    """
+    Download a multitrack zip and extract its stems into path. With a disk_budget,
+    the download first waits until the zip and its stems fit on disk. With
+    STEM_CATEGORIES, only those stems are fetched, with Range requests. Stems left
+    by an earlier fetch of fewer categories are removed first.
+    Returns False if the download or the extraction failed.
+    """
+    reservation = disk_budget.reserve(footprint(f"{name}.zip", link_sizes.get(link))) if disk_budget else None
+    if reservation is not None:
+        reservation.track(path)
+    try:
+        remove_asset(path, f"{name}.zip")
+        select = selected_stems()
+        if select is not None and fetch_selected_stems(link, path, select, default_dir=name,
+                                                       metrics=metrics) is not None:
+            return True
+        # Extract while downloading, fall back to the resumable download for archives that can't be streamed
+        try:
+            if stream_download_and_extract(link, path, default_dir=name, show_progress=False,
+                                           metrics=metrics) is not None:
+                return True
+        except Exception as e:
+            print(e)  # The stream kept breaking, the next run resumes it
+            return False
+        if not download_file_with_progress(link, opj(path, f"{name}.zip")):
+            return False
+        print(path)
+        return post_process_download(path)
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+
+def process_song(song_path, disk_budget=None):
     """Check if excerpts/full multitracks exist, and download if missing."""
     song_name = os.path.basename(song_path)
     excerpt_path = opj(song_path, "excerpt_multitrack")
@@ -92,9 +174,6 @@ def process_song(song_path):
     os.makedirs(excerpt_path, exist_ok=True)
     os.makedirs(full_path, exist_ok=True)
 
-    excerpt_subdirs = glob(opj(excerpt_path, "*/"))
-    full_subdirs = glob(opj(full_path, "*/"))
-
     failed_downloads = {"excerpt": None, "full": None}
 
     excerpt_link, full_link = metadata_dict.get(song_name, (None, None))
@@ -102,32 +181,40 @@ def process_song(song_path):
     print(f"Excerpt: {excerpt_link}")
     print(f"Full: {full_link}")
 
-    if not excerpt_subdirs and isinstance(excerpt_link, str):
-        if download_file_with_progress(excerpt_link, opj(excerpt_path, "excerpt_multitrack.zip")):
-            print(excerpt_path)
-            post_process_download(excerpt_path)
-        else:
+    if not is_downloaded(excerpt_path) and isinstance(excerpt_link, str):
+        if not download_multitrack(excerpt_link, excerpt_path, "excerpt_multitrack", disk_budget):
             failed_downloads["excerpt"] = song_name
 
-    if not full_subdirs and isinstance(full_link, str):
-        if download_file_with_progress(full_link, opj(full_path, "full_multitrack.zip")):
-            print(full_path)
-            post_process_download(full_path)
-        else:
+    if not is_downloaded(full_path) and isinstance(full_link, str):
+        if not download_multitrack(full_link, full_path, "full_multitrack", disk_budget):
             failed_downloads["full"] = song_name
 
     return failed_downloads
 
 
 def main():
+    load_metadata()
     song_dirs = glob(opj(DATASET_DIR, "*"))
     print(f"Found {len(song_dirs)} songs")
 
     failed_downloads = {"excerpt": [], "full": []}
 
-    # Use ThreadPoolExecutor for parallel downloads
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        results = list(tqdm(executor.map(process_song, song_dirs), total=len(song_dirs), desc="Processing Songs"))
+    # Songs are leased from the shared queue, so this can run on several machines at once.
+    # Songs with failed downloads are released instead of marked done, to be retried.
+    queue = LeaseQueue(QUEUE_DIR)
+    print(f"Node {queue.node}, queue status: {queue.status()}")
+    song_dirs, total_bytes = largest_first(song_dirs)
+    disk_budget = DiskBudget(DATASET_DIR, DISK_BUDGET)
+    print(f"{total_bytes / 1024 ** 3:.1f} GB to download")
+    try:
+        with ProgressReporter(metrics, interval=30, total_bytes=total_bytes, export_path=METRICS_PATH, inline=False,
+                              eta=EtaEstimator(total_bytes)):
+            results = list(run_queue(queue, song_dirs, lambda song_path: process_song(song_path, disk_budget),
+                                     max_workers=MAX_WORKERS,
+                                     is_complete=lambda failed: not any(failed.values()), ordered=True).values())
+    finally:
+        queue.close()
+    print(f"Processed {len(results)} songs on this node. Delete {QUEUE_DIR} to process finished songs again.")
 
     # Collect failed downloads
     for result in results:
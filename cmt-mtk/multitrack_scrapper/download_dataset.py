@@ -1,159 +1,596 @@
 
 import os
-import requests
 import shutil
 import pandas as pd
-from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor
-import zipfile
-import time
-import glob
+import hashlib
+from range_journal import RangeJournal, StreamJournal, split_ranges
+from stream_unzip import stream_extract, StreamFallback
+from stem_extract import FlatLayout, extract_stems, verify_zip
+from remote_zip import (SELECTION_FILE, fetch_selected_stems, selection_covers, selection_of, stem_filter,
+                        stored_selection)
 
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+from blob_store import BlobStore
+from http_cache import ValidatorCache, response_validators
+from integrity import Manifest
+from metrics import Metrics, ProgressReporter
+from scheduler import Job, SizeCache, SizeScheduler, host_of, learn_sizes
+from disk_budget import DiskBudget, footprint
+from buffered_io import BUFFER_SIZE, BufferPool, WriteBehind, read_into
+import http_client
 
-def download_file_part(url, start, end, part_index, output_path, progress_bars):
+
+def check_content_range(response, start, end, open_ended=False):
+    """
+    Make sure a ranged response covers exactly the bytes we asked for (with
+    open_ended, at least them, starting at start).
+    A plain 200 is only usable when the requested range is the whole file.
+    """
+    total = end - start + 1
+    if response.status_code == 206:
+        content_range = response.headers.get('content-range', '')
+        try:
+            served = content_range.split(' ')[1].split('/')[0]
+            served_start, served_end = (int(x) for x in served.split('-'))
+        except (IndexError, ValueError):
+            raise Exception(f"Malformed Content-Range '{content_range}' for bytes {start}-{end}.")
+        if served_start != start or (served_end < end if open_ended else served_end != end):
+            raise Exception(f"Server returned bytes {served_start}-{served_end}, expected {start}-{end}.")
+    elif not (start == 0 and int(response.headers.get('content-length', -1)) == total):
+        raise Exception(f"Server ignored the Range header for bytes {start}-{end} (status {response.status_code}).")
+
+
+def sync_file(fd):
+    """Flush written data to disk before the journal is allowed to record it."""
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def download_file_part(url, start, end, part_index, fd, journal, metrics, pool, probe=None,
+                       checkpoint_bytes=16 * 1024 * 1024):
     """
-    Download a specific range of bytes (a part) from the file.
-    Updates the progress bar for that part.
+    Download a specific range of bytes (a part) from the file and write it
+    straight into the preallocated output file at its offset.
+    The response is read into buffers from pool, which a write-behind thread
+    writes out, so the connection keeps draining while the disk catches up.
+    Written bytes are checkpointed to the journal every checkpoint_bytes, and
+    once more if the part fails, so a restart only fetches what is missing.
+    Each checkpointed range is hashed (SHA-256) as it is written.
+    Received bytes are only added to this thread's metrics counters, progress is
+    rendered elsewhere.
+    probe is an already open response from byte start onwards (see open_probe),
+    read up to end instead of sending a new request.
     """
     headers = {'Range': f'bytes={start}-{end}'}
-    with requests.get(url, headers=headers, stream=True) as response:
-        response.raise_for_status()
-        part_path = f"{output_path}.part{part_index}"
-        with open(part_path, "wb") as part_file:
-            downloaded = 0
-            total = end - start + 1
-            last_time = time.time()
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    part_file.write(chunk)
-                    downloaded += len(chunk)
-                    # Update progress bar
-                    current_time = time.time()
-                    speed = len(chunk) / (current_time - last_time + 1e-5)  # Avoid division by zero
-                    progress_bars[part_index].update(len(chunk))
-                    progress_bars[part_index].desc = f"Part {part_index + 1}: {downloaded / (1024 ** 2):.2f}MB/{total / (1024 ** 2):.2f}MB @ {speed / 1024:.2f} KB/s"
-                    last_time = current_time
-
-
-def download_file_with_progress(url, output_path, num_parts=4):
-    """
-    Download a file using multiple parts with progress tracking for each part.
-    """
-    # Get file size
-    response = requests.head(url, allow_redirects=True)
-    total_size = int(response.headers.get('content-length', 0))
+    offset = start  # Received
+    written = start  # On disk, only touched by the writer thread
+    checkpoint = start
+    piece_hash = hashlib.sha256()
+    total = end - start + 1
+    counters = metrics.worker()
+
+    def on_written(view):
+        nonlocal written, checkpoint, piece_hash
+        piece_hash.update(view)
+        written += len(view)
+        if written - checkpoint >= checkpoint_bytes:
+            sync_file(fd)
+            journal.mark_done(checkpoint, written - 1, piece_hash.hexdigest())
+            checkpoint = written
+            piece_hash = hashlib.sha256()
+
+    writer = WriteBehind(fd, pool)
+    try:
+        response = probe
+        if response is None:
+            counters.requests += 1
+            response = http_client.get(url, headers=headers, stream=True)
+            counters.observe_latency(response.elapsed.total_seconds())
+        with response:
+            response.raise_for_status()
+            check_content_range(response, start, end, open_ended=probe is not None)
+            while offset <= end:
+                buffer = pool.acquire()
+                try:
+                    length = read_into(response, buffer, min(len(buffer), end + 1 - offset))
+                except BaseException:
+                    pool.release(buffer)  # A partly filled buffer is fetched again on resume
+                    raise
+                if not length:
+                    pool.release(buffer)
+                    break
+                writer.submit(buffer, length, offset, on_written)
+                offset += length
+                counters.bytes += length
+        if offset != end + 1:
+            raise Exception(f"Part {part_index + 1} ended early: got {offset - start} of {total} bytes.")
+    except Exception:
+        counters.errors += 1
+        raise
+    finally:
+        # Keep whatever was written, even if the connection dropped half way
+        write_error = writer.close()
+        if written > checkpoint:
+            sync_file(fd)
+            journal.mark_done(checkpoint, written - 1, piece_hash.hexdigest())
+        if write_error is not None:
+            raise write_error
+
+
+def preallocate_file(path, size):
+    """
+    Create a file of the given size so that download parts can be written at
+    their offsets. Existing content is kept so an interrupted download can be
+    resumed. Returns an open file descriptor.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    os.ftruncate(fd, size)
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass  # Not supported on every filesystem (e.g. some NFS mounts), the sparse file still works
+    return fd
+
+
+def open_probe(url, length=None):
+    """
+    GET the first length bytes of a file (all of it if length is None). The headers
+    give the size and validator, so no separate HEAD is needed, and the body is the
+    first part of the download: a file that fits in the probe costs a single request.
+    The probe is bounded when the file will be split into parts, so the server doesn't
+    keep sending bytes the first part won't read.
+    Returns (response, total size, last byte served, whether the server honoured the Range).
+    """
+    byte_range = f'bytes=0-{length - 1}' if length else 'bytes=0-'
+    response = http_client.get(url, headers={'Range': byte_range}, stream=True, allow_redirects=True)
+    response.raise_for_status()
+    if response.status_code == 206:
+        try:
+            served, total = response.headers.get('content-range', '').split(' ')[1].split('/')
+            return response, int(total), int(served.split('-')[1]), True
+        except (IndexError, ValueError):
+            response.close()
+            raise Exception(f"Malformed Content-Range '{response.headers.get('content-range')}' for {url}.")
+    total = int(response.headers.get('content-length', 0))
+    return response, total, total - 1, False
+
+
+def download_file_with_progress(url, output_path, num_parts=4, max_workers=4, min_part_size=1024 * 1024,
+                                show_progress=True, metrics=None, validators=None):
+    """
+    Download a file using multiple parallel ranged requests with progress tracking
+    for each part. Every part is written in place into a single preallocated file,
+    so there is no merge pass once the parts are done.
+    Progress is kept in a journal next to the partial file, so calling this again
+    after a crash only fetches the byte ranges that are still missing.
+    Returns the SHA-256 piece hashes [(start, end, sha256), ...] of the file, computed
+    while downloading (None if a journal from before piece hashing was resumed).
+    Bytes, requests and errors go to metrics (a fresh Metrics if None). With
+    show_progress, the file's progress is redrawn twice a second. With validators (a
+    dict), the file's validators (see http_cache) are stored there.
+    """
+    metrics = metrics or Metrics()
+    # Get file size from the first request of the download itself
+    counters = metrics.worker()
+    counters.requests += 1
+    probe, total_size, probe_end, ranged = open_probe(url, min_part_size if num_parts > 1 else None)
+    counters.observe_latency(probe.elapsed.total_seconds())
     if total_size == 0:
+        probe.close()
         raise Exception("Failed to fetch file size. URL might be invalid or server does not support ranged requests.")
+    validator = probe.headers.get('etag') or probe.headers.get('last-modified')
+    if validators is not None:
+        validators.update(response_validators(probe.headers, total_size))
 
-    # Split file into parts
-    part_size = total_size // num_parts
-    ranges = [(i * part_size, (i + 1) * part_size - 1) for i in range(num_parts)]
-    ranges[-1] = (ranges[-1][0], total_size - 1)  # Ensure the last part includes any leftover bytes
-
-    # Create progress bars for each part
-    progress_bars = [
-        tqdm(total=(end - start + 1), position=i + 1, leave=False, desc=f"Part {i + 1}")
-        for i, (start, end) in enumerate(ranges)
-    ]
+    temp_path = f"{output_path}.part"
+    journal = RangeJournal(f"{temp_path}.journal", url, total_size, validator)
+    if not journal.load() and os.path.exists(temp_path):
+        os.remove(temp_path)  # Unknown content, can't trust any of it
+    missing = journal.missing()
+    if journal.done:
+        print(f"Resuming {os.path.basename(output_path)}: {total_size - sum(e - s + 1 for s, e in missing)} of {total_size} bytes already on disk.")
 
-    # Download each part sequentially using threads
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        futures = [
-            executor.submit(download_file_part, url, start, end, idx, output_path, progress_bars)
-            for idx, (start, end) in enumerate(ranges)
-        ]
-        for future in futures:
-            future.result()  # Wait for each part to finish
+    # Split what is missing into parts, small files (e.g. mp3 previews) are not worth splitting.
+    # The probe already delivers the start of the file, it becomes the first part.
+    num_parts = max(1, min(num_parts, total_size // min_part_size))
+    if not ranged:
+        # The server ignores Range, the whole file comes in one piece through the probe
+        journal.done, journal.pieces = [], []
+        missing = ranges = [(0, total_size - 1)]
+    elif missing and missing[0][0] == 0:
+        first = (0, min(probe_end, missing[0][1]))
+        rest = ([(first[1] + 1, missing[0][1])] if missing[0][1] > first[1] else []) + missing[1:]
+        ranges = [first] + split_ranges(rest, max(1, num_parts - 1))
+    else:
+        probe.close()  # Resuming, the start of the file is already on disk
+        probe = None
+        ranges = split_ranges(missing, num_parts)
 
-    # Close progress bars
-    for bar in progress_bars:
-        bar.close()
+    # Download the parts concurrently into a temporary file, renamed once complete.
+    # Two buffers per connection: one being filled while the other is written.
+    workers = max(1, min(max_workers, len(ranges)))
+    pool = BufferPool(count=2 * workers, size=min(BUFFER_SIZE, max((e - s + 1 for s, e in ranges), default=1)))
+    fd = preallocate_file(temp_path, total_size)
+    reporter = ProgressReporter(metrics, interval=0.5, total_bytes=sum(e - s + 1 for s, e in missing),
+                                show=show_progress)
+    try:
+        with reporter, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(download_file_part, url, start, end, idx, fd, journal, metrics, pool,
+                                probe if idx == 0 else None)
+                for idx, (start, end) in enumerate(ranges)
+            ]
+            for future in futures:
+                future.result()  # Wait for each part to finish
+    finally:
+        if probe is not None:
+            probe.close()
+        os.close(fd)
 
-    # Merge parts
-    with open(output_path, "wb") as output_file:
-        for idx in range(num_parts):
-            part_path = f"{output_path}.part{idx}"
-            with open(part_path, "rb") as part_file:
-                shutil.copyfileobj(part_file, output_file)
-            os.remove(part_path)  # Clean up part files
+    if journal.missing():
+        raise Exception(f"Download of {url} is incomplete, rerun to resume.")
+    pieces = journal.piece_hashes()
+    os.replace(temp_path, output_path)
+    journal.remove()
+    return pieces
 
 
-def extract_zip_file(zip_path, output_folder):
+def extract_zip_file(zip_path, output_folder, digests=None):
     """
-    Extract a zip file into the specified output folder and delete the zip file.
+    Check the CRC of every member of a zip file, then extract its audio stems into
+    one flat stem folder inside the specified output folder and delete the zip file.
+    A corrupt zip is deleted without extracting anything, so it is downloaded again.
+    The SHA-256 of every stem goes into digests, if given.
     """
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(output_folder)
+        bad_members = verify_zip(zip_path)
+        if bad_members:
+            os.remove(zip_path)
+            print(f"Corrupt zip {zip_path} ({len(bad_members)} bad members, e.g. {bad_members[0]}), removed it.")
+            return False
+        stems = extract_stems(zip_path, output_folder, digests=digests)
         os.remove(zip_path)
-        print(f"Extracted and removed zip: {zip_path}")
+        print(f"Extracted {len(stems)} stems and removed zip: {zip_path}")
+        return True
     except Exception as e:
         print(f"Failed to extract {zip_path}: {e}")
+        return False
 
 
-def handle_track_download(row, dl_dir, full, preview, excerpt, excerpt_preview, num_parts=4):
+STREAM_RESUMES = 5  # Broken streams resumed in a row without a new member through, before giving up
+
+
+def stream_download_and_extract(url, output_folder, default_dir="multitrack", show_progress=True,
+                                chunk_size=1024 * 1024, metrics=None, digests=None, validators=None):
     """
-    Handle downloading for a single track, including full multitracks and previews.
+    Extract the audio stems of a zip into one flat stem folder inside output_folder
+    while it downloads, without ever storing the archive.
+    Members land in a hidden staging folder first, so a broken stream never leaves a
+    half extracted archive that looks finished. A broken stream is resumed with a Range
+    request from the local header after the last member written and CRC checked, which
+    is also saved in the staging folder (StreamJournal) for the next run to resume from.
+    It gives up after STREAM_RESUMES breaks in a row without a new member through, and
+    raises, keeping the members extracted so far.
+    Returns (archive size, SHA-256 of the archive computed on the fly, None when resumed
+    from an earlier run), or None when the archive needs its central directory (or broke
+    before any member could be kept) and has to go through the regular download +
+    extract path.
+    With digests (a dict), the SHA-256 of every stem is stored there by final path,
+    with validators (a dict), the archive's validators (see http_cache).
     """
-    track_name = row["Track Name"]
-    track_folder = os.path.join(dl_dir, track_name)
-    os.makedirs(track_folder, exist_ok=True)
-    if len(glob.glob(track_folder + '/*')) == 4:
-        print(f"Track {track_name} already downloaded.")
+    metrics = metrics or Metrics()
+    counters = metrics.worker()
+    staging_folder = os.path.join(output_folder, ".streaming")
+    journal = StreamJournal(os.path.join(staging_folder, ".journal.json"), url)
+    if journal.load():
+        print(f"Resuming the stream of {url} at byte {journal.offset}.")
+    else:
+        shutil.rmtree(staging_folder, ignore_errors=True)
+    os.makedirs(staging_folder, exist_ok=True)
+    layout = FlatLayout(staging_folder, default_dir)
+    # The archive hash covers the bytes before hashed, those of an earlier run can't be hashed again
+    archive_hash, hashed = None, journal.offset
+    stalled = 0  # Breaks in a row without a new member checked
+    try:
+        while True:
+            # Back to the last checked member, the one that broke is extracted again under the same name
+            start = journal.offset
+            layout.stem_dir, layout.used_names = journal.stem_dir, set(journal.used_names)
+            staged = dict(journal.digests)
+            headers = {'Range': f'bytes={start}-', 'If-Range': journal.validator} if start else {}
+            try:
+                counters.requests += 1
+                with http_client.get(url, stream=True, headers=headers) as response:
+                    counters.observe_latency(response.elapsed.total_seconds())
+                    response.raise_for_status()
+                    if start and response.status_code != 206:
+                        print(f"{url} changed upstream, streaming it again from the start.")
+                        shutil.rmtree(staging_folder, ignore_errors=True)
+                        os.makedirs(staging_folder)
+                        journal = StreamJournal(journal.path, url)
+                        layout, staged, start = FlatLayout(staging_folder, default_dir), {}, 0
+                    if start == 0:
+                        archive_hash, hashed = hashlib.sha256(), 0
+                        journal.validator = response.headers.get('etag') or response.headers.get('last-modified')
+                    total_size = start + int(response.headers.get('content-length', 0))
+                    received = start
+                    with ProgressReporter(metrics, interval=0.5, total_bytes=total_size - start, show=show_progress):
+                        def chunks():
+                            nonlocal hashed, received
+                            for chunk in response.iter_content(chunk_size=chunk_size):
+                                if archive_hash is not None and received + len(chunk) > hashed:
+                                    archive_hash.update(memoryview(chunk)[max(0, hashed - received):])
+                                    hashed = received + len(chunk)
+                                received += len(chunk)
+                                counters.bytes += len(chunk)
+                                yield chunk
+                        stream = chunks()
+                        stream_extract(stream, staging_folder, target_for=layout.target, digests=staged, start=start,
+                                       on_member=lambda offset: journal.save(offset, layout, staged))
+                        for _ in stream:
+                            pass  # Hash the central directory too
+                    if total_size != start and received != total_size:
+                        raise Exception(f"Got {received} of {total_size} bytes.")
+                break
+            except StreamFallback:
+                raise
+            except Exception as e:
+                counters.errors += 1
+                stalled = 0 if journal.offset > start else stalled + 1
+                if journal.validator is None or stalled > STREAM_RESUMES:
+                    raise
+                counters.retries += 1
+                print(f"Stream of {url} broke ({e}), resuming at byte {journal.offset}.")
+    except StreamFallback as e:
+        print(f"Can't stream {url} ({e}), falling back to download then extract.")
+    except Exception as e:
+        if journal.offset:
+            raise Exception(f"Stream of {url} keeps breaking ({e}), rerun to resume at byte {journal.offset}.")
+        print(f"Streaming extraction of {url} failed ({e}), falling back to download then extract.")
+    else:
+        journal.remove()
+        for name in os.listdir(staging_folder):
+            os.replace(os.path.join(staging_folder, name), os.path.join(output_folder, name))
+        os.rmdir(staging_folder)
+        if digests is not None:
+            for path, sha256 in staged.items():
+                digests[os.path.join(output_folder, os.path.relpath(path, staging_folder))] = sha256
+        if validators is not None:
+            validators.update(response_validators(response.headers, total_size))
+        print(f"Streamed and extracted: {url}")
+        return total_size, archive_hash.hexdigest() if archive_hash is not None else None
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    return None
+
+
+# (metadata column, subfolder, file name, label) for every asset of a track
+ASSETS = [
+    ("Full Multitrack Link", "full_multitrack", "full_multitrack.zip", "Full Multitrack"),
+    ("Full Mix Preview", "mix_previews", "mix_preview.mp3", "Mix Preview"),
+    ("Excerpt Multitrack Link", "excerpt_multitrack", "excerpt_multitrack.zip", "Excerpt Multitrack"),
+    ("Excerpt Mix Preview", "excerpt_mix_previews", "excerpt_mix_preview.mp3", "Excerpt Mix Preview"),
+]
+
+# Maximum number of files downloaded at once from each host, the rest share DEFAULT_HOST_LIMIT.
+# Every multitrack download itself opens up to num_parts connections.
+HOST_LIMITS = {
+    "zenodo.org": 2,
+    "cambridge-mt.com": 2,
+    "previews.cambridge-mt.com": 8,
+}
+DEFAULT_HOST_LIMIT = 2
+
+
+def selected_assets(full, preview, excerpt, excerpt_preview):
+    """Return the ASSETS entries enabled by the y/n answers, in ASSETS order."""
+    answers = [full, preview, excerpt, excerpt_preview]
+    return [asset for asset, answer in zip(ASSETS, answers) if answer.lower() == "y"]
+
+
+def is_asset_downloaded(folder, file_name, select=None):
+    """
+    An mp3 is done once it exists, a zip is done once it has been extracted and removed,
+    with at least the stems select asks for (see remote_zip.stored_selection).
+    """
+    if file_name.endswith(".zip"):
+        return (any(not f.startswith((file_name, ".")) for f in os.listdir(folder))
+                and selection_covers(stored_selection(folder), selection_of(select)))
+    return os.path.exists(os.path.join(folder, file_name))
+
+
+def remove_asset(folder, file_name):
+    """Delete a previously downloaded mp3, or the extracted content of a zip, before downloading it again."""
+    if not file_name.endswith(".zip"):
+        os.remove(os.path.join(folder, file_name))
         return
+    if os.path.exists(os.path.join(folder, SELECTION_FILE)):
+        os.remove(os.path.join(folder, SELECTION_FILE))
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.startswith((file_name, ".")):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
 
-    # Subfolder paths
-    subfolders = {
-        "Full Multitrack": os.path.join(track_folder, "full_multitrack"),
-        "Mix Previews": os.path.join(track_folder, "mix_previews"),
-        "Excerpt Multitrack": os.path.join(track_folder, "excerpt_multitrack"),
-        "Excerpt Mix Previews": os.path.join(track_folder, "excerpt_mix_previews"),
-    }
-    for folder in subfolders.values():
-        os.makedirs(folder, exist_ok=True)
-
-    # Download full multitrack
-    if full.lower() == "y" and pd.notna(row["Full Multitrack Link"]):
-        full_multitrack_path = os.path.join(subfolders["Full Multitrack"], "full_multitrack.zip")
-        print(f"Downloading Full Multitrack: {track_name}")
-        try:
-            download_file_with_progress(row["Full Multitrack Link"], full_multitrack_path, num_parts=num_parts)
-            extract_zip_file(full_multitrack_path, subfolders["Full Multitrack"])
-        except Exception as e:
-            print(f"Failed to download Full Multitrack for {track_name}: {e}")
 
-    # Download mix previews
-    if preview.lower() == "y" and pd.notna(row["Full Mix Preview"]):
-        mix_preview_path = os.path.join(subfolders["Mix Previews"], "mix_preview.mp3")
-        print(f"Downloading Mix Preview: {track_name}")
+def download_asset(url, folder, file_name, label, track_name, num_parts=4, max_workers=4, show_progress=True,
+                   stream_zip=True, blob_store=None, validator_cache=None, manifest=None, metrics=None, size=None,
+                   disk_budget=None, select=None):
+    """
+    Download (and extract, for zips) one asset of a track.
+    With stream_zip, zips are extracted while they download and only fall back to
+    the ranged download + extract path when streaming is not possible.
+    With a blob_store, the resulting mp3 or stems are deduplicated into it.
+    With a validator_cache, an asset already on disk is revalidated with a conditional
+    HEAD and downloaded again only if it changed upstream, and the validators of the
+    download itself are stored for the next run.
+    With a manifest, the checksums computed during the download are recorded in it.
+    With metrics, bytes, requests and errors of the download are counted there.
+    With a disk_budget, the download waits until its peak footprint fits on disk
+    (size in bytes, asked with a HEAD if not given).
+    With select (see remote_zip.stem_filter), only the chosen stems of a zip are
+    fetched, with Range requests, and the rest of the archive is never downloaded.
+    A zip extracted with fewer stems than select asks for is downloaded again.
+    Returns the number of bytes downloaded, 0 if it was skipped or failed.
+    """
+    os.makedirs(folder, exist_ok=True)
+    output_path = os.path.join(folder, file_name)
+    if is_asset_downloaded(folder, file_name, select):
+        if validator_cache is None:
+            return 0
         try:
-            download_file_with_progress(row["Full Mix Preview"], mix_preview_path, num_parts=num_parts)
+            unchanged, headers = validator_cache.revalidate(url)
         except Exception as e:
-            print(f"Failed to download Mix Preview for {track_name}: {e}")
+            print(f"Failed to revalidate {label} for {track_name}: {e}")
+            return 0
+        if validator_cache.get(url) is None:
+            validator_cache.store(url, headers, output_path)  # Downloaded before the cache existed
+            return 0
+        if unchanged:
+            return 0
+        print(f"{label} for {track_name} changed upstream, downloading it again.")
+        remove_asset(folder, file_name)
+    elif file_name.endswith(".zip") and any(not f.startswith((file_name, ".")) for f in os.listdir(folder)):
+        print(f"{label} for {track_name} only has some of the stems asked for, downloading it again.")
+        remove_asset(folder, file_name)
 
-    # Download excerpt multitrack
-    if excerpt.lower() == "y" and pd.notna(row["Excerpt Multitrack Link"]):
-        excerpt_multitrack_path = os.path.join(subfolders["Excerpt Multitrack"], "excerpt_multitrack.zip")
-        print(f"Downloading Excerpt Multitrack: {track_name}")
-        try:
-            download_file_with_progress(row["Excerpt Multitrack Link"], excerpt_multitrack_path, num_parts=num_parts)
-            extract_zip_file(excerpt_multitrack_path, subfolders["Excerpt Multitrack"])
-        except Exception as e:
-            print(f"Failed to download Excerpt Multitrack for {track_name}: {e}")
+    reservation = None
+    if disk_budget is not None:
+        if size is None:
+            size = learn_sizes([url], SizeCache(None)).get(url)
+        reservation = disk_budget.reserve(footprint(file_name, size))  # Unknown size: see DiskBudget.reserve
+        reservation.track(folder)  # Preallocated parts and extracted stems show up here
+    try:
+        print(f"Downloading {label}: {track_name}")
+        streamed = selected = None
+        digests = {}  # Stem path -> SHA-256, hashed while extracting so the blob store doesn't read them again
+        validators = {}  # Of the response that delivered the asset
+        if select is not None and file_name.endswith(".zip"):
+            selected = fetch_selected_stems(url, folder, select, default_dir=os.path.splitext(file_name)[0],
+                                            metrics=metrics, digests=digests, validators=validators)
+            if selected is not None and reservation is not None:
+                reservation.release(max(0, reservation.nbytes - selected[0]))
+        if selected is None and stream_zip and file_name.endswith(".zip"):
+            streamed = stream_download_and_extract(url, folder, default_dir=os.path.splitext(file_name)[0],
+                                                   show_progress=show_progress, metrics=metrics,
+                                                   digests=digests, validators=validators)
+            if streamed is not None and reservation is not None:
+                reservation.release(reservation.nbytes // 2)  # The zip itself never touched the disk
+        if selected is not None:
+            size = selected[0]  # Not a whole archive, nothing to checksum
+        elif streamed is not None:
+            size, sha256 = streamed
+            if manifest is not None:
+                manifest.record(None, size, url=url, sha256=sha256)
+        else:
+            pieces = download_file_with_progress(url, output_path, num_parts=num_parts, max_workers=max_workers,
+                                                 show_progress=show_progress, metrics=metrics,
+                                                 validators=validators)
+            size = os.path.getsize(output_path)
+            # A single piece is the hash of the whole file
+            sha256 = pieces[0][2] if pieces and len(pieces) == 1 else None
+            if manifest is not None:
+                manifest.record(output_path, size, url=url, sha256=sha256, pieces=pieces)
+            if file_name.endswith(".zip") and not extract_zip_file(output_path, folder, digests):
+                return 0
+        if blob_store is not None:
+            if file_name.endswith(".zip"):
+                blob_store.add_tree(folder, digests)
+            else:
+                blob_store.add(output_path, sha256)
+        if validator_cache is not None:
+            validator_cache.store(url, validators, output_path)
+        return size
+    except Exception as e:
+        print(f"Failed to download {label} for {track_name}: {e}")
+        return 0
+    finally:
+        if reservation is not None:
+            reservation.release()
+
+
+def handle_track_download(row, dl_dir, full, preview, excerpt, excerpt_preview, num_parts=4, max_workers=4,
+                          blob_store=None, validator_cache=None, manifest=None, disk_budget=None, select=None):
+    """
+    Handle downloading for a single track, including full multitracks and previews.
+    With a disk_budget, each asset waits for disk space before it starts.
+    With select, only the chosen stems of the multitracks are downloaded.
+    """
+    track_name = row["Track Name"]
+    track_folder = os.path.join(dl_dir, track_name)
+    for column, subfolder, file_name, label in selected_assets(full, preview, excerpt, excerpt_preview):
+        if pd.notna(row[column]):
+            download_asset(row[column], os.path.join(track_folder, subfolder), file_name, label, track_name,
+                           num_parts=num_parts, max_workers=max_workers, blob_store=blob_store,
+                           validator_cache=validator_cache, manifest=manifest, disk_budget=disk_budget,
+                           select=select)
 
-    # Download excerpt mix previews
-    if excerpt_preview.lower() == "y" and pd.notna(row["Excerpt Mix Preview"]):
-        excerpt_mix_preview_path = os.path.join(subfolders["Excerpt Mix Previews"], "excerpt_mix_preview.mp3")
-        print(f"Downloading Excerpt Mix Preview: {track_name}")
-        try:
-            download_file_with_progress(row["Excerpt Mix Preview"], excerpt_mix_preview_path, num_parts=num_parts)
-        except Exception as e:
-            print(f"Failed to download Excerpt Mix Preview for {track_name}: {e}")
+
+def download_all(metadata_csv, dl_dir, full, preview, excerpt, excerpt_preview, num_parts=4,
+                 max_workers=4, max_downloads=8, report_interval=30, blob_store=None, validator_cache=None,
+                 manifest=None, metrics_path=None, fast_lanes=2, disk_budget=None, select=None):
+    """
+    Download every selected asset of every track, max_downloads files at a time.
+
+    Assets are scheduled by size (learned from earlier runs or a HEAD request, see
+    scheduler.learn_sizes) instead of CSV order: the largest archives start first so
+    no multi-GB zip is left to finish alone at the end, while fast_lanes workers keep
+    downloading previews and other small files. At most HOST_LIMITS[host] files are
+    in flight per host. With a disk_budget (DiskBudget), a download only starts once
+    its zip and extracted stems fit on disk. With select, only the chosen stems of
+    the multitracks are fetched (see download_asset). Aggregate throughput, ETA,
+    requests, errors and latency are printed every report_interval seconds and at the
+    end, and written to metrics_path (JSON, or Prometheus text for a .prom file) if given.
+    """
+    http_client.session(pool_size=max_downloads * num_parts)  # Enough keep-alive connections for every part
+    metrics = Metrics()
+
+    assets = []
+    for _, row in metadata_csv.iterrows():
+        track_folder = os.path.join(dl_dir, row["Track Name"])
+        for column, subfolder, file_name, label in selected_assets(full, preview, excerpt, excerpt_preview):
+            if pd.notna(row[column]):
+                folder = os.path.join(track_folder, subfolder)
+                downloaded = os.path.isdir(folder) and is_asset_downloaded(folder, file_name, select)
+                assets.append((row[column], folder, file_name, label, row["Track Name"], downloaded))
+
+    sizes = learn_sizes([asset[0] for asset in assets if not asset[5]], SizeCache(os.path.join(dl_dir, ".sizes.jsonl")),
+                        validator_cache, manifest)
+    # Assets already on disk only cost a revalidation, if anything
+    jobs = [Job(f"{asset[4]}/{asset[2]}", 0 if asset[5] else sizes.get(asset[0]),
+                payload=asset[:5] + (sizes.get(asset[0]),), host=host_of(asset[0])) for asset in assets]
+    scheduler = SizeScheduler(jobs, max_downloads, fast_lanes=fast_lanes, host_limits=HOST_LIMITS,
+                              default_host_limit=DEFAULT_HOST_LIMIT)
+
+    def run_asset(asset):
+        url, folder, file_name, label, track_name, size = asset
+        size = download_asset(url, folder, file_name, label, track_name, num_parts=num_parts,
+                              max_workers=max_workers, show_progress=False, blob_store=blob_store,
+                              validator_cache=validator_cache, manifest=manifest, metrics=metrics, size=size,
+                              disk_budget=disk_budget, select=select)
+        metrics.worker().files += 1  # Finished or skipped assets
+        return size
+
+    reporter = ProgressReporter(metrics, interval=report_interval, total_bytes=scheduler.eta.total_bytes,
+                                total_files=len(jobs), export_path=metrics_path, export_interval=report_interval,
+                                inline=False, eta=scheduler.eta)
+    with reporter:
+        scheduler.run(run_asset)
 
 
 if __name__ == "__main__":
     import subprocess
 
+    http_client.install_dns_cache()  # Every part of every download looks up the same few hosts
+
     # Prompt the user for settings
     DL_DIR = input("Enter the download directory (default is './data/multitrack_website/'): ") or './data/multitrack_website/'
     FULL_MULTITRACK = input("Download full multitracks? (y/n) (default is y): ") or 'y'
@@ -161,6 +598,12 @@ if __name__ == "__main__":
     EXCERPT_MULTITRACK = input("Download excerpt multitracks, if exists? (y/n) (default is n): ") or 'n'
     EXCERPT_MIX_PREVIEWS = input("Download excerpt mix previews, if exists? (y/n) (default is n): ") or 'n'
     UPDATE_METADATA = input("Update metadata.csv? (y/n) (default is n): ") or 'n'
+    NUM_CONNECTIONS = int(input("Number of parallel connections per file (default is 4): ") or 4)
+    MAX_DOWNLOADS = int(input("Number of files to download at once (default is 8): ") or 8)
+    DEDUPLICATE = input("Deduplicate audio into a content-addressed store? (y/n) (default is y): ") or 'y'
+    REVALIDATE = input("Re-download assets that changed upstream? (y/n) (default is y): ") or 'y'
+    DISK_BUDGET_GB = input("Disk space in GB that downloads in flight may use (default is all free space): ")
+    STEM_CATEGORIES = input("Only download stems of these categories, e.g. drum,kick,snare,vocal (default is all): ")
 
     # Check and update metadata
     if os.path.exists('data/multitrack_website/metadata.csv') and UPDATE_METADATA.lower() == 'n':
@@ -171,8 +614,16 @@ if __name__ == "__main__":
 
     print(f"Downloading {len(metadata_csv)} multitracks from Cambridge Multitrack website...")
 
-    # Sequential download
-    for _, row in tqdm(metadata_csv.iterrows(), total=len(metadata_csv), desc="Tracks"):
-        handle_track_download(row, DL_DIR, FULL_MULTITRACK, MIX_PREVIEWS, EXCERPT_MULTITRACK, EXCERPT_MIX_PREVIEWS)
+    blob_store = BlobStore(os.path.join(DL_DIR, ".blobs")) if DEDUPLICATE.lower() == 'y' else None
+    validator_cache = ValidatorCache(os.path.join(DL_DIR, ".http_cache.jsonl")) if REVALIDATE.lower() == 'y' else None
+    manifest = Manifest(os.path.join(DL_DIR, ".manifest.jsonl"))
+    os.makedirs(DL_DIR, exist_ok=True)
+    disk_budget = DiskBudget(DL_DIR, float(DISK_BUDGET_GB) * 1024 ** 3 if DISK_BUDGET_GB else None)
+    download_all(
+        metadata_csv, DL_DIR, FULL_MULTITRACK, MIX_PREVIEWS, EXCERPT_MULTITRACK, EXCERPT_MIX_PREVIEWS,
+        num_parts=NUM_CONNECTIONS, max_workers=NUM_CONNECTIONS, max_downloads=MAX_DOWNLOADS,
+        blob_store=blob_store, validator_cache=validator_cache, manifest=manifest,
+        metrics_path=os.path.join(DL_DIR, ".metrics.json"), disk_budget=disk_budget,
+        select=stem_filter(categories=[c.strip() for c in STEM_CATEGORIES.split(",")]) if STEM_CATEGORIES else None)
 
     print("\nDownload completed.")
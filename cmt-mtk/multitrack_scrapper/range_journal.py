@@ -0,0 +1,183 @@
+import os
+import json
+import threading
+
+
+class RangeJournal:
+    """
+    Persistent record of which byte ranges of a download are already on disk.
+
+    The journal lives next to the partial file as a small JSON sidecar. It is
+    rewritten atomically (temp file + os.replace) every time a range is marked
+    complete, and the caller is expected to flush the data to disk before doing
+    so, so after a crash the journal never claims bytes that were not written.
+    Ranges can carry the SHA-256 the worker computed while receiving them, which
+    become the piece hashes of the finished file.
+    """
+
+    def __init__(self, path, url, total_size, validator=None):
+        self.path = path
+        self.url = url
+        self.total_size = total_size
+        self.validator = validator  # ETag / Last-Modified, so a changed upstream file is not resumed
+        self.done = []
+        self.pieces = []  # (start, end, sha256) for every range marked with a hash
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load completed ranges if the journal on disk belongs to the same remote file."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable journal {self.path}")
+            return False
+        if (state.get("url") != self.url or state.get("total_size") != self.total_size
+                or state.get("validator") != self.validator):
+            print(f"Remote file changed since {self.path} was written, starting over.")
+            return False
+        self.done = [tuple(r) for r in state.get("done", [])]
+        self.pieces = [tuple(p) for p in state.get("pieces", [])]
+        return True
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "url": self.url,
+                "total_size": self.total_size,
+                "validator": self.validator,
+                "done": self.done,
+                "pieces": self.pieces,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def mark_done(self, start, end, sha256=None):
+        """Record the inclusive range [start, end] as written and flushed, with its hash if known."""
+        with self.lock:
+            self.done = merge_ranges(self.done + [(start, end)])
+            if sha256 is not None:
+                self.pieces.append((start, end, sha256))
+            self.save()
+
+    def piece_hashes(self):
+        """Piece hashes sorted by offset, None unless they cover the whole file."""
+        pieces = sorted(self.pieces)
+        position = 0
+        for start, end, _ in pieces:
+            if start != position:
+                return None
+            position = end + 1
+        return pieces if position == self.total_size else None
+
+    def missing(self):
+        """Return the inclusive ranges of the file that still have to be fetched."""
+        with self.lock:
+            gaps = []
+            position = 0
+            for start, end in self.done:
+                if start > position:
+                    gaps.append((position, start - 1))
+                position = max(position, end + 1)
+            if position < self.total_size:
+                gaps.append((position, self.total_size - 1))
+            return gaps
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamJournal:
+    """
+    Where a streamed extraction (see stream_download_and_extract) can resume: the offset
+    of the local header that follows the last member written and CRC checked, with the
+    stem folder layout so far and the SHA-256 of the stems already extracted. It lives
+    in the staging folder, is rewritten atomically after every member, and is only
+    saved for files with a validator, so a resume can ask for the same file (If-Range).
+    """
+
+    def __init__(self, path, url):
+        self.path = path
+        self.url = url
+        self.validator = None
+        self.offset = 0
+        self.stem_dir = None
+        self.used_names = []
+        self.digests = {}
+
+    def load(self):
+        """Load the resume point if the journal on disk belongs to the same URL."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable journal {self.path}")
+            return False
+        if state.get("url") != self.url or not state.get("validator"):
+            return False
+        self.validator = state["validator"]
+        self.offset = state["offset"]
+        self.stem_dir = state.get("stem_dir")
+        self.used_names = state.get("used_names", [])
+        self.digests = state.get("digests", {})
+        return True
+
+    def save(self, offset, layout, digests):
+        """Record that everything before offset is extracted, given the FlatLayout and digests so far."""
+        if self.validator is None:
+            return  # A resume couldn't tell whether the file changed
+        self.offset = offset
+        self.stem_dir = layout.stem_dir
+        self.used_names = sorted(layout.used_names)
+        self.digests = dict(digests)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "url": self.url,
+                "validator": self.validator,
+                "offset": self.offset,
+                "stem_dir": self.stem_dir,
+                "used_names": self.used_names,
+                "digests": self.digests,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent inclusive ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_ranges(ranges, num_parts):
+    """Split the missing ranges into at most roughly num_parts pieces of similar size."""
+    total = sum(end - start + 1 for start, end in ranges)
+    if total == 0:
+        return []
+    target = max(1, -(-total // num_parts))
+    parts = []
+    for start, end in ranges:
+        while start <= end:
+            part_end = min(end, start + target - 1)
+            parts.append((start, part_end))
+            start = part_end + 1
+    return parts
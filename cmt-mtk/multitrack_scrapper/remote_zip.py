@@ -0,0 +1,370 @@
+"""
+    List the members of a remote zip and download only some of its stems, with HTTP
+    Range requests: one for the central directory at the end of the archive, then one
+    per run of adjacent selected members. Nothing else of the archive is downloaded.
+
+    python remote_zip.py <zip_url> --list
+    python remote_zip.py <zip_url> <output_folder> --category drum kick snare --pattern "*Vox*"
+"""
+
+import os
+import json
+import shutil
+import struct
+import zlib
+import argparse
+from fnmatch import fnmatch
+
+from stream_unzip import ChunkReader, StreamFallback, copy_deflated, copy_stored
+from stem_extract import AUDIO_PATTERNS, FlatLayout
+
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "post_processing"))
+from buffered_io import WriteBehindFile
+from metrics import Metrics
+from http_cache import response_validators
+from stem_categories import CATEGORIES, category_of
+import http_client
+
+LOCAL_FILE_HEADER = 0x04034b50
+CENTRAL_DIRECTORY_HEADER = 0x02014b50
+END_OF_CENTRAL_DIRECTORY = 0x06054b50
+ZIP64_END_OF_CENTRAL_DIRECTORY = 0x06064b50
+ZIP64_LOCATOR = 0x07064b50
+TAIL_SIZE = 64 * 1024 + 22  # End of central directory record with the longest possible comment
+MAX_GAP = 256 * 1024  # Unselected bytes read (and dropped) rather than starting another request
+SELECTION_FILE = ".selected_stems.json"  # Left next to the stems of a selective fetch, see stored_selection
+
+
+class ZipMember:
+    def __init__(self, name, method, flags, crc, compressed_size, size, offset):
+        self.name = name
+        self.method = method
+        self.flags = flags
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.offset = offset  # Of the local file header
+        self.end = None  # Offset of whatever follows the member (next header or central directory)
+
+
+class RemoteZip:
+    """
+    A zip archive read through Range requests on its URL. members() reads the
+    central directory (zip64 included), fetch() downloads and extracts some members.
+    Bytes and requests are counted in metrics.
+    """
+
+    def __init__(self, url, metrics=None):
+        self.url = url
+        self.metrics = metrics or Metrics()
+        self.size = None
+        self.headers = None  # Of the last response, for its validators
+        self.directory = None
+
+    def get_range(self, byte_range, stream=False):
+        """GET a byte range (e.g. "0-99" or "-100"), returning the response and the offset it starts at."""
+        counters = self.metrics.worker()
+        counters.requests += 1
+        response = http_client.get(self.url, headers={"Range": f"bytes={byte_range}"}, stream=stream,
+                                   allow_redirects=True)
+        counters.observe_latency(response.elapsed.total_seconds())
+        response.raise_for_status()
+        if response.status_code != 206:
+            response.close()
+            counters.errors += 1
+            raise StreamFallback(f"{self.url} doesn't support Range requests.")
+        try:
+            served, total = response.headers.get("content-range", "").split(" ")[1].split("/")
+            start = int(served.split("-")[0])
+        except (IndexError, ValueError):
+            response.close()
+            raise Exception(f"Malformed Content-Range '{response.headers.get('content-range')}' for {self.url}.")
+        self.size = int(total)
+        self.headers = response.headers
+        return response, start
+
+    def read(self, start, end):
+        """Bytes start..end (inclusive) of the archive."""
+        response, _ = self.get_range(f"{start}-{end}")
+        self.metrics.worker().bytes += len(response.content)
+        return response.content
+
+    def members(self):
+        """List every member of the archive, in archive order."""
+        if self.directory is not None:
+            return self.directory
+        response, tail_start = self.get_range(f"-{TAIL_SIZE}")
+        tail = response.content
+        self.metrics.worker().bytes += len(tail)
+        position = tail.rfind(struct.pack("<I", END_OF_CENTRAL_DIRECTORY))
+        if position < 0:
+            raise Exception(f"No end of central directory record in {self.url}, not a zip?")
+        entries, directory_size, directory_offset = struct.unpack("<10xHII", tail[position:position + 20])
+        if 0xFFFFFFFF in (directory_size, directory_offset) or entries == 0xFFFF:
+            entries, directory_size, directory_offset = self.zip64_directory(tail, tail_start, position)
+
+        if directory_offset >= tail_start:
+            directory = tail[directory_offset - tail_start:directory_offset - tail_start + directory_size]
+        else:
+            directory = self.read(directory_offset, directory_offset + directory_size - 1)
+        self.directory = parse_central_directory(directory, entries)
+        for member, following in zip(self.directory, self.directory[1:] + [None]):
+            member.end = following.offset if following is not None else directory_offset
+        return self.directory
+
+    def zip64_directory(self, tail, tail_start, position):
+        """Entry count, size and offset of the central directory from the zip64 records."""
+        locator = tail[position - 20:position]
+        if len(locator) < 20 or struct.unpack("<I", locator[:4])[0] != ZIP64_LOCATOR:
+            raise Exception(f"Missing zip64 locator in {self.url}.")
+        record_offset = struct.unpack("<Q", locator[8:16])[0]
+        if record_offset >= tail_start:
+            record = tail[record_offset - tail_start:record_offset - tail_start + 56]
+        else:
+            record = self.read(record_offset, record_offset + 55)
+        if struct.unpack("<I", record[:4])[0] != ZIP64_END_OF_CENTRAL_DIRECTORY:
+            raise Exception(f"Bad zip64 end of central directory in {self.url}.")
+        entries, directory_size, directory_offset = struct.unpack("<QQQ", record[32:56])
+        return entries, directory_size, directory_offset
+
+    def fetch(self, members, target_for, digests=None):
+        """
+        Download and extract members (from members()) to target_for(member.name),
+        CRC checking each of them. Members less than MAX_GAP bytes apart in the archive
+        (e.g. separated by __MACOSX entries) are fetched with a single request.
+        With digests (a dict), the SHA-256 of every extracted file is stored there by path.
+        Returns the list of extracted file paths.
+        """
+        extracted = []
+        for run in adjacent_runs(sorted(members, key=lambda member: member.offset)):
+            response, _ = self.get_range(f"{run[0].offset}-{run[-1].end - 1}", stream=True)
+            counters = self.metrics.worker()
+            with response:
+                def chunks():
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        counters.bytes += len(chunk)
+                        yield chunk
+                reader = ChunkReader(chunks())
+                position = run[0].offset
+                for member in run:
+                    if member.offset > position:
+                        reader.read_exact(member.offset - position)  # Gap of unselected members
+                    extracted.append(extract_member(reader, member, target_for(member.name), digests))
+                    position = member.end
+        return extracted
+
+
+def parse_central_directory(directory, entries):
+    members = []
+    position = 0
+    for _ in range(entries):
+        if struct.unpack("<I", directory[position:position + 4])[0] != CENTRAL_DIRECTORY_HEADER:
+            raise Exception("Corrupt central directory.")
+        (flags, method, crc, compressed_size, size, name_length, extra_length, comment_length,
+         offset) = struct.unpack("<4xHH4xIIIHHH8xI", directory[position + 4:position + 46])
+        name = directory[position + 46:position + 46 + name_length].decode("utf-8" if flags & 0x800 else "cp437")
+        extra = directory[position + 46 + name_length:position + 46 + name_length + extra_length]
+        if 0xFFFFFFFF in (size, compressed_size, offset):
+            size, compressed_size, offset = zip64_sizes(extra, size, compressed_size, offset)
+        members.append(ZipMember(name, method, flags, crc, compressed_size, size, offset))
+        position += 46 + name_length + extra_length + comment_length
+    return sorted(members, key=lambda member: member.offset)
+
+
+def zip64_sizes(extra, size, compressed_size, offset):
+    """Replace the 0xFFFFFFFF fields with their values from the zip64 extra field, which only holds those."""
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, length = struct.unpack("<HH", extra[position:position + 4])
+        if header_id == 0x0001:
+            values = iter(struct.unpack(f"<{length // 8}Q", extra[position + 4:position + 4 + length // 8 * 8]))
+            if size == 0xFFFFFFFF:
+                size = next(values)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = next(values)
+            if offset == 0xFFFFFFFF:
+                offset = next(values)
+            break
+        position += 4 + length
+    return size, compressed_size, offset
+
+
+def adjacent_runs(members, max_gap=MAX_GAP):
+    """Split members (sorted by offset) into runs where each one starts at most max_gap bytes after the previous one."""
+    runs = []
+    for member in members:
+        if runs and member.offset - runs[-1][-1].end <= max_gap:
+            runs[-1].append(member)
+        else:
+            runs.append([member])
+    return runs
+
+
+def extract_member(reader, member, target, digests=None):
+    """
+    Read one member (local header, data, descriptor) from reader into target, and check
+    its CRC. Its SHA-256 goes into digests, if given.
+    """
+    header = reader.read_exact(30)
+    if struct.unpack("<I", header[:4])[0] != LOCAL_FILE_HEADER:
+        raise Exception(f"No local header at the offset of {member.name}.")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    reader.read_exact(name_length + extra_length)
+    if member.flags & 0x1:
+        raise StreamFallback(f"{member.name} is encrypted.")
+    if member.method not in (0, 8):
+        raise StreamFallback(f"{member.name} uses compression method {member.method}.")
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with WriteBehindFile(target) as out:
+        if member.method == 0:
+            crc, size, sha256 = copy_stored(reader, out, member.compressed_size)
+        else:
+            crc, size, sha256 = copy_deflated(reader, out)
+    if crc != member.crc or size != member.size:
+        raise zlib.error(f"CRC or size mismatch for {member.name}.")
+    if digests is not None:
+        digests[target] = sha256
+    # Skip the data descriptor, if any, up to the next member
+    trailing = member.end - (member.offset + 30 + name_length + extra_length + member.compressed_size)
+    if trailing > 0:
+        reader.read_exact(trailing)
+    return target
+
+
+def stem_filter(patterns=None, categories=None):
+    """
+    Selector of the stems to fetch: audio members whose file name matches one of
+    patterns (fnmatch, case insensitive) or falls in one of categories (see
+    post_processing/stem_categories.py). Without either, every stem is selected.
+    The selector's selection attribute describes it, as stored in SELECTION_FILE.
+    """
+    unknown = set(categories or ()) - set(CATEGORIES) - {"other"}
+    if unknown:
+        raise ValueError(f"Unknown stem categories {sorted(unknown)}, use {sorted(CATEGORIES) + ['other']}.")
+
+    def select(name):
+        base = name.replace("\\", "/").split("/")[-1]
+        if not any(fnmatch(base.lower(), pattern) for pattern in AUDIO_PATTERNS):
+            return False
+        if not patterns and not categories:
+            return True
+        return (any(fnmatch(base.lower(), pattern.lower()) for pattern in patterns or ())
+                or category_of(base) in (categories or ()))
+    select.selection = "full" if not patterns and not categories else {
+        "patterns": sorted({pattern.lower() for pattern in patterns or ()}),
+        "categories": sorted(set(categories or ())),
+    }
+    return select
+
+
+def selection_of(select):
+    """Description of a selector (see stem_filter): "full" for None, None for one stem_filter didn't make."""
+    return "full" if select is None else getattr(select, "selection", None)
+
+
+def stored_selection(folder):
+    """Selection of the stems extracted into folder, "full" unless a selective fetch left a SELECTION_FILE."""
+    path = os.path.join(folder, SELECTION_FILE)
+    if not os.path.exists(path):
+        return "full"
+    try:
+        with open(path) as f:
+            return json.load(f)["selection"]
+    except (OSError, ValueError, KeyError):
+        print(f"Ignoring unreadable {path}")
+        return None
+
+
+def selection_covers(stored, requested):
+    """Whether every stem of the requested selection is among the stored one ("full" covers everything)."""
+    if stored == "full":
+        return True
+    if stored is None or requested is None or requested == "full":
+        return False
+    return (set(requested["patterns"]) <= set(stored["patterns"])
+            and set(requested["categories"]) <= set(stored["categories"]))
+
+
+def record_selection(folder, select):
+    """Write the selection of the stems just fetched into folder, for the next stored_selection."""
+    path = os.path.join(folder, SELECTION_FILE)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"selection": selection_of(select)}, f)
+    os.replace(temp_path, path)
+
+
+def fetch_selected_stems(url, output_folder, select, default_dir="multitrack", metrics=None, digests=None,
+                         validators=None):
+    """
+    Download only the stems chosen by select(member name) (see stem_filter) into one
+    flat stem folder inside output_folder, like stream_download_and_extract does
+    with the whole archive. Members land in a hidden staging folder first, and the
+    selection is recorded in output_folder (see stored_selection), so a later full
+    download doesn't take the partial folder for a finished one.
+    With digests (a dict), the SHA-256 of every stem is stored there by final path.
+    With validators (a dict), the archive's validators (see http_cache) are stored there.
+    Returns (bytes downloaded, number of stems), or None if the archive can't be read
+    with Range requests, in which case the caller falls back to a full download.
+    """
+    metrics = metrics or Metrics()
+    counters = metrics.worker()
+    received = counters.bytes
+    remote = RemoteZip(url, metrics)
+    staging_folder = os.path.join(output_folder, ".selecting")
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    try:
+        members = remote.members()
+        layout = FlatLayout(staging_folder, default_dir)
+        selected = [member for member in members if not member.name.endswith("/") and select(member.name)]
+        targets = {member.name: layout.target(member.name) for member in selected}
+        selected = [member for member in selected if targets[member.name] is not None]
+        staged = {}
+        remote.fetch(selected, targets.get, staged)
+        if selected:
+            for name in os.listdir(staging_folder):
+                os.replace(os.path.join(staging_folder, name), os.path.join(output_folder, name))
+            os.rmdir(staging_folder)
+            record_selection(output_folder, select)
+        if digests is not None:
+            for path, sha256 in staged.items():
+                digests[os.path.join(output_folder, os.path.relpath(path, staging_folder))] = sha256
+        if validators is not None:
+            validators.update(response_validators(remote.headers, remote.size))
+    except StreamFallback as e:
+        print(f"Can't select stems from {url} ({e}), falling back to the whole archive.")
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        return None
+    except Exception as e:
+        counters.errors += 1
+        print(f"Fetching selected stems of {url} failed ({e}), falling back to the whole archive.")
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        return None
+    downloaded = counters.bytes - received
+    whole = sum(member.compressed_size for member in members)
+    print(f"Fetched {len(selected)} of {len(members)} members of {url} "
+          f"({downloaded / 1024 ** 2:.1f} of {whole / 1024 ** 2:.1f} MB).")
+    return downloaded, len(selected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List a remote multitrack zip, or download only some of its stems.")
+    parser.add_argument("url")
+    parser.add_argument("output_folder", nargs="?")
+    parser.add_argument("--list", action="store_true", help="only list the members and their categories")
+    parser.add_argument("--pattern", nargs="*", default=[], help='stem file name patterns, e.g. "*Kick*"')
+    parser.add_argument("--category", nargs="*", default=[], choices=list(CATEGORIES) + ["other"])
+    args = parser.parse_args()
+
+    if args.list or not args.output_folder:
+        for member in RemoteZip(args.url).members():
+            print(f"{member.size / 1024 ** 2:10.1f} MB  {category_of(member.name.split('/')[-1]):<10}  {member.name}")
+        return
+    fetch_selected_stems(args.url, args.output_folder, stem_filter(args.pattern, args.category))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,28 @@
 #  number of tracks in excert and full multitrack, and the number of bars
 #  in the excerpt and full multitrack, links to mixing and mastering forum, podcast link.
 
+import os
+import sys
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+import http_client
+
 # URL of the website to scrape
 URL = "https://cambridge-mt.com/ms/mtk/"
+# Pages are recorded into this archive, or with REPLAY served from it offline (see common/http_archive.py)
+HTTP_ARCHIVE = None  # e.g. "data/multitrack_website/pages.sqlite"
+REPLAY = False
+
+if HTTP_ARCHIVE:
+    http_client.use_archive(HTTP_ARCHIVE, replay=REPLAY)
 
 try:
     # Send a GET request to the webpage
-    response = requests.get(URL)
+    response = http_client.get(URL)
     response.raise_for_status()  # Raise an error for bad status codes
     soup = BeautifulSoup(response.content, "html.parser")
 
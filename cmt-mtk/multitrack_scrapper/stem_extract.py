@@ -0,0 +1,128 @@
+import os
+import hashlib
+import threading
+import zipfile
+import zlib
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+from stream_unzip import safe_member_path
+
+# Members worth extracting from a multitrack archive, everything else is skipped
+AUDIO_PATTERNS = ("*.wav", "*.aif", "*.aiff", "*.flac")
+
+
+class FlatLayout:
+    """
+    Decide where each archive member goes so that all stems end up in one folder,
+    output_folder/<stem dir>/<stem>, which is the layout the post-processing scripts
+    glob for. <stem dir> is the top-level folder of the first stem in the archive, or
+    default_dir when stems sit at the archive root. __MACOSX, hidden files and
+    members not matching patterns are skipped.
+    """
+
+    def __init__(self, output_folder, default_dir, patterns=AUDIO_PATTERNS):
+        self.output_folder = output_folder
+        self.default_dir = default_dir
+        self.patterns = patterns
+        self.stem_dir = None
+        self.used_names = set()
+
+    def target(self, name):
+        """Return the output path for a member, or None to skip it."""
+        parts = [p for p in name.replace("\\", "/").split("/") if p]
+        if not parts or name.endswith("/") or "__MACOSX" in parts or parts[-1].startswith("."):
+            return None
+        if not any(fnmatch(parts[-1].lower(), pattern) for pattern in self.patterns):
+            return None
+
+        if self.stem_dir is None:
+            self.stem_dir = parts[0] if len(parts) > 1 else self.default_dir
+        file_name = parts[-1]
+        if file_name.lower() in self.used_names:
+            # Same stem name in two subfolders, keep both
+            file_name = f"{parts[-2]}_{file_name}" if len(parts) > 1 else f"{len(self.used_names)}_{file_name}"
+        self.used_names.add(file_name.lower())
+        return safe_member_path(self.output_folder, f"{self.stem_dir}/{file_name}")
+
+
+def extract_stems(zip_path, output_folder, default_dir=None, patterns=AUDIO_PATTERNS, max_workers=4, digests=None):
+    """
+    Extract only the audio members of a zip, straight into their flat location, with
+    members decompressed concurrently (zlib releases the GIL). Every thread reads
+    through its own ZipFile handle. zipfile checks each member's CRC as it is read.
+    With digests (a dict), the SHA-256 of every stem is stored there by path.
+    Returns the list of extracted file paths.
+    """
+    default_dir = default_dir or os.path.splitext(os.path.basename(zip_path))[0]
+    layout = FlatLayout(output_folder, default_dir, patterns)
+    with zipfile.ZipFile(zip_path) as zip_ref:
+        # Read in archive order, so the disk is scanned roughly sequentially
+        members = sorted(zip_ref.infolist(), key=lambda info: info.header_offset)
+        plan = [(info, layout.target(info.filename)) for info in members]
+    plan = [(info, target) for info, target in plan if target is not None]
+    if not plan:
+        return []
+    os.makedirs(os.path.dirname(plan[0][1]), exist_ok=True)
+
+    with ZipHandles(zip_path) as handles, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def extract_member(item):
+            info, target = item
+            digest = hashlib.sha256()
+            with handles.get().open(info) as source, open(target, "wb") as destination:
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    destination.write(chunk)
+                    digest.update(chunk)
+            if digests is not None:
+                digests[target] = digest.hexdigest()
+            return target
+        return list(executor.map(extract_member, plan))
+
+
+def verify_zip(zip_path, max_workers=4):
+    """
+    Read every member of a zip in parallel and check it against its CRC-32, without
+    writing anything. Returns the names of the members that are corrupt (an unreadable
+    archive is reported as a single bad "<central directory>" member).
+    """
+    try:
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            members = sorted(zip_ref.infolist(), key=lambda info: info.header_offset)
+    except (zipfile.BadZipFile, OSError):
+        return ["<central directory>"]
+
+    with ZipHandles(zip_path) as handles, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def is_corrupt(info):
+            try:
+                with handles.get().open(info) as source:
+                    while source.read(1024 * 1024):  # zipfile raises BadZipFile on a CRC mismatch at the end
+                        pass
+                return False
+            except (zipfile.BadZipFile, zlib.error, EOFError, OSError):
+                return True
+        corrupt = list(executor.map(is_corrupt, members))
+    return [info.filename for info, bad in zip(members, corrupt) if bad]
+
+
+class ZipHandles:
+    """One ZipFile per thread for the same archive, so members can be read concurrently."""
+
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self.local = threading.local()
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not hasattr(self.local, "zip_ref"):
+            self.local.zip_ref = zipfile.ZipFile(self.zip_path)
+            with self.lock:
+                self.opened.append(self.local.zip_ref)
+        return self.local.zip_ref
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for zip_ref in self.opened:
+            zip_ref.close()
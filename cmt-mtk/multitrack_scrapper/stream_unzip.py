@@ -0,0 +1,184 @@
+import os
+import struct
+import zlib
+import hashlib
+
+import sys
+currentdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(os.path.dirname(currentdir), "common"))
+from buffered_io import WriteBehindFile
+
+LOCAL_FILE_HEADER = 0x04034b50
+CENTRAL_DIRECTORY_HEADER = 0x02014b50
+END_OF_CENTRAL_DIRECTORY = 0x06054b50
+DATA_DESCRIPTOR = 0x08074b50
+
+
+class StreamFallback(Exception):
+    """Raised when an archive can't be extracted from its local headers alone and needs the central directory."""
+
+
+class ChunkReader:
+    """
+    Byte reader on top of an iterator of chunks (e.g. response.iter_content). position
+    is the offset in the archive of the next byte read, the chunks starting at start.
+    """
+
+    def __init__(self, chunks, start=0):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.position = start
+
+    def read(self, n):
+        """Return up to n bytes, b"" once the stream is exhausted."""
+        if not self.buffer:
+            self.buffer = next(self.chunks, b"")
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        self.position += len(data)
+        return data
+
+    def read_exact(self, n):
+        parts = []
+        while n > 0:
+            data = self.read(n)
+            if not data:
+                raise EOFError("Archive stream ended unexpectedly.")
+            parts.append(data)
+            n -= len(data)
+        return b"".join(parts)
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+        self.position -= len(data)
+
+
+def safe_member_path(output_folder, name):
+    """Resolve a member name inside output_folder, refusing absolute paths and '..' like zipfile does."""
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    if not parts:
+        return None
+    return os.path.join(output_folder, *parts)
+
+
+def has_zip64_extra(extra):
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[position:position + 4])
+        if header_id == 0x0001:
+            return True
+        position += 4 + size
+    return False
+
+
+def copy_stored(reader, out, size):
+    """Copy a stored member, returns its CRC-32, size and SHA-256."""
+    crc = 0
+    digest = hashlib.sha256()
+    remaining = size
+    while remaining:
+        data = reader.read(min(remaining, 1024 * 1024))
+        if not data:
+            raise EOFError("Archive stream ended inside a stored member.")
+        out.write(data)
+        crc = zlib.crc32(data, crc)
+        digest.update(data)
+        remaining -= len(data)
+    return crc, size, digest.hexdigest()
+
+
+def copy_deflated(reader, out):
+    """
+    Inflate until the end of the deflate stream, pushing back any bytes that belong to
+    the next record. Returns the CRC-32, size and SHA-256 of the inflated member.
+    """
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    crc = 0
+    digest = hashlib.sha256()
+    written = 0
+    while not decompressor.eof:
+        data = reader.read(1024 * 1024)
+        if not data:
+            raise EOFError("Archive stream ended inside a deflated member.")
+        output = decompressor.decompress(data)
+        out.write(output)
+        crc = zlib.crc32(output, crc)
+        digest.update(output)
+        written += len(output)
+    reader.unread(decompressor.unused_data)
+    return crc, written, digest.hexdigest()
+
+
+def stream_extract(chunks, output_folder, target_for=None, digests=None, start=0, on_member=None):
+    """
+    Extract a zip archive from an iterator of byte chunks as they arrive, using only
+    the local file headers. Every member is CRC checked.
+    target_for(name) can map a member name to its output path, or to None to skip it;
+    by default members are extracted with their archive paths under output_folder.
+    With digests (a dict), the SHA-256 of every extracted file is stored there by path.
+    chunks may start at a local header past the start of the archive, at offset start.
+    on_member(offset), if given, is called once each member is written and checked,
+    with the offset of the record that follows it: where to resume a broken stream.
+
+    Raises StreamFallback for archives that need the central directory (encrypted
+    members, zip64, methods other than stored/deflate, stored members with a data
+    descriptor). Members extracted before that point are left on disk.
+    Returns the list of extracted file paths.
+    """
+    reader = ChunkReader(chunks, start)
+    extracted = []
+    while True:
+        signature = struct.unpack("<I", reader.read_exact(4))[0]
+        if signature in (CENTRAL_DIRECTORY_HEADER, END_OF_CENTRAL_DIRECTORY):
+            return extracted  # Every member has been seen, the rest is the directory
+        if signature != LOCAL_FILE_HEADER:
+            raise StreamFallback(f"Unexpected record signature {signature:#010x}.")
+
+        (_, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length) = struct.unpack("<HHHHHIIIHH", reader.read_exact(26))
+        raw_name = reader.read_exact(name_length)
+        extra = reader.read_exact(extra_length)
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+
+        if flags & 0x1:
+            raise StreamFallback(f"{name} is encrypted.")
+        if method not in (0, 8):
+            raise StreamFallback(f"{name} uses compression method {method}.")
+        if has_zip64_extra(extra) or 0xFFFFFFFF in (compressed_size, size):
+            raise StreamFallback(f"{name} is a zip64 member.")
+        has_descriptor = bool(flags & 0x8)
+        if has_descriptor and method == 0:
+            raise StreamFallback(f"{name} is stored with an unknown size.")
+
+        if target_for is not None:
+            target = None if name.endswith("/") else target_for(name)
+            is_directory = target is None
+        else:
+            target = safe_member_path(output_folder, name)
+            is_directory = target is None or name.endswith("/")
+            if is_directory and target is not None:
+                os.makedirs(target, exist_ok=True)
+        if not is_directory:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        # Directory entries and skipped members are still read (and checked), into devnull.
+        # Stems are written by a background thread, so inflating never waits on the disk.
+        with open(os.devnull, "wb") if is_directory else WriteBehindFile(target) as out:
+            if method == 0:
+                actual_crc, actual_size, sha256 = copy_stored(reader, out, compressed_size)
+            else:
+                actual_crc, actual_size, sha256 = copy_deflated(reader, out)
+
+        if has_descriptor:
+            descriptor = reader.read_exact(12)
+            if struct.unpack("<I", descriptor[:4])[0] == DATA_DESCRIPTOR:
+                descriptor = descriptor[4:] + reader.read_exact(4)
+            crc, compressed_size, size = struct.unpack("<III", descriptor)
+
+        if actual_crc != crc or actual_size != size:
+            raise zlib.error(f"CRC or size mismatch for {name}.")
+        if not is_directory:
+            extracted.append(target)
+            if digests is not None:
+                digests[target] = sha256
+        if on_member is not None:
+            on_member(reader.position)
@@ -1,5 +1,4 @@
 import os
-import re
 import yaml
 import soundfile as sf
 import librosa
@@ -9,58 +8,16 @@ import shutil
 from glob import glob
 from tqdm import tqdm
 import audalign as ad
+from stem_categories import categorize_names
 
 def opj(*args):
     return os.path.join(*args)
 
-def add_space_between_cases(text):
-    return re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
-
 def categorize_tracks(multitrack_dir):
-    correspondance = {
-        'kick': [], 'snare': [], 'aux_perc': [], 'percussion': [], 'drum': [], 'bass': [], 'synth': [], 'keys': [], 
-        'room': [], 'organ': [], 'brass': [], 'woodwind': [], 'vocal': [], 'string': [], 'fx': [], 'guitar': [], 'other': []
-    }
     track_names = glob(opj(multitrack_dir, "*.wav"))
     if len(track_names) == 0:
         return {}
-    names = [os.path.basename(name) for name in track_names]
-    length = len(names)
-    
-    for name in names:
-        process_name = re.sub(r'\d+', '', name.replace(".wav", "").replace("_", " ").replace("-", " "))
-        process_name = add_space_between_cases(process_name).lower()
-        
-        categories = {
-            "kick": ["kick"],
-            "snare": ["snare"],
-            "aux_perc": ["hihat", "tom", "cymbal", "ride", "crash", "splash", "hi", "hat", "ride"],
-            "percussion": ["perc", "shaker", "kalimba", "clap", "snap", "djembe", "cowbell", "conga", "glockenspiel", "timpani", "congo", "beat", "overhead", "beatbox", "tambourine", "triangle", "maraca", "bongo", "cabasa", "guiro", "woodblock", "clave", "castanet", "agogo", "whistle", "bell", "chime", "gong", "tambourine"],
-            "drum": ["drum"],
-            "bass": ["bass"],
-            "synth": ["synth"],
-            "keys": ["piano", "keys", "clavinet", "rhodes", "accordion"],
-            "room": ["room"],
-            "organ": ["organ"],
-            "brass": ["brass", "trumpet", "trombone", "horn", "bagpipe", "tuba", "euphonium"],
-            "woodwind": ["woodwind", "flute", "clarinet", "oboe", "saxophone", "sax", "bassoon", "alto", "soprano"],
-            "vocal": ["vocal", "choir", "vox", "backing"],
-            "string": ["string", "violin", "cello", "viola"],
-            "fx": ["fx"],
-            "guitar": ["guitar", "gtr", "ukulele", "ukelele", "banjo", "fiddle", "mandolin"]
-        }
-        
-        found = False
-        for category, keywords in categories.items():
-            if any(keyword in process_name for keyword in keywords):
-                correspondance[category].append(name)
-                found = True
-                break
-        
-        if not found:
-            correspondance['other'].append(name)
-    
-    return {k: v for k, v in correspondance.items() if v}
+    return categorize_names([os.path.basename(name) for name in track_names])
 
 def get_first_subdir(parent_dir):
     """Returns the first subdirectory inside a given directory, or None if empty."""
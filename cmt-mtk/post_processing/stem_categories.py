@@ -0,0 +1,44 @@
+import os
+import re
+
+# Keywords of every stem category, a stem goes to the first category with a keyword in its name
+CATEGORIES = {
+    "kick": ["kick"],
+    "snare": ["snare"],
+    "aux_perc": ["hihat", "tom", "cymbal", "ride", "crash", "splash", "hi", "hat", "ride"],
+    "percussion": ["perc", "shaker", "kalimba", "clap", "snap", "djembe", "cowbell", "conga", "glockenspiel", "timpani", "congo", "beat", "overhead", "beatbox", "tambourine", "triangle", "maraca", "bongo", "cabasa", "guiro", "woodblock", "clave", "castanet", "agogo", "whistle", "bell", "chime", "gong", "tambourine"],
+    "drum": ["drum"],
+    "bass": ["bass"],
+    "synth": ["synth"],
+    "keys": ["piano", "keys", "clavinet", "rhodes", "accordion"],
+    "room": ["room"],
+    "organ": ["organ"],
+    "brass": ["brass", "trumpet", "trombone", "horn", "bagpipe", "tuba", "euphonium"],
+    "woodwind": ["woodwind", "flute", "clarinet", "oboe", "saxophone", "sax", "bassoon", "alto", "soprano"],
+    "vocal": ["vocal", "choir", "vox", "backing"],
+    "string": ["string", "violin", "cello", "viola"],
+    "fx": ["fx"],
+    "guitar": ["guitar", "gtr", "ukulele", "ukelele", "banjo", "fiddle", "mandolin"]
+}
+
+
+def add_space_between_cases(text):
+    return re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
+
+
+def category_of(name):
+    """Category of a stem file name (e.g. "03_SnareTop.wav" -> "snare"), "other" if no keyword matches."""
+    process_name = re.sub(r'\d+', '', os.path.splitext(name)[0].replace("_", " ").replace("-", " "))
+    process_name = add_space_between_cases(process_name).lower()
+    for category, keywords in CATEGORIES.items():
+        if any(keyword in process_name for keyword in keywords):
+            return category
+    return "other"
+
+
+def categorize_names(names):
+    """Group stem file names by category, leaving out empty categories."""
+    correspondance = {category: [] for category in list(CATEGORIES) + ["other"]}
+    for name in names:
+        correspondance[category_of(name)].append(name)
+    return {k: v for k, v in correspondance.items() if v}
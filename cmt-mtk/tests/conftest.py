@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+for folder in ("common", "multitrack_scrapper", "forum_scrapper", "benchmarks"):
+    sys.path.append(os.path.join(root, folder))
+
+from mock_server import MockServer, ServerConfig
+
+
+@pytest.fixture
+def mock_server():
+    """Start a MockServer with the given ServerConfig options, stopped after the test."""
+    servers = []
+
+    def start(**options):
+        server = MockServer(config=ServerConfig(**options)).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
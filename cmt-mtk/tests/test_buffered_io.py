@@ -0,0 +1,27 @@
+import os
+
+import http_client
+from buffered_io import BufferPool, save_response
+from download_dataset import download_file_with_progress
+
+
+def test_save_response_reuses_the_connection(mock_server, tmp_path):
+    server = mock_server(mp3_size=300 * 1024)
+    pool = BufferPool(count=2, size=64 * 1024)
+    for i in range(5):
+        with http_client.get(f"{server.url}/files/mix_{i}.mp3", stream=True) as response:
+            assert save_response(response, str(tmp_path / f"mix_{i}.mp3"), pool) == 300 * 1024
+    assert server.stats.requests == 5
+    assert server.stats.connections == 1
+
+
+def test_ranged_parts_reuse_the_connection(mock_server, tmp_path):
+    server = mock_server(zip_stems=2, stem_size=2 * 1024 * 1024)
+    size = len(server.static_file("multitrack", "zip"))
+    for i in range(3):
+        path = str(tmp_path / f"multitrack_{i}.zip")
+        download_file_with_progress(f"{server.url}/files/multitrack.zip", path, num_parts=4, max_workers=1,
+                                    min_part_size=256 * 1024, show_progress=False)
+        assert os.path.getsize(path) == size
+    assert server.stats.requests == 12
+    assert server.stats.connections == 1
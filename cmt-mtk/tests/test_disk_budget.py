@@ -0,0 +1,42 @@
+import time
+import threading
+
+import disk_budget
+from disk_budget import DiskBudget
+
+MB = 1024 ** 2
+
+
+def test_unknown_size_reserves_the_largest_so_far(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_budget, "UNKNOWN_FOOTPRINT", 1 * MB)
+    budget = DiskBudget(str(tmp_path), headroom=0)
+
+    assert budget.reserve(None).nbytes == 1 * MB
+    budget.reserve(5 * MB)
+    assert budget.reserve(None).nbytes == 5 * MB
+
+
+def test_tracked_trees_are_not_walked_on_every_check(tmp_path, monkeypatch):
+    walks = []
+    monkeypatch.setattr(disk_budget, "disk_used", lambda path: walks.append(path) or 0)
+    budget = DiskBudget(str(tmp_path), headroom=0, measure_interval=60)
+    budget.reserve(MB).track(str(tmp_path))
+
+    for _ in range(20):
+        budget.reserve(1024)
+    assert len(walks) == 1  # Only track(), the admissions use the measurement of the first one
+
+
+def test_release_admits_a_waiting_download(tmp_path):
+    budget = DiskBudget(str(tmp_path), budget=10 * MB, headroom=0, measure_interval=60)
+    first = budget.reserve(8 * MB)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(budget.reserve(5 * MB)))
+    waiter.start()
+    time.sleep(0.2)
+    assert not admitted
+
+    start = time.time()
+    first.release()
+    waiter.join(5)
+    assert admitted and time.time() - start < 1.0
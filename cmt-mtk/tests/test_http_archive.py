@@ -0,0 +1,27 @@
+import time
+
+import http_client
+from host_controller import AIMDController
+
+
+def test_replay_skips_the_politeness_interval(mock_server, tmp_path):
+    server = mock_server()
+    urls = [f"{server.url}/forumdisplay.php?fid={fid}&page={page}" for fid in (101, 102, 103) for page in range(1, 7)]
+    session = http_client.session(pool_size=4, status_retries=False)
+    try:
+        http_client.use_archive(str(tmp_path / "pages.sqlite"))
+        recorder = AIMDController(initial_interval=0.0)
+        recorded = [recorder.request(session.get, url).text for url in urls]
+        http_client.archive.close()
+        server.stop()
+
+        http_client.use_archive(str(tmp_path / "pages.sqlite"), replay=True)
+        controller = AIMDController(initial_concurrency=1, initial_interval=2.0, min_interval=0.5)
+        start = time.time()
+        replayed = [controller.request(session.get, url).text for url in urls]
+        assert time.time() - start < 1.0
+        assert replayed == recorded
+    finally:
+        if http_client.archive is not None:
+            http_client.archive.close()
+        http_client.archive = None
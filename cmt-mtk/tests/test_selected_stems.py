@@ -0,0 +1,38 @@
+import os
+
+from download_dataset import download_asset, is_asset_downloaded
+from http_cache import ValidatorCache
+from remote_zip import SELECTION_FILE, stem_filter
+
+
+def stems_in(folder):
+    """File names of the extracted stems, staging folders left out."""
+    return sorted(name for root, dirs, files in os.walk(folder) if "/." not in root[len(folder):]
+                  for name in files if not name.startswith("."))
+
+
+def test_full_download_after_a_selective_fetch(mock_server, tmp_path):
+    server = mock_server(stem_size=256 * 1024)
+    url = f"{server.url}/files/multitrack.zip"
+    folder = str(tmp_path / "Song" / "full_multitrack")
+    validator_cache = ValidatorCache(str(tmp_path / ".http_cache.jsonl"))
+    drums = stem_filter(categories=["kick", "snare"])
+
+    assert download_asset(url, folder, "multitrack.zip", "Full multitrack", "Song", show_progress=False,
+                          validator_cache=validator_cache, select=drums) > 0
+    assert stems_in(folder) == ["01_Kick.wav", "02_Snare.wav"]
+    assert is_asset_downloaded(folder, "multitrack.zip", stem_filter(categories=["kick"]))
+    assert not is_asset_downloaded(folder, "multitrack.zip", stem_filter(categories=["kick", "bass"]))
+    assert not is_asset_downloaded(folder, "multitrack.zip")
+    # The same selection again is only revalidated
+    assert download_asset(url, folder, "multitrack.zip", "Full multitrack", "Song", show_progress=False,
+                          validator_cache=validator_cache, select=drums) == 0
+
+    assert download_asset(url, folder, "multitrack.zip", "Full multitrack", "Song", show_progress=False,
+                          validator_cache=validator_cache) == len(server.static_file("multitrack", "zip"))
+    assert stems_in(folder) == ["01_Kick.wav", "02_Snare.wav", "03_Overheads.wav", "04_Bass.wav", "05_ElecGtr.wav",
+                                "06_Keys.wav", "07_LeadVox.wav", "08_BackingVox.wav"]
+    assert not os.path.exists(os.path.join(folder, SELECTION_FILE))
+    assert is_asset_downloaded(folder, "multitrack.zip", drums)
+    assert download_asset(url, folder, "multitrack.zip", "Full multitrack", "Song", show_progress=False,
+                          validator_cache=validator_cache) == 0
@@ -0,0 +1,64 @@
+import io
+import json
+import os
+import zipfile
+import hashlib
+
+import pytest
+
+import download_dataset
+from download_dataset import stream_download_and_extract
+
+
+def stems_of(body):
+    """Audio stems of a zip as {file name: bytes}."""
+    with zipfile.ZipFile(io.BytesIO(body)) as zip_ref:
+        return {os.path.basename(info.filename): zip_ref.read(info) for info in zip_ref.infolist()
+                if info.filename.endswith(".wav") and "__MACOSX" not in info.filename}
+
+
+def extracted(folder):
+    stem_folder = os.path.join(folder, "Song")
+    files = {}
+    for name in os.listdir(stem_folder):
+        with open(os.path.join(stem_folder, name), "rb") as f:
+            files[name] = f.read()
+    return files
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_broken_stream_resumes_from_the_last_member(mock_server, tmp_path, seed):
+    server = mock_server(reset_rate=0.5, seed=seed)
+    body = server.static_file("multitrack", "zip")
+    digests = {}
+
+    result = stream_download_and_extract(f"{server.url}/files/multitrack.zip", str(tmp_path), show_progress=False,
+                                         digests=digests)
+
+    assert result == (len(body), hashlib.sha256(body).hexdigest())
+    assert extracted(str(tmp_path)) == stems_of(body)
+    assert sorted(os.listdir(tmp_path)) == ["Song"]
+    assert {os.path.basename(path): sha256 for path, sha256 in digests.items()} == {
+        name: hashlib.sha256(data).hexdigest() for name, data in stems_of(body).items()}
+    assert server.stats.requests == server.stats.faults + 1  # One resume per break, no fallback download
+
+
+def test_next_run_resumes_a_stream_that_gave_up(mock_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(download_dataset, "STREAM_RESUMES", 0)
+    server = mock_server(reset_rate=1.0, seed=0)
+    url = f"{server.url}/files/multitrack.zip"
+    body = server.static_file("multitrack", "zip")
+
+    with pytest.raises(Exception, match="rerun to resume"):
+        stream_download_and_extract(url, str(tmp_path), show_progress=False)
+    with open(tmp_path / ".streaming" / ".journal.json") as f:
+        offset = json.load(f)["offset"]
+    assert offset > 0
+
+    server.config.reset_rate = 0.0
+    server.stats.reset()
+    size, sha256 = stream_download_and_extract(url, str(tmp_path), show_progress=False)
+    assert size == len(body) and sha256 is None  # The first run's bytes weren't hashed again
+    assert server.stats.bytes_sent == len(body) - offset  # Only the members after the last checked one
+    assert extracted(str(tmp_path)) == stems_of(body)
+    assert sorted(os.listdir(tmp_path)) == ["Song"]